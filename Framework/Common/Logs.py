@@ -10,6 +10,7 @@ _doc_category = Doc_Category_Default('Common')
 import os
 from pathlib import Path
 import json
+import threading
 from ..Common.Settings import Settings
 from ..Common import Change_Log
 
@@ -25,16 +26,30 @@ class Plugin_Log_class:
       - Optional function which will be called by Print instead
         of doing the normal file write. The function should accept
         one argument, the message string.
+    * num_messages
+      - Int, count of messages printed so far, so callers can tell
+        if some step logged anything.
+    * thread_captures
+      - Dict, keyed by thread id, holding lists that collect messages
+        printed by that thread instead of logging them; see Start_Capture.
     '''
     def __init__(self):
         self.log_file = None
         self.logging_function = None
+        self.num_messages = 0
+        self.thread_captures = {}
 
     def Print(self, line):
         '''
         Write a line to the summary file.
         '''
         line = str(line)
+        self.num_messages += 1
+        # If this thread is capturing messages, hold onto the message.
+        capture = self.thread_captures.get(threading.get_ident())
+        if capture != None:
+            capture.append(line)
+            return
         # If there is a logging_function attached, call it.
         if self.logging_function != None:
             self.logging_function(line)
@@ -48,6 +63,22 @@ class Plugin_Log_class:
         self.log_file.flush()
         return
 
+    def Start_Capture(self):
+        '''
+        Starts collecting messages printed by the current thread, rather
+        than logging them, eg. for work done ahead of time in the
+        background whose messages should be logged when it is used.
+        '''
+        self.thread_captures[threading.get_ident()] = []
+        return
+
+    def End_Capture(self):
+        '''
+        Ends message collection for the current thread, returning the
+        list of messages collected.
+        '''
+        return self.thread_captures.pop(threading.get_ident(), [])
+
     def Close(self):
         'Close the log file safely; the next Print will overwrite it.'
         if self.log_file != None:
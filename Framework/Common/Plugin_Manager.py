@@ -50,6 +50,7 @@ def _Plugin_Wrapper(
         uses_paths_from_settings = True,
         doc_priority = 0,
         shared_docs = None,
+        inputs = None,
     ):
     '''
     Wrapper function for plugins.
@@ -79,6 +80,14 @@ def _Plugin_Wrapper(
       - Printouts will aim to print this once when listing multiple
         plugins with the same shared_doc, or per-plugin when they
         are printed individually.
+    * inputs
+      - Optional string or list of strings, virtual paths or wildcard
+        patterns of files the plugin will load.
+      - Only a hint: when a control script calls this plugin, matching
+        files may be read and patched in the background while earlier
+        plugins run. See File_System.Prefetch_Files.
+      - Leave out broad patterns over large files, eg. all t files,
+        since every match is fully parsed ahead of time.
     '''
     # Make the inner decorator function, capturing the wrapped function.
     def inner_decorator(func):
@@ -97,6 +106,14 @@ def _Plugin_Wrapper(
             func._shared_docs = []
         else:
             func._shared_docs = shared_docs
+
+        # Similar for input hints, lowercased to match virtual paths.
+        if isinstance(inputs, str):
+            func._input_hints = [inputs.lower()]
+        elif inputs == None:
+            func._input_hints = []
+        else:
+            func._input_hints = [x.lower() for x in inputs]
             
 
         if category != None:
@@ -132,6 +149,14 @@ def _Plugin_Wrapper(
             # Note this plugin as having been called.
             plugins_names_run.add(func.__name__)            
 
+            # Start reading any hinted inputs of later plugins in
+            #  the background, now that settings are in place.
+            # Use a delayed import, due to circular imports.
+            if (func._uses_paths_from_settings
+            and Settings.prefetch_transform_inputs):
+                from ..File_Manager import File_System
+                File_System.Start_Prefetch()
+
 
             # Call the plugin function, looking for exceptions.
             # This will be the generally clean fallback when anything
@@ -174,6 +199,49 @@ def _Plugin_Wrapper(
     return inner_decorator
 
 
+def Get_Script_Input_Hints(script_path):
+    '''
+    Returns a list of input hint patterns for plugins called by a
+    control script, in the order the calls appear in the script.
+    Calls are found by name, so plugins called through other names
+    or helper functions are missed. Returns an empty list if the
+    script cannot be parsed.
+
+    * script_path
+      - Path or string, the control script file.
+    '''
+    import ast
+    try:
+        with open(script_path, 'r', encoding = 'utf-8') as file:
+            tree = ast.parse(file.read())
+    except Exception:
+        return []
+
+    hints_by_name = {x.__name__ : x._input_hints for x in plugin_list
+                     if x._input_hints}
+    calls = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        # Handle both "Plugin(...)" and "Module.Plugin(...)".
+        if isinstance(node.func, ast.Name):
+            name = node.func.id
+        elif isinstance(node.func, ast.Attribute):
+            name = node.func.attr
+        else:
+            continue
+        if name in hints_by_name:
+            calls.append(((node.lineno, node.col_offset), name))
+
+    # ast.walk is breadth first, so sort back into script order.
+    hints = []
+    for _, name in sorted(calls):
+        for hint in hints_by_name[name]:
+            if hint not in hints:
+                hints.append(hint)
+    return hints
+
+
 # Wrappers on the wrapper, filling in the plugin_type conveniently.
 def Transform_Wrapper(**kwargs):
     return _Plugin_Wrapper(plugin_type = 'Transform', **kwargs)
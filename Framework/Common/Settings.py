@@ -94,6 +94,77 @@ class Settings_class:
         to verify their md5 hash, no exception will be thrown.
       - Defaults to False; consider setting True if needing to
         unpack incorrectly assembled catalogs.
+    * use_mmap_catalogs
+      - Bool, if True then catalog dat files are memory mapped and kept
+        open while the file system is loaded, instead of being reopened
+        for every file read.
+      - Mappings are released when the file system is reset.
+      - Defaults to True.
+    * use_catalog_index_cache
+      - Bool, if True then parsed catalog contents are saved to a compact
+        binary cache in the customizer "cache" folder, and reused on
+        later runs for catalogs whose size and modification time have
+        not changed.
+      - Defaults to True.
+    * use_folder_walk_cache
+      - Bool, if True then the list of loose files found in the x4 and
+        extension folders is saved to the customizer "cache" folder, and
+        reused on later runs if no folder has been modified (files added,
+        removed, or renamed).
+      - Defaults to True.
+    * use_extension_summary_cache
+      - Bool, if True then details read from extension content.xml files
+        are saved to the customizer "cache" folder, and reused on later
+        runs for extensions whose content.xml and folder have not
+        changed.
+      - Defaults to True.
+    * use_patched_xml_cache
+      - Bool, if True then xml files patched by extensions are saved to
+        the customizer "cache" folder, and reused on later runs when the
+        base file and all patches are unchanged, skipping the patching.
+      - Defaults to True.
+    * patched_xml_cache_size_mb
+      - Int, the size limit in megabytes of the patched xml cache;
+        the least recently used files are removed past this limit.
+      - Defaults to 500.
+    * compress_xml_roots
+      - Bool, if True then the original and patched versions of loaded
+        xml files, when not in regular use, are held zlib compressed.
+      - Saves memory at some cost in load and diff time.
+      - Defaults to True.
+    * fast_xml_parsing
+      - Bool, if True then xml comments are dropped when parsing game
+        files, and very large files or text nodes are allowed.
+      - Comments from source files will then be missing from any
+        fully written (non-diff) output xml.
+      - Defaults to False.
+    * loaded_file_memory_mb
+      - Int, rough memory budget in megabytes for parsed xml of loaded
+        files that are unedited; past this, the least recently loaded
+        are unloaded, to be parsed again if loaded later.
+      - Edited files are always kept.
+      - Defaults to 0, no budget.
+    * text_language_id
+      - Int, id of the language used for text lookups, eg. 44 for
+        english, matching the t/0001-l044.xml file.
+      - Only this language (and the generic t/0001.xml) is read for
+        lookups, a page at a time.
+      - Text lookups raise an error if this language file is not found.
+      - Defaults to 44.
+    * prefetch_transform_inputs
+      - Bool, if True then files hinted as inputs by transforms called
+        in the control script are read and patched in a background
+        thread while earlier transforms run.
+      - Defaults to True.
+    * cat_md5_verification
+      - String, how md5 hashes of files read from cat/dat are verified.
+      - "eager": every read is hashed immediately.
+      - "cached": as eager, but files that passed verification on a prior
+        run (unchanged dat file) are not hashed again.
+      - "background": hashing runs in a background thread pool, and any
+        failures are reported to the plugin log (and raise an error,
+        unless allow_cat_md5_errors is set) before files are written.
+      - Defaults to "eager".
     * ignore_output_extension
       - Bool, if True, the target extension being generated will have
         its prior content ignored (this run works on the original files,
@@ -136,6 +207,16 @@ class Settings_class:
     * generate_sigs
       - Bool, if True then dummy signature files will be created.
       - Defaults to True.
+    * catalog_write_workers
+      - Int, number of threads used to generate file contents and
+        hashes when writing to a catalog (output_to_catalog).
+      - Output is identical regardless of this setting.
+      - Defaults to 1.
+    * gzip_catalog_xml
+      - Bool, if True then xml files written to a catalog
+        (output_to_catalog) are gzipped and stored as ".pck" files,
+        which x4 unzips when loading.
+      - Defaults to False.
     * make_maximal_diffs
       - Bool, if True then generated xml diff patches will do the
         maximum full tree replacement instead of using the algorithm
@@ -389,6 +470,18 @@ class Settings_class:
         defaults['extension_whitelist'] = ''
         defaults['extension_blacklist'] = ''
         defaults['allow_cat_md5_errors'] = False
+        defaults['use_mmap_catalogs'] = True
+        defaults['use_catalog_index_cache'] = True
+        defaults['use_folder_walk_cache'] = True
+        defaults['use_extension_summary_cache'] = True
+        defaults['use_patched_xml_cache'] = True
+        defaults['patched_xml_cache_size_mb'] = 500
+        defaults['compress_xml_roots'] = True
+        defaults['fast_xml_parsing'] = False
+        defaults['loaded_file_memory_mb'] = 0
+        defaults['text_language_id'] = 44
+        defaults['prefetch_transform_inputs'] = True
+        defaults['cat_md5_verification'] = 'eager'
         defaults['ignore_output_extension'] = True
         defaults['X4_exe_name'] = 'X4.exe'
         defaults['root_file_tag'] = '.mod'
@@ -411,6 +504,8 @@ class Settings_class:
         defaults['allow_path_error'] = False
         defaults['output_to_catalog'] = False
         defaults['generate_sigs'] = False
+        defaults['catalog_write_workers'] = 1
+        defaults['gzip_catalog_xml'] = False
         return defaults
 
 
@@ -685,6 +780,18 @@ class Settings_class:
         'Returns the path to the live editor log file.'
         return self.Get_Output_Folder() / self.live_editor_log_file_name
 
+    # Note: this is independent of the user paths, so it is safe
+    # to use before delayed init (eg. from standalone utilities).
+    def Get_Cache_Folder(self):
+        '''
+        Returns the path to the folder holding persistent caches,
+        creating it if needed.
+        '''
+        path = home_path / 'cache'
+        if not path.exists():
+            path.mkdir(parents = True)
+        return path
+
 
 
 # General settings object, to be referenced by any place so interested.
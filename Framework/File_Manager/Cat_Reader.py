@@ -29,15 +29,47 @@ Note on case:
     However, working in pure lowercase is simpler to maintain.
     Here, paths will be handled in lower case generally, but the original
     case will be preserved for lookup when needed.
+
+Note on the index cache:
+    Parsing cat text is a noticeable part of startup when many extensions
+    are present, so parsed catalogs can be saved to a binary cache file
+    (one per cat, in the customizer cache folder) and reloaded on later
+    runs. Cache files record the cat size and modification time, and are
+    rebuilt when either changes.
+    Cache layout: a fixed header, then a newline joined blob of original
+    case paths, a newline joined blob of hash strings, and native int64
+    arrays of file sizes and timestamps. Start offsets are recomputed
+    from the sizes on load.
+
+Note on md5 verification:
+    Hashing every file read is a large part of load time for big files,
+    so Settings.cat_md5_verification selects how reads are checked:
+    - 'eager': hash every read immediately (original behavior).
+    - 'cached': as eager, but files that verified on a prior run (same
+      dat path, size, mtime, and file offset) are trusted without
+      rehashing. Verified files are saved in the customizer cache folder.
+    - 'background': hashing is handed to a thread pool, and any failures
+      are reported to the plugin log before output files are written.
+    Settings.allow_cat_md5_errors still suppresses the exceptions
+    in all modes.
 '''
 from ..Documentation import Doc_Category_Default
 _doc_category = Doc_Category_Default('File_Manager')
 
 from pathlib import Path
+import os
+import json
 import hashlib
+import mmap
+import struct
+import threading
+from array import array
+from itertools import accumulate, chain
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 
-from ..Common import Cat_Hash_Exception, Settings, Print
+from ..Common import Cat_Hash_Exception, Settings, Print, Plugin_Log
 
 # Use a named tuple to track cat entries.
 # Values are integers unless suffixed otherwise.
@@ -46,6 +78,31 @@ Cat_Entry = namedtuple(
     ['cat_path','num_bytes', 'start_byte', 'timestamp', 'hash_str'])
 
 
+# Cache header: magic, format version, cat size, cat mtime (ns),
+# entry count, path blob length, hash blob length.
+_index_cache_header = struct.Struct('<4sHqqIQQ')
+_index_cache_magic = b'X4CI'
+_index_cache_version = 1
+
+# Counts and times for index cache use, for profiling.
+index_cache_stats = {
+    'hits'      : 0,
+    'misses'    : 0,
+    'hit_time'  : 0.0,
+    'miss_time' : 0.0,
+    }
+
+def Get_Index_Cache_Summary():
+    '''
+    Returns a string summarizing catalog index cache hits and misses
+    so far, with their total load times.
+    '''
+    return ('Cat index cache: {} hits ({:.3f} s), {} misses ({:.3f} s)'.format(
+        index_cache_stats['hits'],   index_cache_stats['hit_time'],
+        index_cache_stats['misses'], index_cache_stats['miss_time'],
+        ))
+
+
 def Get_Hash_String(binary):
     '''
     Returns a 128-bit md5 hash as a hex string for the given binary.
@@ -64,6 +121,179 @@ def Get_Hash_String(binary):
     return hash_str
 
 
+def Hash_Matches(binary, cat_hash_str):
+    '''
+    Returns True if the md5 of the given binary matches the hash string
+    recorded in a catalog, else False.
+    '''
+    # Note: egosoft cats are buggy and can have a 0 for the hash
+    # of empty files, so also check that, but keep the normal
+    # check incase proper empty file hashes show up sometimes.
+    if cat_hash_str == Get_Hash_String(binary):
+        return True
+    if not binary and cat_hash_str == '00000000000000000000000000000000':
+        return True
+    return False
+
+
+class Cat_Hash_Verifier_class:
+    '''
+    Handles md5 verification of catalog reads, according to
+    Settings.cat_md5_verification. A single static copy is shared
+    by all Cat_Readers.
+
+    Attributes:
+    * verified_dict
+      - Dict, keyed by dat file path string, holding a list of
+        [dat size, dat mtime (ns), set of verified file start offsets].
+      - Loaded from the cache folder on first use in 'cached' mode.
+    * modified
+      - Bool, True if verified_dict has unsaved additions.
+    * executor
+      - ThreadPoolExecutor for 'background' mode, created as needed.
+    * pending
+      - List of (future, message, allow_error) tuples for background
+        checks not yet collected; futures return True on a hash match.
+    '''
+    cache_file_name = 'cat_md5_verified.json'
+
+    def __init__(self):
+        self.verified_dict = None
+        self.modified = False
+        self.executor = None
+        self.pending = []
+        return
+
+
+    def _Load(self):
+        '''
+        Loads the verified_dict from the cache folder, if not loaded yet.
+        '''
+        if self.verified_dict != None:
+            return
+        self.verified_dict = {}
+        try:
+            with open(Settings.Get_Cache_Folder() / self.cache_file_name, 'r') as file:
+                for dat_path, (size, mtime, offsets) in json.load(file).items():
+                    self.verified_dict[dat_path] = [size, mtime, set(offsets)]
+        except Exception:
+            # Missing or broken cache; start fresh.
+            pass
+        return
+
+
+    def Save(self):
+        '''
+        Saves the verified_dict to the cache folder, if modified.
+        '''
+        if not self.modified:
+            return
+        json_dict = {dat_path: [size, mtime, sorted(offsets)]
+                     for dat_path, (size, mtime, offsets) in self.verified_dict.items()}
+        try:
+            with open(Settings.Get_Cache_Folder() / self.cache_file_name, 'w') as file:
+                json.dump(json_dict, file)
+            self.modified = False
+        except Exception:
+            pass
+        return
+
+
+    def Verify(self, cat_reader, cat_entry, binary, virtual_path, allow_error, policy = None):
+        '''
+        Verifies the binary read for a cat_entry, according to the policy.
+        Raises Cat_Hash_Exception on a failed immediate check unless
+        errors are allowed.
+
+        * cat_reader
+          - Cat_Reader the binary was read from.
+        * cat_entry
+          - Cat_Entry for the binary.
+        * binary
+          - Bytes-like file contents.
+        * virtual_path
+          - String, virtual path, for messages.
+        * allow_error
+          - Bool, if True then failures will not raise exceptions.
+        * policy
+          - Optional string, overrides Settings.cat_md5_verification.
+        '''
+        if policy == None:
+            policy = Settings.cat_md5_verification
+        message = 'File {} in cat {} failed the md5 hash check'.format(
+                    virtual_path, cat_reader.cat_path)
+
+        if policy == 'none':
+            # Caller already trusts this data.
+            return
+
+        if policy == 'background':
+            if self.executor == None:
+                self.executor = ThreadPoolExecutor()
+            # hashlib releases the GIL on large buffers, so this runs
+            # alongside parsing in the main thread.
+            future = self.executor.submit(Hash_Matches, binary, cat_entry.hash_str)
+            self.pending.append((future, message, allow_error))
+            return
+
+        # Look up the prior verification record for this dat, if caching.
+        offsets = None
+        if policy == 'cached':
+            self._Load()
+            dat_path, size, mtime = cat_reader.Get_Dat_Stat()
+            record = self.verified_dict.get(dat_path)
+            if record == None or record[0] != size or record[1] != mtime:
+                record = [size, mtime, set()]
+                self.verified_dict[dat_path] = record
+            offsets = record[2]
+            if cat_entry.start_byte in offsets:
+                return
+
+        if Hash_Matches(binary, cat_entry.hash_str):
+            if offsets != None:
+                offsets.add(cat_entry.start_byte)
+                self.modified = True
+            return
+
+        # Handle the error message.
+        # Prevent the exception based on Settings or the input arg.
+        if not allow_error:
+            raise Cat_Hash_Exception(message)
+        elif Settings.verbose:
+            Print(message)
+        return
+
+
+    def Finish_Background_Checks(self, raise_errors = True):
+        '''
+        Waits for any background hash checks to complete, printing
+        failures to the plugin log. Raises Cat_Hash_Exception if any
+        failure occurred for a read that did not allow errors.
+        Also saves any cached verifications.
+
+        * raise_errors
+          - Bool, if False then failures are only logged.
+        '''
+        error_messages = []
+        for future, message, allow_error in self.pending:
+            if future.result():
+                continue
+            Plugin_Log.Print('Error: ' + message)
+            if not allow_error:
+                error_messages.append(message)
+        self.pending.clear()
+        self.Save()
+
+        if error_messages and raise_errors:
+            raise Cat_Hash_Exception('{} catalog file(s) failed the md5'
+                ' hash check, first: {}'.format(
+                    len(error_messages), error_messages[0]))
+        return
+
+# Static verifier object.
+Cat_Hash_Verifier = Cat_Hash_Verifier_class()
+
+
 class Cat_Reader:
     '''
     Parsed catalog file contents.
@@ -81,22 +311,52 @@ class Cat_Reader:
       - Dict of Cat_Entry objects holding the parsed file information,
         keyed by the virtual path (lower case).
       - A Cat_Entry itself will have an original case path.
+    * use_mmap
+      - Bool, if True then the dat file is memory mapped on the first
+        read and kept mapped until Close is called, instead of being
+        reopened on every read.
+      - Defaults to Settings.use_mmap_catalogs if not given.
+    * dat_file
+      - File object for the open dat file, when using mmap, else None.
+    * dat_mmap
+      - mmap object covering the dat file, when using mmap, else None.
+    * dat_stat
+      - Tuple of (dat path string, size, mtime), filled in on demand
+        by Get_Dat_Stat.
+    * dat_map_lock
+      - Lock guarding creation of the dat mapping.
     '''
-    def __init__(self, cat_path = None):
+    def __init__(self, cat_path = None, use_mmap = None):
         self.cat_path = cat_path
         self.dat_path = cat_path.with_suffix('.dat')
         self.cat_entries = {}
+        self.use_mmap = use_mmap if use_mmap != None else Settings.use_mmap_catalogs
+        self.dat_file = None
+        self.dat_mmap = None
+        self.dat_stat = None
+        self.dat_map_lock = threading.Lock()
 
         # Read the cat. Error if not found.
         if not self.cat_path.exists():
-            raise AssertionError('Error: failed to find cat file at {}'.format(path))
+            raise AssertionError('Error: failed to find cat file at {}'.format(cat_path))
+        cat_stat = self.cat_path.stat()
+        start = time()
+
+        # Try the cache first.
+        if Settings.use_catalog_index_cache and self._Load_Index_Cache(cat_stat):
+            index_cache_stats['hits'] += 1
+            index_cache_stats['hit_time'] += time() - start
+            return
+
         # This can just do a raw text read.
         with open(self.cat_path, 'r') as file:
             text = file.read()
             
-        # Loop over the lines.
-        # Also track a running offset for packed file start locations.
-        dat_start_offset = 0
+        # Loop over the lines, collecting fields in parallel lists.
+        paths      = []
+        sizes      = []
+        timestamps = []
+        hash_strs  = []
         for line in text.splitlines():
 
             # Get the packed file's name and size.
@@ -104,23 +364,176 @@ class Cat_Reader:
             #  separated from the size/time/hash by spaces, so this will need
             #  to only split on the last 3 spaces.
             cat_path, size_str, timestamp_str, hash_str = line.rsplit(' ', 3)
-            num_bytes = int(size_str)
-
-            # Make a new cat entry for it.
-            self.cat_entries[cat_path.lower()] = Cat_Entry(
-                cat_path,
-                num_bytes,
-                dat_start_offset,
-                int(timestamp_str),
-                hash_str,
-                )
-
-            # Advance the offset for the next packed file.
-            dat_start_offset += num_bytes
+            paths     .append(cat_path)
+            sizes     .append(int(size_str))
+            timestamps.append(int(timestamp_str))
+            hash_strs .append(hash_str)
+
+        self._Fill_Entries(paths, sizes, timestamps, hash_strs)
+
+        if Settings.use_catalog_index_cache:
+            self._Save_Index_Cache(cat_stat, paths, sizes, timestamps, hash_strs)
+            index_cache_stats['misses'] += 1
+            index_cache_stats['miss_time'] += time() - start
+        return
+
+
+    def _Fill_Entries(self, paths, sizes, timestamps, hash_strs):
+        '''
+        Fills in cat_entries from parallel lists of cat fields, in
+        cat line order.
+        '''
+        # Packed file start locations are a running sum of prior sizes.
+        start_bytes = chain([0], accumulate(sizes))
+        entries = map(Cat_Entry._make, 
+                      zip(paths, sizes, start_bytes, timestamps, hash_strs))
+        # Later duplicate paths overwrite earlier ones.
+        self.cat_entries = dict(zip([x.lower() for x in paths], entries))
+        return
+
+
+    def _Get_Index_Cache_Path(self):
+        '''
+        Returns the path to the index cache file for this catalog.
+        '''
+        name = hashlib.md5(self.cat_path.resolve().as_posix().encode()).hexdigest()
+        return Settings.Get_Cache_Folder() / 'cat_index' / (name + '.bin')
+
+
+    def _Load_Index_Cache(self, cat_stat):
+        '''
+        Fills in cat_entries from the index cache, if it exists and
+        matches the cat file. Returns True on success, else False.
+        '''
+        try:
+            with open(self._Get_Index_Cache_Path(), 'rb') as file:
+                data = file.read()
+
+            (magic, version, num_bytes, mtime, count, 
+             paths_length, hashes_length) = _index_cache_header.unpack_from(data, 0)
+            if (magic != _index_cache_magic 
+            or version != _index_cache_version
+            or num_bytes != cat_stat.st_size
+            or mtime != cat_stat.st_mtime_ns):
+                return False
+
+            offset = _index_cache_header.size
+            paths = data[offset : offset + paths_length].decode('utf-8').split('\n')
+            offset += paths_length
+            hash_strs = data[offset : offset + hashes_length].decode('utf-8').split('\n')
+            offset += hashes_length
+            sizes = array('q')
+            sizes.frombytes(data[offset : offset + count * 8])
+            offset += count * 8
+            timestamps = array('q')
+            timestamps.frombytes(data[offset : offset + count * 8])
             
+            # Empty cats will split into a single blank string.
+            if count == 0:
+                paths, hash_strs = [], []
+            if not (len(paths) == len(hash_strs) == len(sizes) 
+                    == len(timestamps) == count):
+                return False
+
+        # Any problem (missing file, truncation, etc.) is just a miss.
+        except Exception:
+            return False
+
+        self._Fill_Entries(paths, sizes, timestamps, hash_strs)
+        return True
+
+
+    def _Save_Index_Cache(self, cat_stat, paths, sizes, timestamps, hash_strs):
+        '''
+        Writes the index cache file for this catalog.
+        Failures are ignored, since the cache is optional.
+        '''
+        paths_blob  = '\n'.join(paths).encode('utf-8')
+        hashes_blob = '\n'.join(hash_strs).encode('utf-8')
+        header = _index_cache_header.pack(
+            _index_cache_magic, _index_cache_version,
+            cat_stat.st_size, cat_stat.st_mtime_ns,
+            len(paths), len(paths_blob), len(hashes_blob))
+        try:
+            cache_path = self._Get_Index_Cache_Path()
+            cache_path.parent.mkdir(parents = True, exist_ok = True)
+            # Write to a temp file and swap it in, so a partial write
+            # never looks valid.
+            temp_path = cache_path.with_suffix('.tmp')
+            with open(temp_path, 'wb') as file:
+                file.write(header)
+                file.write(paths_blob)
+                file.write(hashes_blob)
+                file.write(array('q', sizes).tobytes())
+                file.write(array('q', timestamps).tobytes())
+            os.replace(temp_path, cache_path)
+        except Exception:
+            pass
+        return
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
         return
 
 
+    def Close(self):
+        '''
+        Releases the dat file mapping and handle, if open.
+        The reader may still be used afterward, and will reopen
+        the dat file on the next read.
+        '''
+        if self.dat_mmap != None:
+            try:
+                self.dat_mmap.close()
+            except BufferError:
+                # Some returned memoryviews are still alive; drop the
+                # local link and let the mapping close when they
+                # are released.
+                pass
+            self.dat_mmap = None
+        if self.dat_file != None:
+            self.dat_file.close()
+            self.dat_file = None
+        return
+
+
+    def Get_Dat_Stat(self):
+        '''
+        Returns a tuple of (dat path string, size, mtime in ns) for the
+        dat file, used to recognize prior hash verifications.
+        '''
+        if self.dat_stat == None:
+            stat = self.dat_path.stat()
+            self.dat_stat = (self.dat_path.resolve().as_posix(), 
+                             stat.st_size, stat.st_mtime_ns)
+        return self.dat_stat
+
+
+    def _Get_Dat_Map(self):
+        '''
+        Returns the mmap for the dat file, opening it if needed.
+        Returns None if the dat file is empty (which cannot be mapped).
+        '''
+        if self.dat_mmap == None:
+            # Lock, in case of reads from multiple threads (eg. unpacking).
+            with self.dat_map_lock:
+                if self.dat_mmap == None:
+                    dat_file = open(self.dat_path, 'rb')
+                    try:
+                        self.dat_mmap = mmap.mmap(
+                            dat_file.fileno(), 0, access = mmap.ACCESS_READ)
+                    except ValueError:
+                        # Empty file; nothing to map.
+                        dat_file.close()
+                        return None
+                    self.dat_file = dat_file
+        return self.dat_mmap
+
+
     def Get_File_Names(self):
         '''
         Returns a list of virtual names of files in this catalog,
@@ -137,7 +550,14 @@ class Cat_Reader:
         return self.cat_entries
 
             
-    def Read(self, virtual_path, error_if_not_found = False, allow_md5_error = False):
+    def Read(
+            self, 
+            virtual_path, 
+            error_if_not_found = False, 
+            allow_md5_error = False,
+            as_memoryview = False,
+            md5_policy = None,
+        ):
         '''
         Read an entry in the corresponding dat file, based on the
         provided file name (including internal path).
@@ -150,6 +570,15 @@ class Cat_Reader:
         * allow_md5_error
           - Bool, if True then the md5 check will be suppressed and
             errors allowed. May still print a warning message.
+        * as_memoryview
+          - Bool, if True and the dat file is memory mapped, a read-only
+            memoryview slice of the mapping is returned instead of
+            a bytes copy.
+          - The view is only valid until Close is called.
+        * md5_policy
+          - Optional string, one of 'eager', 'cached', 'background', or
+            'none' (no check, for data already trusted),
+            overriding Settings.cat_md5_verification.
         '''
         # Ensure lower case path.
         virtual_path = virtual_path.lower()
@@ -161,38 +590,38 @@ class Cat_Reader:
                     virtual_path, self.cat_path))
             return None
 
-        # For now, open the dat file on every call and close it
-        #  afterwards.  Could also consider leaving this open
-        #  across calls, if many reads are expected, for a speedup.
-        with open(self.dat_path, 'rb') as file:
-            # Move to the file start location.
-            file.seek(self.cat_entries[virtual_path].start_byte)
-            # Grab the byte range.
-            binary = file.read(self.cat_entries[virtual_path].num_bytes)
+        cat_entry = self.cat_entries[virtual_path]
+        start = cat_entry.start_byte
+        end   = start + cat_entry.num_bytes
+
+        # When mmapping, the dat stays mapped across calls, and slices
+        # are taken directly from it.
+        dat_mmap = self._Get_Dat_Map() if self.use_mmap else None
+        if dat_mmap != None:
+            if as_memoryview:
+                binary = memoryview(dat_mmap)[start : end]
+            else:
+                binary = dat_mmap[start : end]
+        elif self.use_mmap:
+            # Empty dat; only empty entries can be present.
+            binary = b''
+        else:
+            # Open the dat file on this call and close it afterwards.
+            with open(self.dat_path, 'rb') as file:
+                # Move to the file start location.
+                file.seek(start)
+                # Grab the byte range.
+                binary = file.read(cat_entry.num_bytes)
 
 
         # Verify the hash.
-        binary_hash_str = Get_Hash_String(binary)
-        cat_hash_str = self.cat_entries[virtual_path].hash_str
-
-        # Note: egosoft cats are buggy and can have a 0 for the hash
-        # of empty files, so also check that, but keep the normal
-        # check incase proper empty file hashes show up sometimes.
-        if (cat_hash_str == binary_hash_str):
-            # Hash match.
-            pass
-        elif not binary and cat_hash_str == '00000000000000000000000000000000':
-            # Alt hash match for empty file.
-            pass
-        else:
-            # Handle the error message.
-            message = 'File {} in cat {} failed the md5 hash check'.format(
-                    virtual_path, self.cat_path)
-            # Prevent the exception based on Settings or the input arg.
-            if not Settings.allow_cat_md5_errors and not allow_md5_error:
-                raise Cat_Hash_Exception(message)
-            elif Settings.verbose:
-                Print(message)
+        Cat_Hash_Verifier.Verify(
+            cat_reader   = self,
+            cat_entry    = cat_entry,
+            binary       = binary,
+            virtual_path = virtual_path,
+            allow_error  = Settings.allow_cat_md5_errors or allow_md5_error,
+            policy       = md5_policy)
 
         return binary
 
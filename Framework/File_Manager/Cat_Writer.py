@@ -12,24 +12,42 @@ Note on newlines:
     matching ego results as a potentential fix for some users complaining
     about the extension not loading.)
     X Tools does not add newlines between text files.
+
+Note on gzip:
+    X4 accepts gzipped files in catalogs under a ".pck" extension in
+    place of the original (eg. "md/script.pck" for "md/script.xml").
+    Writes can optionally compress xml files this way, which shrinks
+    output catalogs considerably.
+
+Note on memory use:
+    The dat is streamed to a temporary file as each game file's binary
+    is generated, with its md5 hash taken at the same time, so only one
+    file's contents need be held at once. The temporary files are
+    renamed into place when complete (dat first, then cat), so an
+    interrupted write never leaves a cat pointing at a partial dat.
 '''
 from ..Documentation import Doc_Category_Default
 _doc_category = Doc_Category_Default('File_Manager')
 
+import os
+import io
 import gzip
 import time
 import hashlib
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .File_Types import Game_File, Signature_File, Machine_Code_File
 from .File_Types import Generate_Signatures
 from .Cat_Reader import Get_Hash_String
+from .Source_Reader_Local import Get_Pck_Path
 from ..Common import Print
 
 
 class Cat_Writer:
     '''
     Support class for collecting modified files into a single catalog.
-    Initial functionality will not gzip the files.
+    Files are written uncompressed unless gzip is requested.
 
     Attributes:
     * cat_path
@@ -39,28 +57,56 @@ class Cat_Writer:
       - Set automatically to match the cat_path index.
     * game_files
       - List of Game_File objects to be written.
+    * timestamp_dict
+      - Dict, keyed by virtual_path, of integer timestamps to record
+        for specific files instead of the write time.
+    * reuse_dict
+      - Dict, keyed by virtual_path, of (Cat_Reader, Cat_Entry) tuples
+        for files whose contents are copied from an existing catalog
+        instead of being generated.
     '''
     def __init__(self, cat_path):
         # Ensure this is a Path.
         self.cat_path = Path(cat_path)
         self.dat_path = self.cat_path.with_suffix('.dat')
         self.game_files = []
+        self.timestamp_dict = {}
+        self.reuse_dict = {}
         return
 
 
-    def Add_File(self, game_file):
+    def Add_File(self, game_file, timestamp = None, reuse_entry = None):
         '''
         Add a Game_File to be recorded into the catalog.
         Machine_Code_File will be rejected.
+
+        * timestamp
+          - Int, optional, timestamp to record in the cat for this file.
+          - Defaults to the time of writing.
+        * reuse_entry
+          - Optional tuple of (Cat_Reader, Cat_Entry) for an existing
+            catalog entry known to hold this file's contents.
+          - The bytes, hash, and timestamp are copied from that entry
+            without regenerating or rehashing the file.
         '''
         assert isinstance(game_file, Game_File)
         if isinstance(game_file, Machine_Code_File):
             Print('Cat_Writer ignoring Machine_Code_File {}'.format(game_file.virtual_path))
             return
         self.game_files.append(game_file)
+        if timestamp != None:
+            self.timestamp_dict[game_file.virtual_path] = timestamp
+        if reuse_entry != None:
+            self.reuse_dict[game_file.virtual_path] = reuse_entry
 
 
-    def Write(self, generate_sigs = False, separate_sigs = False):
+    def Write(
+            self, 
+            generate_sigs = False, 
+            separate_sigs = False, 
+            num_workers = 1,
+            gzip_xml = False,
+        ):
         '''
         Write the contents to a cat/dat file pair.
         Any existing files will be overwritten.
@@ -71,82 +117,211 @@ class Cat_Writer:
           - Bool, if True then any signatures will be moved to a second
             cat/dat pair suffixed with .sig. This may result in an
             empty dat.
+        * num_workers
+          - Int, number of threads preparing file binaries and hashes.
+          - Defaults to 1, preparing each file in turn.
+          - If None, uses the python thread pool default.
+          - Output is identical regardless of worker count; files are
+            always written in the order they were added.
+        * gzip_xml
+          - Bool, if True then xml files are gzipped and stored with
+            a ".pck" extension in place of ".xml".
+          - Reused entries are copied as they were.
         '''
         # Handle signature generation first.
-        game_files = self.game_files
+        # Note: these are not added back to self.game_files, so that
+        #  repeated writes do not accumulate them.
+        game_files = list(self.game_files)
         if generate_sigs:
             game_files += Generate_Signatures(self.game_files)
 
+        # Get the current time since epoch, as an integer, then
+        #  swap to a string (normal base 10).
+        timestamp = str(int(time.time()))
 
-        # Requires up to two passes, if separating sigs.
-        if separate_sigs:
-            modes = ['std','sig']
-        else:
-            modes = ['all']
+        def Prepare_Payload(game_file):
+            '''
+            Returns a tuple of (cat path, binary, timestamp string,
+            hash string) for the game_file.
+            '''
+            # Copy reused entries straight over from their old dat.
+            virtual_path = game_file.virtual_path
+            if virtual_path in self.reuse_dict:
+                cat_reader, cat_entry = self.reuse_dict[virtual_path]
+                binary = cat_reader.Read(cat_entry.cat_path, md5_policy = 'none')
+                return (virtual_path, binary, 
+                        str(cat_entry.timestamp), cat_entry.hash_str)
 
-        for mode in modes:
+            # Get the binary data; any text should be utf-8.
+            binary = game_file.Get_Binary(for_cat = True)
 
-            # Cat contents will be kept as a list of strings.
-            # Dat contents will be running binary.
-            cat_lines = []
-            dat_binary = bytearray()
+            # Swap xml for a zipped pck, if requested.
+            cat_path = virtual_path
+            if gzip_xml and virtual_path.endswith('.xml'):
+                cat_path = Get_Pck_Path(virtual_path)
+                binary = Compress_Pck(binary)
 
-            # Get the current time since epoch, as an integer, then
-            #  swap to a string (normal base 10).
-            timestamp = str(int(time.time()))
+            return (cat_path, binary, 
+                    str(self.timestamp_dict.get(virtual_path, timestamp)),
+                    Get_Hash_String(binary))
 
-            # Collect info from the files.
+        # Output streams per cat/dat pair, keyed by mode.
+        streams = {}
+        try:
+            # Signature files go to a second pair, suffixed with .sig.
+            # Streams open their temp dat right away, so add them one at
+            # a time; if a later one fails to open, the earlier ones are
+            # aborted below.
+            if separate_sigs:
+                streams['std'] = _Cat_Stream(self.cat_path, self.dat_path)
+                streams['sig'] = _Cat_Stream(
+                    self.cat_path.parent / (self.cat_path.name + '.sig'),
+                    self.dat_path.parent / (self.dat_path.name + '.sig'))
+            else:
+                streams['all'] = _Cat_Stream(self.cat_path, self.dat_path)
+
+            # Collect info from the files, getting each binary once.
             # Note: this may generate nothing if no game files were added,
             #  eg. when making dummy catalogs.
-            for game_file in self.game_files:
-
-                # If just wanting standard or sig files, filter the
-                # others out.
-                if mode == 'std' and isinstance(game_file, Signature_File):
-                    continue
-                if mode == 'sig' and not isinstance(game_file, Signature_File):
-                    continue
-
-                # Get the binary data; any text should be utf-8.
-                this_binary = game_file.Get_Binary(for_cat = True)
-                x = bytes(this_binary)
-
-                # Append to the existing dat binary.
-                dat_binary += this_binary
-
-                # Get the hash.
-                hash_str = Get_Hash_String(this_binary)
-
-                # Add the cat entry line.
-                cat_lines.append( ' '.join([
-                    game_file.virtual_path,
-                    str(len(this_binary)),
-                    timestamp,
-                    hash_str,
-                    ]))
-
-
-            # The cat needs to end in a newline.
-            cat_lines.append('')
-
-            # Convert the cat to utf-8 binary.
-            # Note: x4 cats appear to use unix newlines, which this bytes()
-            # method will match.
-            cat_str = '\n'.join(cat_lines)
-            cat_binary = bytes(cat_str, encoding = 'utf-8')
-        
-            # Append a .sig to the names for signature files.
-            if mode == 'sig':
-                cat_path = self.cat_path.parent / (self.cat_path.name + '.sig')
-                dat_path = self.dat_path.parent / (self.dat_path.name + '.sig')
-            else:
-                cat_path = self.cat_path
-                dat_path = self.dat_path
+            for game_file, (cat_path, this_binary, this_timestamp, hash_str) in zip(
+                    game_files,
+                    _Ordered_Map(Prepare_Payload, game_files, num_workers)):
+
+                # Pick the stream this file goes to.
+                if not separate_sigs:
+                    mode = 'all'
+                elif isinstance(game_file, Signature_File):
+                    mode = 'sig'
+                else:
+                    mode = 'std'
+
+                streams[mode].Add(cat_path, this_binary, 
+                                  this_timestamp, hash_str = hash_str)
+                # Drop the binary before collecting the next.
+                this_binary = None
+
+            # Move the completed files into place.
+            for stream in streams.values():
+                stream.Finish()
+
+        except BaseException:
+            # Clean up temp files, leaving any prior output untouched.
+            for stream in streams.values():
+                stream.Abort()
+            raise
+        return
+
+
+def Compress_Pck(binary):
+    '''
+    Returns the gzipped form of the binary, for storing as a pck file.
+    The gzip header timestamp is zeroed, so output is repeatable.
+    '''
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj = buffer, mode = 'wb', mtime = 0) as file:
+        file.write(binary)
+    return buffer.getvalue()
+
+
+def _Ordered_Map(function, items, num_workers = 1):
+    '''
+    Generator which applies the function to the items, yielding the
+    results in item order. With more than one worker, items are
+    processed by a thread pool, with a limited number run ahead of
+    the one being yielded to bound memory use.
+    '''
+    if num_workers == 1:
+        for item in items:
+            yield function(item)
+        return
+
+    # Match the ThreadPoolExecutor default when not given.
+    if num_workers == None:
+        num_workers = min(32, (os.cpu_count() or 1) + 4)
+    max_pending = num_workers * 2
+
+    with ThreadPoolExecutor(max_workers = num_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    return
+
 
-            # Write the data out.
-            with open(cat_path, 'wb') as file:
-                file.write(cat_binary)
-            with open(dat_path, 'wb') as file:
-                file.write(dat_binary)
+class _Cat_Stream:
+    '''
+    Incrementally writes one cat/dat pair, using temporary files
+    that are moved into place by Finish.
+
+    Attributes:
+    * cat_path
+    * dat_path
+      - Paths, the final cat and dat locations.
+    * temp_cat_path
+    * temp_dat_path
+      - Paths, where contents are written until finished.
+    * dat_file
+      - Open file handle for the temp dat.
+    * cat_lines
+      - List of strings, cat lines recorded so far.
+    '''
+    def __init__(self, cat_path, dat_path):
+        self.cat_path = cat_path
+        self.dat_path = dat_path
+        self.temp_cat_path = cat_path.parent / (cat_path.name + '.tmp')
+        self.temp_dat_path = dat_path.parent / (dat_path.name + '.tmp')
+        self.dat_file = open(self.temp_dat_path, 'wb')
+        self.cat_lines = []
+        return
+
+
+    def Add(self, virtual_path, binary, timestamp, hash_str = None):
+        '''
+        Appends a file binary to the dat, and records its cat line.
+        If hash_str is given, it is used instead of hashing the binary.
+        '''
+        self.dat_file.write(binary)
+        if hash_str == None:
+            hash_str = Get_Hash_String(binary)
 
+        # Add the cat entry line.
+        self.cat_lines.append( ' '.join([
+            virtual_path,
+            str(len(binary)),
+            timestamp,
+            hash_str,
+            ]))
+        return
+
+
+    def Finish(self):
+        '''
+        Writes the cat, and moves the cat and dat into their final places.
+        '''
+        self.dat_file.close()
+
+        # The cat needs to end in a newline.
+        # Note: x4 cats appear to use unix newlines, which this bytes()
+        # method will match.
+        cat_str = '\n'.join(self.cat_lines + [''])
+        with open(self.temp_cat_path, 'wb') as file:
+            file.write(bytes(cat_str, encoding = 'utf-8'))
+
+        # Dat goes first, so the cat is never ahead of it.
+        os.replace(self.temp_dat_path, self.dat_path)
+        os.replace(self.temp_cat_path, self.cat_path)
+        return
+
+
+    def Abort(self):
+        '''
+        Closes and removes any temp files.
+        '''
+        self.dat_file.close()
+        for path in [self.temp_dat_path, self.temp_cat_path]:
+            if path.exists():
+                path.unlink()
         return
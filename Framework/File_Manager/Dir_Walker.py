@@ -0,0 +1,178 @@
+'''
+Shared directory walking, built on os.scandir.
+
+Note on speed:
+    Path.glob('**/*') followed by is_file() calls does a separate stat
+    per entry. os.scandir returns the file type with the directory
+    listing, and on windows the size and modification time as well,
+    so walking through DirEntry objects avoids most of those stats.
+
+Note on snapshots:
+    A walk can optionally be saved to the customizer cache folder,
+    recording every visited folder's modification time. A folder's
+    mtime changes whenever an entry directly in it is added, removed,
+    or renamed, so if every recorded folder still has its old mtime,
+    the set of files is unchanged and the saved list is reused without
+    listing anything.
+    File sizes and times in a reused snapshot are as of when it was
+    taken; edits to a file's contents in place do not change its
+    folder, so callers needing current sizes/times should stat files
+    themselves.
+'''
+from ..Documentation import Doc_Category_Default
+_doc_category = Doc_Category_Default('File_Manager')
+
+import os
+import json
+import hashlib
+from pathlib import Path
+from collections import namedtuple
+
+from ..Common import Settings
+
+
+# Folder names never walked into, eg. version control data.
+pruned_folder_names = {'.git', '.svn', '.hg', '__pycache__'}
+
+# Version of the snapshot file format; bump on changes.
+_snapshot_version = 1
+
+
+# Record of a found file.
+# * rel_path
+#   - String, path relative to the walk root, posix style, original case.
+# * size
+#   - Int, file size in bytes.
+# * mtime_ns
+#   - Int, file modification time in nanoseconds.
+File_Record = namedtuple('File_Record', ['rel_path', 'size', 'mtime_ns'])
+
+
+def Walk_Files(root, top_folders = None, use_snapshot = False):
+    '''
+    Returns a list of File_Record for all files under the root folder,
+    skipping folders in pruned_folder_names.
+    If the root does not exist, returns an empty list.
+
+    * root
+      - Path or string, the folder to walk.
+    * top_folders
+      - Optional set of lowercase folder names; if given, only these
+        folders directly under the root are walked into.
+      - Files directly in the root are always returned.
+    * use_snapshot
+      - Bool, if True then the walk result is saved to the cache folder,
+        and reused on later calls if no walked folder has changed.
+    '''
+    root = str(root)
+    if not os.path.isdir(root):
+        return []
+
+    if use_snapshot:
+        snapshot_path = _Get_Snapshot_Path(root, top_folders)
+        records = _Load_Snapshot(snapshot_path, root)
+        if records != None:
+            return records
+
+    records = []
+    # Folder mtimes, keyed by relative path ('' for the root).
+    folder_mtimes = {}
+
+    # Walk with an explicit stack of (abs path, relative prefix).
+    stack = [(root, '')]
+    while stack:
+        folder_path, rel_prefix = stack.pop()
+        try:
+            folder_mtimes[rel_prefix] = os.stat(folder_path).st_mtime_ns
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    # Note: is_dir/is_file follow symlinks, same as glob.
+                    if entry.is_dir():
+                        if entry.name in pruned_folder_names:
+                            continue
+                        if (not rel_prefix and top_folders != None
+                        and entry.name.lower() not in top_folders):
+                            continue
+                        stack.append((entry.path, rel_prefix + entry.name + '/'))
+
+                    elif entry.is_file():
+                        # On windows this stat is cached from the listing.
+                        stat = entry.stat()
+                        records.append(File_Record(
+                            rel_prefix + entry.name,
+                            stat.st_size,
+                            stat.st_mtime_ns))
+
+        # Skip unreadable folders, as glob would.
+        except OSError:
+            continue
+
+    if use_snapshot:
+        _Save_Snapshot(snapshot_path, root, folder_mtimes, records)
+    return records
+
+
+def List_Folder(folder):
+    '''
+    Returns a dict of the entries directly in a folder, keyed by name
+    normalized for the os (lowercase on windows), holding os.DirEntry
+    objects. Returns an empty dict if the folder cannot be listed.
+    '''
+    try:
+        with os.scandir(str(folder)) as entries:
+            return {os.path.normcase(x.name) : x for x in entries}
+    except OSError:
+        return {}
+
+
+def _Get_Snapshot_Path(root, top_folders):
+    '''
+    Returns the cache path for a walk's snapshot, which depends on the
+    root and any top folder filter.
+    '''
+    key = Path(root).resolve().as_posix()
+    if top_folders != None:
+        key += '|' + ','.join(sorted(top_folders))
+    name = hashlib.md5(key.encode()).hexdigest()
+    return Settings.Get_Cache_Folder() / 'folder_walks' / (name + '.json')
+
+
+def _Load_Snapshot(snapshot_path, root):
+    '''
+    Returns the records saved in a snapshot if every recorded folder
+    is unchanged, else None.
+    '''
+    try:
+        with open(snapshot_path, 'r') as file:
+            data = json.load(file)
+        if data['version'] != _snapshot_version:
+            return None
+        for rel_folder, mtime in data['folders'].items():
+            if os.stat(os.path.join(root, rel_folder)).st_mtime_ns != mtime:
+                return None
+        return [File_Record(*x) for x in data['files']]
+
+    # Any problem (missing file, removed folder, etc.) is just a miss.
+    except Exception:
+        return None
+
+
+def _Save_Snapshot(snapshot_path, root, folder_mtimes, records):
+    '''
+    Writes a walk snapshot. Failures are ignored, since it is optional.
+    '''
+    try:
+        snapshot_path.parent.mkdir(parents = True, exist_ok = True)
+        # Write to a temp file and swap it in, so a partial write
+        # never looks valid.
+        temp_path = snapshot_path.with_suffix('.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump({
+                'version' : _snapshot_version,
+                'folders' : folder_mtimes,
+                'files'   : [list(x) for x in records],
+                }, file)
+        os.replace(temp_path, snapshot_path)
+    except Exception:
+        pass
+    return
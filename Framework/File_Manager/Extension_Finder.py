@@ -2,8 +2,10 @@
 from ..Documentation import Doc_Category_Default
 _doc_category = Doc_Category_Default('File_Manager')
 
+import json
 from lxml import etree as ET
 from ..Common import Settings, Print
+from .Dir_Walker import List_Folder
 
 '''
 Notes on duplicated extension IDs:
@@ -19,6 +21,10 @@ Notes on duplicated extension IDs:
        in the UI.
 '''
 
+# Attributes saved in summary caches, for use without the parsed xml.
+_cached_attributes = ['name', 'version', 'author', 'date', 'description', 'save']
+
+
 class Extension_Summary:
     '''
     Class to summarize a found extension, and some picked out details.
@@ -29,6 +35,14 @@ class Extension_Summary:
     * content_xml
       - XML Element holding the contents of content.xml, used in some
         misc lookup methods.
+      - Parsed on first access, so summaries built from cached data
+        need not read the file.
+    * summary_data
+      - Dict holding the details picked out of content.xml, suitable
+        for saving to json: 'id', 'enabled', 'soft_dependencies',
+        'hard_dependencies', 'attributes' (dict of common attribute
+        values, None if missing), and 'catalog_names' (list of cat
+        file names in the extension folder).
     * extension_name
       - String, name of the containing folder, lowercase.
       - Should be unique across extensions.
@@ -56,33 +70,63 @@ class Extension_Summary:
         has a soft (non-error if missing) dependency on.
     * hard_dependencies
       - As above, but dependencies that will throw an error if missing.
+    * catalog_names
+      - List of names of the cat files in the extension folder.
     '''
     def __init__(
             self, 
             content_xml_path,
+            summary_data = None,
         ):
-        
+        '''
+        * summary_data
+          - Optional dict of prior summary_data for this content.xml,
+            used instead of parsing the file.
+        '''
         self.extension_name = content_xml_path.parent.name.lower()
         self.content_xml_path = content_xml_path
         self.is_current_output = False
+        self._content_xml = None
 
-        # Load it and pick out the id.
-        self.content_xml = ET.parse(str(content_xml_path)).getroot()
-        self.ext_id = self.content_xml.get('id')
+        # Load it and pick out the details, if not given.
+        if summary_data == None:
+            summary_data = self._Parse_Summary_Data()
+        self.summary_data = summary_data
 
+        self.ext_id = summary_data['id']
         # If id was missing, give a default.
         if self.ext_id == None:
             self.ext_id = '*undefined*'
             Print(('Warning: blank extension id found in folder {}; setting'
                    ' as *undefined*.').format(content_xml_path.parent.name))
 
+        self.default_enabled = summary_data['enabled']
+        self.enabled = self.default_enabled
+        self.ignore = False
+        self.soft_dependencies = summary_data['soft_dependencies']
+        self.hard_dependencies = summary_data['hard_dependencies']
+        self.catalog_names     = summary_data['catalog_names']
+        self.display_name = self.Get_Attribute('name')
+        return
+
+
+    @property
+    def content_xml(self):
+        if self._content_xml == None:
+            self._content_xml = ET.parse(str(self.content_xml_path)).getroot()
+        return self._content_xml
+
+
+    def _Parse_Summary_Data(self):
+        '''
+        Parses the content.xml, returning a dict of summary_data.
+        '''
+        ext_id = self.content_xml.get('id')
+
         # Determine if this is enabled or disabled.
         # Apparently a mod can use '1' for this instead of
         # 'true', so try both.
-        # TODO: move this into the ext_summary constructor.
-        self.default_enabled =  self.content_xml.get('enabled', 'true').lower() in ['true','1']
-        self.enabled = self.default_enabled
-        self.ignore = False
+        default_enabled =  self.content_xml.get('enabled', 'true').lower() in ['true','1']
                 
         # Collect all the names of dependencies.
         # Lowercase these to standardize name checks.
@@ -91,14 +135,26 @@ class Extension_Summary:
                         for x in self.content_xml.xpath('dependency')
                         if x.get('id') != None]
         # Collect optional dependencies.
-        self.soft_dependencies = [x.get('id') 
+        soft_dependencies = [x.get('id') 
                         for x in self.content_xml.xpath('dependency[@optional="true"]')]
         # Pick out hard dependencies (those not optional).
-        self.hard_dependencies = [x for x in dependencies
-                                    if x not in self.soft_dependencies ]
+        hard_dependencies = [x for x in dependencies
+                                if x not in soft_dependencies ]
 
-        self.display_name = self.Get_Attribute('name')
-        return
+        # Note the catalogs alongside the content.xml.
+        catalog_names = sorted(
+            entry.name for name, entry in List_Folder(self.content_xml_path.parent).items()
+            if name.endswith('.cat') and entry.is_file())
+
+        return {
+            'id'                : ext_id,
+            'enabled'           : default_enabled,
+            'soft_dependencies' : soft_dependencies,
+            'hard_dependencies' : hard_dependencies,
+            'attributes'        : {x : self._Find_Attribute(x) 
+                                   for x in _cached_attributes},
+            'catalog_names'     : catalog_names,
+            }
 
 
     def Get_Attribute(self, attribute, default = ''):
@@ -107,12 +163,24 @@ class Extension_Summary:
         This will search the language node first, then the root node.
         If not found, returns an empty string.
         '''
+        # Common attributes are already summarized.
+        attributes = self.summary_data['attributes']
+        if attribute in attributes:
+            value = attributes[attribute]
+        else:
+            value = self._Find_Attribute(attribute)
+        return default if value == None else value
+
+
+    def _Find_Attribute(self, attribute):
+        '''
+        Returns the string value of an attribute from the content_xml,
+        or None if not found.
+        '''
         node = self.content_xml.find('text[@language="44"][@{}]'.format(attribute))
         if node != None:
-            value = node.get(attribute, default)
-        else:
-            value = self.content_xml.get(attribute, default)
-        return value
+            return node.get(attribute)
+        return self.content_xml.get(attribute)
     
 
     def Get_Bool_Attribute(self, attribute, default = True):
@@ -133,6 +201,99 @@ class Extension_Summary:
             return default
 
 
+class Extension_Summary_Cache_class:
+    '''
+    Persistent cache of Extension_Summary data, so that unchanged
+    extensions need not have their content.xml parsed on every search.
+    Entries are matched on the content.xml size and modification time,
+    and the extension folder modification time (which changes when cat
+    files are added or removed).
+
+    Attributes:
+    * entry_dict
+      - Dict, keyed by content.xml path string, holding a list of
+        [xml size, xml mtime (ns), folder mtime (ns), summary_data].
+      - Loaded from the cache folder on first use.
+    * modified
+      - Bool, True if entry_dict has unsaved changes.
+    '''
+    cache_file_name = 'extension_summaries.json'
+
+    def __init__(self):
+        self.entry_dict = None
+        self.modified = False
+        return
+
+
+    def _Load(self):
+        '''
+        Loads the entry_dict from the cache folder, if not loaded yet.
+        '''
+        if self.entry_dict != None:
+            return
+        self.entry_dict = {}
+        try:
+            with open(Settings.Get_Cache_Folder() / self.cache_file_name, 'r') as file:
+                self.entry_dict = json.load(file)
+        except Exception:
+            # Missing or broken cache; start fresh.
+            pass
+        return
+
+
+    def Save(self, keep_paths = None):
+        '''
+        Saves the entry_dict to the cache folder, if modified.
+
+        * keep_paths
+          - Optional set of content.xml path strings; other entries are
+            dropped first, so removed extensions do not linger.
+        '''
+        if self.entry_dict == None:
+            return
+        if keep_paths != None:
+            for path in list(self.entry_dict):
+                if path not in keep_paths:
+                    del self.entry_dict[path]
+                    self.modified = True
+        if not self.modified:
+            return
+        try:
+            with open(Settings.Get_Cache_Folder() / self.cache_file_name, 'w') as file:
+                json.dump(self.entry_dict, file)
+            self.modified = False
+        except Exception:
+            pass
+        return
+
+
+    def Get_Summary(self, content_xml_path):
+        '''
+        Returns an Extension_Summary for the content.xml path, reusing
+        cached data if the files are unchanged.
+        '''
+        if not Settings.use_extension_summary_cache:
+            return Extension_Summary(content_xml_path)
+        self._Load()
+
+        key = str(content_xml_path)
+        xml_stat = content_xml_path.stat()
+        stamp = [xml_stat.st_size, xml_stat.st_mtime_ns, 
+                 content_xml_path.parent.stat().st_mtime_ns]
+
+        entry = self.entry_dict.get(key)
+        if entry != None and entry[:3] == stamp:
+            return Extension_Summary(content_xml_path, summary_data = entry[3])
+
+        ext_summary = Extension_Summary(content_xml_path)
+        self.entry_dict[key] = stamp + [ext_summary.summary_data]
+        self.modified = True
+        return ext_summary
+
+# Static copy of the cache, shared across searches.
+Extension_Summary_Cache = Extension_Summary_Cache_class()
+
+
 def Find_Extensions():
     '''
     Returns a list of Extension_Summary objects, representing all
@@ -170,6 +331,9 @@ def Find_Extensions():
     # can cause problems.
     ext_ids_found = set()
 
+    # Note content.xml paths found, to drop cache entries for others.
+    found_paths = set()
+
     # Find where these extensions are located, and record details.
     # Could be in documents or x4 directory.
     for base_path in [Settings.Get_X4_Folder(), Settings.Get_User_Folder()]:
@@ -179,10 +343,19 @@ def Find_Extensions():
         if not extensions_path.exists():
             continue
 
-        # Use glob to pick out all of the extension content.xml files.
-        for content_xml_path in extensions_path.glob('*/content.xml'):
+        # Pick out all of the extension content.xml files, checking only
+        #  the extension folders rather than globbing.
+        # Sort by name, so the order is the same across systems.
+        for folder_entry in sorted(List_Folder(extensions_path).values(),
+                                   key = lambda x: x.name):
+            if not folder_entry.is_dir():
+                continue
+            content_xml_path = extensions_path / folder_entry.name / 'content.xml'
+            if not content_xml_path.is_file():
+                continue
 
-            ext_summary = Extension_Summary(content_xml_path)
+            ext_summary = Extension_Summary_Cache.Get_Summary(content_xml_path)
+            found_paths.add(str(content_xml_path))
             ext_summary_list.append(ext_summary)
             ext_id = ext_summary.ext_id
 
@@ -241,6 +414,8 @@ def Find_Extensions():
                 ext_summary.ignore = True
 
 
-                        
+
+    # Keep any newly parsed summaries for next time.
+    Extension_Summary_Cache.Save(keep_paths = found_paths)
     return ext_summary_list
                 
@@ -5,17 +5,25 @@ _doc_category = Doc_Category_Default('File_Manager')
     
 from pathlib import Path
 import datetime
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from lxml import etree as ET
 from functools import wraps
 import fnmatch
 from time import time
+from multiprocessing import Pool, cpu_count
+import threading
+import itertools
+from collections import deque
 import re
+from io import BytesIO
 
 from .Source_Reader import Source_Reader_class
 from .Cat_Writer import Cat_Writer
+from .Cat_Reader import Cat_Hash_Verifier
 from .File_Types import Misc_File, XML_File, Signature_File, Machine_Code_File
+from .File_Types import Game_File
 from .File_Types import Generate_Signatures
+from .Text_Table import Text_Table
 from ..Common import Settings
 from ..Common import File_Missing_Exception
 from ..Common import Customizer_Log_class
@@ -58,6 +66,45 @@ class File_System_class:
     * _patterns_loaded
       - Set of strings, virtual path name patterns that have been
         loaded and, when macros, added to class_macro_dict.
+    * read_lock
+      - RLock, held while using the source_reader to read files, so
+        that main thread loads and prefetch thread reads take turns.
+    * prefetch_patterns
+      - List of strings, virtual path patterns queued for prefetch,
+        to be read once Start_Prefetch is called.
+    * prefetched
+      - Dict, keyed by virtual path, holding tuples of (Game_File, list
+        of Plugin_Log messages) for files read by the prefetch thread
+        but not yet loaded.
+    * _prefetch_queue
+      - Deque of virtual paths waiting for the prefetch thread.
+    * _prefetch_thread
+      - Thread reading files in the background, or None.
+    * _prefetch_stop
+      - Bool, set to ask the prefetch thread to stop early.
+    * loaded_roots
+      - OrderedDict, keyed by virtual path, holding the estimated memory
+        of unedited xml files with parsed roots, least recently loaded
+        first. Only filled when Settings.loaded_file_memory_mb is set.
+    * loaded_bytes
+      - Int, sum of the estimates in loaded_roots.
+    * unloaded_paths
+      - Set of virtual paths of files unloaded to stay in budget.
+    * num_unloads
+    * num_reloads
+      - Ints, counts of files unloaded, and unloaded files loaded again.
+    * modified_paths
+      - Set of virtual paths of loaded files flagged as modified.
+    * extension_paths
+      - Dict, keyed by extension name, holding sets of virtual paths of
+        loaded files the extension contributed to.
+    * load_order
+      - Dict, keyed by virtual path, holding an int giving the order
+        files were added in, to return indexed files in the same order
+        as game_file_dict.
+    * text_tables
+      - Dict, keyed by virtual path, holding Text_Tables of t files
+        used by Read_Text but not loaded.
     '''
     def __init__(self):
         self.game_file_dict = {}
@@ -69,7 +116,22 @@ class File_System_class:
         self.asset_class_dict = defaultdict(lambda: defaultdict(list))
         self.asset_name_dict = {}
         self._patterns_loaded = set()
-
+        self.read_lock = threading.RLock()
+        self.prefetch_patterns = []
+        self.prefetched = {}
+        self._prefetch_queue = deque()
+        self._prefetch_thread = None
+        self._prefetch_stop = False
+        self.loaded_roots = OrderedDict()
+        self.loaded_bytes = 0
+        self.unloaded_paths = set()
+        self.num_unloads = 0
+        self.num_reloads = 0
+        self.modified_paths = set()
+        self.extension_paths = defaultdict(set)
+        self.load_order = {}
+        self._load_counter = itertools.count()
+        self.text_tables = {}
         return
     
 
@@ -120,9 +182,24 @@ class File_System_class:
         This will also reset the Live_Editor, since it is out of date.
         '''
         self.game_file_dict.clear()
+        self.modified_paths.clear()
+        self.extension_paths.clear()
+        self.load_order.clear()
         self.asset_class_dict.clear()
         self.asset_name_dict.clear()
         self._patterns_loaded.clear()
+        self.text_tables.clear()
+        # Stop any background reads before dropping the reader.
+        self.Stop_Prefetch()
+        self.prefetch_patterns.clear()
+        self.Print_Memory_Stats()
+        self.loaded_roots.clear()
+        self.loaded_bytes = 0
+        self.unloaded_paths.clear()
+        self.num_unloads = 0
+        self.num_reloads = 0
+        # Release any mapped catalog files before dropping the reader.
+        self.source_reader.Close()
         # Pending a reset option for these, just recreate the objects.
         self.old_log = Customizer_Log_class()
         self.source_reader = Source_Reader_class()
@@ -154,7 +231,19 @@ class File_System_class:
         Record a new a Game_File object, keyed by its virtual path.
         Returns the game_file, for convenience.
         '''
-        self.game_file_dict[game_file.virtual_path] = game_file
+        virtual_path = game_file.virtual_path
+        # Clear indexes of any file being replaced.
+        old_file = self.game_file_dict.get(virtual_path)
+        if old_file != None:
+            self._Unindex_File(old_file)
+        else:
+            self.load_order[virtual_path] = next(self._load_counter)
+
+        self.game_file_dict[virtual_path] = game_file
+        if game_file.modified:
+            self.modified_paths.add(virtual_path)
+        for extension_name in game_file.source_extension_names:
+            self.extension_paths[extension_name].add(virtual_path)
         
         # Check if the game_file is an xml file with a supported
         # asset tag, and updates the asset_class_dict if so.
@@ -177,30 +266,85 @@ class File_System_class:
         Note: this does not clear out any existing references to
         the file object that may have been recorded elsewhere.
         '''
-        if virtual_path not in self.game_file_dict:
+        # Remove from the main file dict.
+        game_file = self.game_file_dict.pop(virtual_path, None)
+        if game_file == None:
             return
+        self.load_order.pop(virtual_path)
+        self._Unindex_File(game_file)
 
-        # Look up the game file.
-        game_file = self.Load_File(virtual_path)
-        # Remove from the main file dict.
-        self.game_file_dict.pop(virtual_path)
-
-        # Also remove from anywhere else that might use it.
-        # These will use a game_file object search.
-        for key, subdict in self.asset_class_dict.items():
-            for key2, sublist in subdict.items():
-                if game_file in sublist:
-                    sublist.remove(game_file)
-
-        for key, value in self.asset_name_dict.items():
-            if value is game_file:
-                # This should be okay to modify the dict if not continuing
-                # the loop further.
-                self.asset_name_dict.pop(key)
-                break
+        # Stop tracking for the memory budget.
+        self.loaded_bytes -= self.loaded_roots.pop(virtual_path, 0)
+        self.unloaded_paths.discard(virtual_path)
+
+        # Also remove from the asset lookups, using the file's own
+        # record of its assets (the same as used by Add_File).
+        if isinstance(game_file, XML_File) and game_file.asset_class_name_dict != None:
+            class_dict = self.asset_class_dict[game_file.root_tag]
+            for class_name, name_list in game_file.asset_class_name_dict.items():
+                # Files with multiple assets of a class are listed
+                # multiple times.
+                class_dict[class_name] = [x for x in class_dict[class_name]
+                                          if x is not game_file]
+                for name in name_list:
+                    if self.asset_name_dict.get(name) is game_file:
+                        self.asset_name_dict.pop(name)
+        return
+
+
+    def _Unindex_File(self, game_file):
+        '''
+        Removes a file from the modified and extension indexes.
+        '''
+        virtual_path = game_file.virtual_path
+        self.modified_paths.discard(virtual_path)
+        for extension_name in game_file.source_extension_names:
+            paths = self.extension_paths.get(extension_name)
+            if paths != None:
+                paths.discard(virtual_path)
+        return
+
+
+    def _Update_Modified_Index(self, game_file):
+        '''
+        Updates modified_paths when a Game_File's modified flag is set;
+        attached as Game_File.modified_callback. Files not recorded
+        in this file system are ignored.
+        '''
+        virtual_path = game_file.virtual_path
+        if self.game_file_dict.get(virtual_path) is not game_file:
+            return
+        if game_file.modified:
+            self.modified_paths.add(virtual_path)
+        else:
+            self.modified_paths.discard(virtual_path)
         return
 
 
+    def _Sort_Paths(self, virtual_paths):
+        '''
+        Returns the loaded files on the given paths, in load order.
+        '''
+        return [self.game_file_dict[x] for x in 
+                sorted(virtual_paths, key = self.load_order.__getitem__)]
+
+
+    def Get_Modified_Files(self):
+        '''
+        Returns a list of loaded Game_Files flagged as modified, in
+        the order they were loaded.
+        '''
+        return self._Sort_Paths(self.modified_paths)
+
+
+    def Get_Extension_Files(self, extension_name):
+        '''
+        Returns a list of loaded Game_Files that the named extension
+        contributed to, in the order they were loaded.
+        '''
+        return self._Sort_Paths(self.extension_paths.get(extension_name, ()))
+
+
     def Get_Asset_File(self, name):
         '''
         Returns a loaded asset XML_File object with the corresponding
@@ -368,14 +512,29 @@ class File_System_class:
         # If the file is not loaded, handle loading.
         if virtual_path not in self.game_file_dict or test_load:
 
-            # Get the file using the source_reader, maybe pulling from
-            #  a cat/dat pair.
-            # Returns a Game_File object, of some subclass, or None
-            #  if not found.
-            game_file = self.source_reader.Read(
-                virtual_path, 
-                error_if_not_found = False,
-                error_if_unmatched_diff = error_if_unmatched_diff)
+            # Take turns with the prefetch thread, if any.
+            with self.read_lock:
+                prefetched = None
+                if not test_load:
+                    prefetched = self.prefetched.pop(virtual_path, None)
+
+                # Use a prefetched copy if available, logging its messages
+                # now, and filling node ids in load order.
+                if prefetched != None:
+                    game_file, messages = prefetched
+                    for message in messages:
+                        Plugin_Log.Print(message)
+                    game_file.Delayed_Init()
+
+                else:
+                    # Get the file using the source_reader, maybe pulling from
+                    #  a cat/dat pair.
+                    # Returns a Game_File object, of some subclass, or None
+                    #  if not found.
+                    game_file = self.source_reader.Read(
+                        virtual_path, 
+                        error_if_not_found = False,
+                        error_if_unmatched_diff = error_if_unmatched_diff)
 
             # Problem if the file isn't found.
             if game_file == None:
@@ -391,15 +550,83 @@ class File_System_class:
             else:
                 return None
 
+        game_file = self.game_file_dict[virtual_path]
+        # Note use of the file for the memory budget.
+        if int(Settings.loaded_file_memory_mb):
+            self._Update_Memory_Budget(game_file)
+
         # Return the file contents.
-        return self.game_file_dict[virtual_path]
+        return game_file
+
+
+    def _Update_Memory_Budget(self, game_file):
+        '''
+        Marks a file as most recently used, then unloads the least
+        recently used unedited xml files to bring their estimated
+        memory within Settings.loaded_file_memory_mb.
+        Files are unloaded through XML_File.Unload_Roots, keeping the
+        Game_File objects in place.
+        '''
+        virtual_path = game_file.virtual_path
+        # Drop any prior estimate; the file may since have been edited.
+        self.loaded_bytes -= self.loaded_roots.pop(virtual_path, 0)
+
+        # Non-xml and edited files are always kept.
+        if not isinstance(game_file, XML_File) or not game_file.Can_Unload():
+            return
+
+        if virtual_path in self.unloaded_paths:
+            self.unloaded_paths.remove(virtual_path)
+            self.num_reloads += 1
+
+        size = game_file.Estimate_Memory()
+        self.loaded_roots[virtual_path] = size
+        self.loaded_bytes += size
+
+        # Unload from the oldest, always keeping the file just loaded.
+        budget = int(Settings.loaded_file_memory_mb) * 2**20
+        while self.loaded_bytes > budget and len(self.loaded_roots) > 1:
+            old_path, old_size = self.loaded_roots.popitem(last = False)
+            self.loaded_bytes -= old_size
+            # Files edited since being loaded will not unload, and are
+            # just dropped from tracking, as are files since reset.
+            old_file = self.game_file_dict.get(old_path)
+            if old_file != None and old_file.Unload_Roots():
+                self.unloaded_paths.add(old_path)
+                self.num_unloads += 1
+        return
+
+
+    def Print_Memory_Stats(self):
+        '''
+        When profiling with a memory budget, prints counts of files
+        unloaded and reloaded, and the estimated memory of unedited
+        files still loaded.
+        '''
+        if not Settings.profile or not int(Settings.loaded_file_memory_mb):
+            return
+        Print(('File_System memory budget: {} unloads, {} reloads,'
+               ' {:.1f} MB estimated loaded').format(
+                   self.num_unloads, self.num_reloads, self.loaded_bytes / 2**20))
+        return
     
 
-    def Load_Files(self, pattern):
+    def Load_Files(self, pattern, num_workers = 1):
         '''
         Searches for and loads in xml files following the given
         virtual_path wildcard pattern (lowercased internally).
         Returns a list of files loaded.
+
+        * num_workers
+          - Int, number of worker processes that read, parse, and patch
+            files not yet loaded.
+          - Defaults to 1, loading each file in turn in this process.
+          - If None, uses one per cpu.
+          - Results match a serial load, including node ids and the
+            order of any Plugin_Log messages.
+          - On windows, scripts calling this with workers should guard
+            their top level code with "if __name__ == '__main__':",
+            since each worker imports the main module.
         '''
         # -Removed; skipping like this fails to fill the return list.
         ## Limit each pattern to running once.
@@ -411,13 +638,291 @@ class File_System_class:
         pattern = pattern.lower()
 
         self._patterns_loaded.add(pattern)
+        virtual_paths = list(self.Gen_All_Virtual_Paths(pattern))
+
+        # Read new files in worker processes, if requested.
+        if num_workers != 1:
+            self._Load_Files_Parallel(
+                [x for x in virtual_paths if x not in self.game_file_dict
+                 and x not in self.prefetched],
+                num_workers)
 
         # Load all files matching the pattern.
         files = []
-        for virtual_path in self.Gen_All_Virtual_Paths(pattern):
+        for virtual_path in virtual_paths:
             files.append( self.Load_File(virtual_path) )
         return files
 
+
+    def _Load_Files_Parallel(self, virtual_paths, num_workers = None):
+        '''
+        Reads the given files in a pool of worker processes, recording
+        them as Load_File would. Files are recorded in the given order,
+        with Plugin_Log messages from the workers replayed as they
+        would have occurred in a serial load.
+        Files that fail to load are left for Load_File to retry, so that
+        errors are raised in the same way.
+        '''
+        if len(virtual_paths) < 2:
+            return
+        if num_workers == None:
+            num_workers = cpu_count()
+        num_workers = min(num_workers, len(virtual_paths))
+
+        if Settings.profile:
+            start = time()
+
+        # Workers copy the current settings, so they find the same files.
+        settings_dict = {field : getattr(Settings, field) 
+                         for field in Settings.Get_Defaults()}
+
+        # Send files in a few chunks per worker, to balance load while
+        # limiting transfer overhead.
+        with Pool(
+                processes = num_workers,
+                initializer = _Init_Load_Worker, 
+                initargs = (settings_dict,)) as pool:
+            results = pool.map(
+                _Read_File_In_Worker, 
+                virtual_paths,
+                chunksize = max(1, len(virtual_paths) // (num_workers * 4)))
+
+        for virtual_path, (game_file, messages) in zip(virtual_paths, results):
+            # Leave failures (and all later files) to the normal load,
+            # which will repeat any messages and raise any errors.
+            if game_file == None:
+                break
+            for message in messages:
+                Plugin_Log.Print(message)
+            # Node ids are filled here, in load order, so they stay unique
+            # and match a serial load.
+            game_file.Delayed_Init()
+            self.Add_File(game_file)
+
+        if Settings.profile:
+            Print('File_System.Load_Files parallel read of {} files: {:.3f} s'.format(
+                len(virtual_paths), time() - start))
+        return
+
+    
+    @_Verify_Init
+    def Query_XML(self, virtual_path, tag, attributes = None):
+        '''
+        Generator that yields the xml nodes of the given tag in a file,
+        in document order, for read-only scans that do not need a
+        loaded Game_File.
+        If the file is not loaded, it is streamed with iterparse where
+        possible, keeping only matched nodes in memory, and is not
+        recorded as loaded. Files needing patching, without a saved
+        patching result, are read in full and then dropped.
+        Returns nothing if the file is not found.
+
+        * virtual_path
+          - Name of the file, as for Load_File.
+        * tag
+          - String, tag of the nodes to return.
+        * attributes
+          - Optional dict of attribute names and values that returned
+            nodes must have; a value of None only requires the
+            attribute be present.
+
+        Notes:
+        - Nodes are for reading only. Nodes streamed from an unloaded
+          file are detached copies without node ids; nodes from a loaded
+          file are the live ones, and must not be edited.
+        - Nested matches are all returned, as from root.iter(tag).
+        '''
+        virtual_path = virtual_path.lower().replace('\\','/')
+        attributes = attributes or {}
+
+        def Is_Match(node):
+            '''
+            Returns True if the node has the tag and attributes.
+            '''
+            if node.tag != tag:
+                return False
+            for name, value in attributes.items():
+                node_value = node.get(name)
+                if node_value == None or (value != None and node_value != value):
+                    return False
+            return True
+
+        # Loaded or prefetched files are searched directly.
+        root = None
+        stream = None
+        if virtual_path in self.game_file_dict:
+            root = self.game_file_dict[virtual_path].Get_Root_Readonly()
+        else:
+            with self.read_lock:
+                if virtual_path in self.prefetched:
+                    root = self.prefetched[virtual_path][0].patched_root
+                else:
+                    binary = self.source_reader.Read_Patched_Binary(virtual_path)
+                    if binary != None:
+                        # Copy out, so the stream outlives any mapped dat.
+                        stream = BytesIO(binary)
+                    else:
+                        # Fall back on a full read, left unrecorded.
+                        game_file = self.source_reader.Read(
+                            virtual_path, 
+                            error_if_not_found = False,
+                            delayed_init = False)
+                        if isinstance(game_file, XML_File) and not game_file.load_error:
+                            root = game_file.patched_root
+
+        if root != None:
+            for node in root.iter(tag):
+                if Is_Match(node):
+                    yield node
+            return
+        if stream == None:
+            return
+
+        # Stream the file, clearing out unmatched nodes once complete.
+        # Matched nodes are only detached at the end of the outermost
+        # match, so that nested matches stay in place.
+        match_depth = 0
+        for event, node in ET.iterparse(
+                stream, 
+                events = ('start','end'),
+                remove_blank_text = True,
+                remove_comments = True,
+                huge_tree = True,
+            ):
+            if event == 'start':
+                if match_depth or Is_Match(node):
+                    match_depth += 1
+                continue
+
+            parent = node.getparent()
+            if match_depth:
+                match_depth -= 1
+                if match_depth:
+                    continue
+                # Detach the finished match; the tail is not needed.
+                node.tail = None
+                if parent != None:
+                    parent.remove(node)
+                for subnode in node.iter(tag):
+                    if Is_Match(subnode):
+                        yield subnode
+            else:
+                # Drop the finished node, and any earlier siblings.
+                node.clear()
+                while node.getprevious() != None:
+                    del parent[0]
+        return
+
+
+    def Prefetch_Files(self, patterns):
+        '''
+        Reads files matching the given virtual path patterns in a
+        background thread, ahead of them being loaded. Loading works
+        as normal, but will pick up the prefetched copy if ready.
+
+        * patterns
+          - String or list of strings, virtual paths or wildcard patterns.
+          - Files are read in the order given.
+
+        Note: prefetched files are only read and patched; node ids
+        are filled and any Plugin_Log messages are logged when the file
+        is loaded, so results match loading without prefetch.
+        '''
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        for pattern in patterns:
+            if pattern.lower() not in self.prefetch_patterns:
+                self.prefetch_patterns.append(pattern.lower())
+        self.Start_Prefetch()
+        return
+
+
+    def Start_Prefetch(self):
+        '''
+        Starts the prefetch thread on any queued prefetch_patterns.
+        Normally called on each plugin call, after Settings init.
+        '''
+        if not self.prefetch_patterns:
+            return
+        if Settings.profile:
+            start = time()
+
+        patterns = list(self.prefetch_patterns)
+        self.prefetch_patterns.clear()
+        # Find the paths here, so the source reader sets up its path
+        # lookups before the thread starts.
+        new_paths = []
+        for pattern in patterns:
+            for virtual_path in self.Gen_All_Virtual_Paths(pattern):
+                if (virtual_path not in self.game_file_dict
+                and virtual_path not in self.prefetched):
+                    new_paths.append(virtual_path)
+
+        with self.read_lock:
+            self._prefetch_queue.extend(new_paths)
+            if self._prefetch_thread == None and self._prefetch_queue:
+                self._prefetch_thread = threading.Thread(
+                    target = self._Prefetch_Loop,
+                    name = 'File_System_Prefetch',
+                    # Don't hold up exit on unneeded reads.
+                    daemon = True)
+                self._prefetch_thread.start()
+
+        if Settings.profile:
+            Print('File_System.Start_Prefetch queued {} files: {:.3f} s'.format(
+                len(new_paths), time() - start))
+        return
+
+
+    def _Prefetch_Loop(self):
+        '''
+        Body of the prefetch thread, reading queued files until the
+        queue is empty or a stop is requested.
+        Files that fail to read are skipped, left for Load_File to
+        retry, which will log messages and raise errors as normal.
+        '''
+        while True:
+            with self.read_lock:
+                if self._prefetch_stop or not self._prefetch_queue:
+                    self._prefetch_thread = None
+                    return
+                virtual_path = self._prefetch_queue.popleft()
+                if (virtual_path in self.game_file_dict
+                or virtual_path in self.prefetched):
+                    continue
+
+                # Hold onto messages until the file is loaded.
+                Plugin_Log.Start_Capture()
+                try:
+                    game_file = self.source_reader.Read(
+                        virtual_path, 
+                        error_if_not_found = False,
+                        delayed_init = False)
+                except Exception:
+                    game_file = None
+                messages = Plugin_Log.End_Capture()
+
+                if game_file != None:
+                    self.prefetched[virtual_path] = (game_file, messages)
+
+
+    def Stop_Prefetch(self):
+        '''
+        Stops the prefetch thread, if running, and drops any prefetched
+        files not yet loaded.
+        '''
+        # Grab the thread under the lock, since it clears it on exit.
+        with self.read_lock:
+            thread = self._prefetch_thread
+            self._prefetch_stop = True
+        if thread != None:
+            thread.join()
+        with self.read_lock:
+            self._prefetch_stop = False
+            self._prefetch_queue.clear()
+            self.prefetched.clear()
+        return
+
     
     @_Verify_Init
     def Get_Source_Reader(self):
@@ -523,15 +1028,11 @@ class File_System_class:
         '''
         Print('Writing output non-extension files')
 
-        # Loop over the files that were loaded.
-        for file_name, file_object in self.game_file_dict.items():
+        # Loop over the modified files.
+        for file_object in self.Get_Modified_Files():
             # Only care about machine code for now.
             if not isinstance(file_object, Machine_Code_File):
                 continue
-            
-            # Skip if not modified and not a sig.
-            if not file_object.modified:
-                continue
 
             # Skip if already written. (Used for exe files handled by
             # Write_Files already.)
@@ -569,6 +1070,11 @@ class File_System_class:
         Print('Writing output files' 
               + (' (diff encoded)' if not Settings.make_maximal_diffs else ''))
         #Print('Output dir: {}'.format(Settings.Get_Output_Folder()))
+        self.Print_Memory_Stats()
+
+        # Collect any md5 checks deferred to the background, so that
+        # corrupted sources are caught before anything is written.
+        Cat_Hash_Verifier.Finish_Background_Checks()
 
         # Add copies of leftover files from the user source folder.
         # Do this before the proper writeout, so it can reuse functionality.
@@ -600,15 +1106,11 @@ class File_System_class:
         # Handle generic sig file creation.
         if Settings.generate_sigs:
             for game_file in Generate_Signatures(self.game_file_dict.values()):
-                self.game_file_dict[game_file.virtual_path] = game_file
-
+                self.Add_File(game_file)
 
-        # Loop over the files that were loaded.
-        for file_name, file_object in self.game_file_dict.items():
 
-            # Skip if not modified and not a sig.
-            if not file_object.modified:
-                continue
+        # Loop over the modified files, including sigs.
+        for file_object in self.Get_Modified_Files():
 
             # Skip if already written. (Used for exe files handled by
             # Write_Non_Ext_Files already.)
@@ -677,7 +1179,9 @@ class File_System_class:
         # If anything was added to the cat_writers, do their writes.
         for writer in [cat_writer, subst_cat_writer]:
             if writer.game_files:
-                writer.Write()
+                # Note: setting may arrive as a string from the gui.
+                writer.Write(num_workers = int(Settings.catalog_write_workers),
+                             gzip_xml = Settings.gzip_catalog_xml)
 
                 # Log both the cat and dat files as written.
                 log.Record_File_Path_Written(writer.cat_path)
@@ -751,12 +1255,16 @@ class File_System_class:
         # Pass the call to the source reader.
         # TODO: swap this around to gathering a set of paths here,
         #  and adding to them new files that get added during runtime.
-        yield from self.source_reader.Gen_All_Virtual_Paths(pattern)
+        # Collect under the read lock, since the source reader may set
+        #  up its path lookups here.
+        with self.read_lock:
+            virtual_paths = list(self.source_reader.Gen_All_Virtual_Paths(pattern))
+        yield from virtual_paths
         return
 
     
     @_Verify_Init
-    def Read_Text(self, text = None, page = None, id = None):
+    def Read_Text(self, text = None, page = None, id = None, language_id = None):
         '''
         Reads and returns the text at the given {page,id}.
         Recursively expands nested references.
@@ -768,24 +1276,24 @@ class File_System_class:
         * page, id
           - Int or string, page and id separated; give for direct
             dereference instead of a full text string.
+        * language_id
+          - Optional int, id of the language to read.
+          - Defaults to Settings.text_language_id.
         '''
-        # Currently expect all text to be in the 0001 file, but could
-        # be split between currently language (eg. 0001-l044.xml) and
-        # a generic fallback (eg. 0001.xml).
-        # TODO: get a language code from Settings.
-
-        # Kick it off with the language specific lookup.
-        t_files = [
-            File_System.Load_File('t/0001-L044.xml'),
-            # This one may not be present; ego doesn't use it, but mods might.
-            # TODO: what happens if two mods use this? are strings joined?
-            # TODO: will tend to fail since there is no vanilla version of
-            # this file; will need special handling to create a vanilla
-            # dummy that extensions can append to.
-            File_System.Load_File('t/0001.xml', error_if_not_found = False),
+        # Text is looked up in the language specific file (eg. 0001-l044.xml)
+        # and then the generic fallback (0001.xml), which ego doesn't
+        # use but mods might.
+        # Files that are loaded (eg. for editing) are read directly;
+        # others go through a Text_Table, parsing only the pages used.
+        # The language file is required, and raises File_Missing_Exception
+        # if not found (eg. a bad text_language_id).
+        if language_id == None:
+            language_id = Settings.text_language_id
+        t_paths = [
+            't/0001-l{:03d}.xml'.format(int(language_id)),
+            't/0001.xml',
             ]
 
-        
         # If page and id given, pack them in a string to reuse the
         # following code. Probably don't need to worry about performance
         # of this.
@@ -825,11 +1333,13 @@ class File_System_class:
                 # Check if it is a nested lookup.
                 if term.startswith('{'):
 
-                    # Search each of the t_files in order to see if any
+                    # Search each of the t files in order to see if any
                     # of them have it, taking the first hit.
                     replacement_text = None
-                    for file in t_files:
-                        replacement_text = file.Read(term)
+                    for t_path in t_paths:
+                        replacement_text = self._Read_Text_Term(
+                            t_path, term,
+                            error_if_not_found = t_path == t_paths[0])
                         if replacement_text != None:
                             break
 
@@ -840,7 +1350,8 @@ class File_System_class:
                     # Otherwise, recursively process it, since it could
                     # have more nested references.
                     else:
-                        new_text += self.Read_Text(replacement_text)
+                        new_text += self.Read_Text(
+                            replacement_text, language_id = language_id)
 
                 else:
                     # There was no lookup for this term; just append
@@ -853,42 +1364,117 @@ class File_System_class:
         # Send back the processed text.
         return text
 
-        
-        # Search for the text.
-        ret_text = None
-        for file in t_files:
-            if file == None:
-                continue
-            # If this runs into a nested reference, point it back to this
-            # function for the next step lookup.
-            # TODO: how to avoid this Read failing to find a term, call
-            # back to Read_Text, and Read_Text calling Read on the same
-            # t_file again (inf loop). Protection should also avoid bouncing
-            # between two t_files each failing their Read.
-            ret_text = file.Read(
-                text = text, 
-                page = page, 
-                id = id,
-                nested_read_text_func = self.Read_Text)
-
-            # If the above returned something useful, use it.
-            if ret_text != None:
-                break
-            # Otherwise keep looping.
-
-        # If text is still None, something failed to resolve.
-        # Could potentially return None, which will cause any higher level
-        # calls to this function (this could be the bottom of a reference
-        # stack) to fail and return None.
-        # Alternatively, use a "read_text" fallback, which will also help
-        # references resolve.
-        if ret_text == None:
-            if text != None:
-                ret_text = text
-            else:
-                ret_text = f'{{{page},{id}}}'
-        return ret_text
+
+    def _Read_Text_Term(self, virtual_path, term, error_if_not_found = False):
+        '''
+        Returns the text for a '{page,id}' term from a t file, or None
+        if not found. Loaded files are read directly; otherwise the
+        file's Text_Table is used, created on first use.
+        If error_if_not_found and the file is missing, raises
+        File_Missing_Exception.
+        '''
+        if virtual_path in self.game_file_dict:
+            return self.game_file_dict[virtual_path].Read(term)
+
+        # Split the term, as XML_Text_File.Read does.
+        try:
+            page, id = (term.replace(' ','').replace('{','')
+                        .replace('}','').split(','))
+        except ValueError:
+            return None
+
+        table = self.text_tables.get(virtual_path)
+        if table == None:
+            table = self.text_tables[virtual_path] = self._Get_Text_Table(
+                virtual_path, error_if_not_found = error_if_not_found)
+        return table.Read(page, id)
+
+
+    def _Get_Text_Table(self, virtual_path, error_if_not_found = False):
+        '''
+        Returns a new Text_Table for a t file, without loading it.
+        The patched binary is used when available without patching,
+        else the file is read and patched in full, keeping only its text.
+        Bad xml raises File_Loading_Error_Exception, here or on lookup.
+        A missing file gives an empty table, or raises File_Missing_Exception
+        if error_if_not_found.
+        '''
+        # The source reader gives an empty dummy for missing t files (so
+        # extensions can add to them), so check for a real source here,
+        # either a base file or an extension file patched onto the dummy.
+        # (The path itself is the pattern, for a quick index lookup.)
+        if (error_if_not_found
+        and virtual_path not in self.Gen_All_Virtual_Paths(virtual_path)
+        and not self.source_reader.Get_Path_Contributors(virtual_path)):
+            raise File_Missing_Exception(
+                'Could not find a match for file {}'.format(virtual_path))
+
+        with self.read_lock:
+            if virtual_path in self.prefetched:
+                return Text_Table(
+                    xml_root = self.prefetched[virtual_path][0].patched_root)
+
+            binary = self.source_reader.Read_Patched_Binary(virtual_path)
+            if binary != None:
+                return Text_Table(binary, virtual_path = virtual_path)
+
+            game_file = self.source_reader.Read(
+                virtual_path, 
+                error_if_not_found = False,
+                delayed_init = False)
+            if isinstance(game_file, XML_File) and not game_file.load_error:
+                return Text_Table(xml_root = game_file.patched_root)
+        return Text_Table()
     
 
 # Static copy of the file system object.
-File_System = File_System_class()
\ No newline at end of file
+File_System = File_System_class()
+# Track modified flags of its files.
+Game_File.modified_callback = File_System._Update_Modified_Index
+
+
+def _Init_Load_Worker(settings_dict):
+    '''
+    Sets up a Load_Files worker process, using a fresh source reader
+    with the main process settings. Plugin_Log messages are captured,
+    to be replayed by the main process.
+    '''
+    # Forked workers inherit the main process state, including open dat
+    # file handles, pending background md5 checks whose threads do not
+    # exist here, and a prefetch lock that may have been held at the fork.
+    # Drop the md5 checks first; waiting on them would hang.
+    Cat_Hash_Verifier.pending = []
+    Cat_Hash_Verifier.executor = None
+    Settings(**settings_dict)
+    # Background md5 checks would never be collected here.
+    if Settings.cat_md5_verification == 'background':
+        Settings.cat_md5_verification = 'eager'
+    # Start the file system over so nothing is shared, without going
+    # through Reset, which would also close out the inherited readers
+    # (finishing md5 checks, trimming the patched xml cache) and print
+    # memory stats in every worker. Inherited dat mappings are left for
+    # the main process to close.
+    File_System.__init__()
+    Plugin_Log.logging_function = _worker_messages.append
+    return
+
+# Plugin_Log messages captured in a worker process.
+_worker_messages = []
+
+
+def _Read_File_In_Worker(virtual_path):
+    '''
+    Reads a file in a Load_Files worker process, without the delayed
+    init. Returns a tuple of (game_file, list of Plugin_Log messages).
+    The game_file is None if the file could not be loaded, or the read
+    had an error.
+    '''
+    _worker_messages.clear()
+    try:
+        game_file = File_System.Get_Source_Reader().Read(
+            virtual_path, 
+            error_if_not_found = False,
+            delayed_init = False)
+    except Exception:
+        game_file = None
+    return (game_file, list(_worker_messages))
@@ -23,8 +23,11 @@ import os
 from lxml import etree as ET
 from copy import deepcopy
 from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 import fnmatch
 import time
+import zlib
+import threading
 
 from ..Common import Plugin_Log
 from ..Common import Settings
@@ -185,6 +188,10 @@ class Game_File:
       - Generally, error files should be skipped.
       - Primarily used for empty xml files.
     '''
+    # Function called with the file whenever its modified flag is set,
+    # used by the File_System to track modified files.
+    modified_callback = None
+
     def __init__(
             self,
             virtual_path,
@@ -224,6 +231,17 @@ class Game_File:
             self.source_extension_names.append(extension_name)
         return
 
+
+    @property
+    def modified(self):
+        return self._modified
+
+    @modified.setter
+    def modified(self, value):
+        self._modified = value
+        if Game_File.modified_callback != None:
+            Game_File.modified_callback(self)
+
     def Get_Index_Path(self):
         '''
         Returns a path string matching the form used in index files, using
@@ -392,10 +410,16 @@ class Game_File:
         return binary
 
 
+# Rough parsed tree size per byte of xml text, measured on wares xml with node ids.
+tree_bytes_per_xml_byte = 13
+
+
 # Note: encoding assumed to be utf-8 in general.
 # A grep of the x4 dat files didn't find any non-utf8 xml encodings.
 # Mods may be non-utf8; keep the logic for handling encoding here just
 #  for these cases, though always output again in utf8.
+
+
 class XML_File(Game_File):
     '''
     XML file contents. This will keep a record of the original xml
@@ -413,14 +437,20 @@ class XML_File(Game_File):
     Attributes:
     * original_root
       - Element holding the original parsed xml, pre-patches, pre-transforms.
+      - Kept as serialized xml, and only parsed when first requested.
     * patched_root
       - Element holding the diff patched root, pre-transforms.
+      - Once the file has a modified_root, this is kept as serialized xml
+        (compressed per Settings.compress_xml_roots), and parsed when
+        requested, eg. when generating a diff.
     * modified_root
       - Element holding transformed xml, suitable for generating
         new diff patches.
     * root_tag
       - Tag name of the root node, for convenient referencing.
       - This is never expected to change across diff patches or transforms.
+    * xml_size
+      - Int, size in bytes of the original xml text, for memory estimates.
     * asset_class_name_dict
       - Dict, keyed by asset class as defined in the xml, holding a list of
         names of the asset nodes of the class type.
@@ -451,11 +481,19 @@ class XML_File(Game_File):
         # Should receive either the binary or the xml itself.
         assert binary != None or xml_root != None
 
+        # Parsed roots, and their serialized forms; see the properties.
+        self._original_root = None
+        self._original_packed = None
+        self._patched_root = None
+        self._patched_packed = None
+        # Root parsed below, before patching.
+        root = None
+        self.xml_size = 0
+
         if binary != None:
             # Dummy files may have empty binary; handle specially.
             if len(binary) == 0:
                 Plugin_Log.Print(f'Error: empty xml format file: {self.virtual_path}')
-                self.original_root = None
             else:
                 # Process into an xml tree.
                 # Strip out blank text here, so that prettyprint works later.
@@ -467,33 +505,134 @@ class XML_File(Game_File):
                 # count that line, causing the sourceline attributes on nodes
                 # to be off. (This doesn't happen when using parse() on file
                 # objects.) No clear fix at this time.
-                self.original_root = ET.XML(
-                binary,
-                parser = ET.XMLParser(remove_blank_text=True))
+                root = ET.XML(binary, parser = Get_XML_Parser())
+                # Hold onto the binary for the original root, which is
+                # much smaller than a parsed copy, and costs nothing here
+                # (eg. for diff patch files that are soon dropped).
+                # Copy views (eg. into mapped catalogs) to plain bytes,
+                # so they don't hold onto the source.
+                if not isinstance(binary, bytes):
+                    binary = bytes(binary)
+                self._original_packed = (binary, False, None)
+                self.xml_size = len(binary)
 
         elif xml_root != None:
             assert isinstance(xml_root, ET._Element)
-            self.original_root = xml_root
+            # Deepcopy this, since patching will edit it in place, and
+            #  the caller may still edit the given root.
+            root = deepcopy(xml_root)
+            self._original_packed = _Pack_XML_Root(xml_root, compress = False)
+            self.xml_size = len(self._original_packed[0])
             
-        if self.original_root != None:
+        if root != None:
             # Init the patched version to the original.
-            # Deepcopy this, since patching will edit it in place.
-            self.patched_root = deepcopy(self.original_root)
+            self._patched_root = root
 
             # The root tag should never be changed by mods, so can
             #  record it here pre-patching.
-            self.root_tag = self.original_root.tag
+            self.root_tag = root.tag
         else:
-            self.patched_root = None
             self.root_tag = None
             self.load_error = True
 
         # Modified root starts as None; gets initialized sometime after
         # Delayed_Init when Get_Root is called by a transform.
         self.modified_root = None
+        # Count of open Edit_Root sessions.
+        self._edit_depth = 0
+        return
+
+
+    @property
+    def original_root(self):
+        if self._original_root == None and self._original_packed != None:
+            self._original_root = _Unpack_XML_Root(self._original_packed)
+        return self._original_root
+
+    @original_root.setter
+    def original_root(self, root):
+        self._original_root = root
+        self._original_packed = None
+
+
+    @property
+    def patched_root(self):
+        if self._patched_root == None and self._patched_packed != None:
+            self._patched_root = _Unpack_XML_Root(self._patched_packed)
+        return self._patched_root
+
+    @patched_root.setter
+    def patched_root(self, root):
+        self._patched_root = root
+        self._patched_packed = None
+
+
+    def Pack_Roots(self):
+        '''
+        Drops parsed original and patched roots that are no longer in
+        regular use, keeping them in serialized form, to be parsed again
+        if requested.
+        The patched_root is only packed once the file has a modified_root,
+        since until then it is the current root.
+        '''
+        compress = Settings.compress_xml_roots
+
+        if self._original_packed != None:
+            data, compressed, root_tail = self._original_packed
+            if compress and not compressed:
+                self._original_packed = (zlib.compress(data, 1), True, root_tail)
+            self._original_root = None
+
+        if self.modified_root != None and self._patched_root != None:
+            # Serialize only if not already packed; the patched_root is
+            # not edited after loading.
+            if self._patched_packed == None:
+                self._patched_packed = _Pack_XML_Root(
+                    self._patched_root, compress = compress)
+            self._patched_root = None
         return
     
     
+    def Can_Unload(self):
+        '''
+        Returns True if this file's roots can be unloaded, requiring
+        that it has not been edited or handed out for editing.
+        '''
+        return (not self.load_error
+                and not self.modified
+                and self.modified_root == None
+                and not self._edit_depth)
+
+
+    def Unload_Roots(self):
+        '''
+        Drops the parsed roots of an unedited file, keeping the patched
+        root in serialized form (with node ids), to be parsed again when
+        next requested. Returns True if unloaded, False if the file
+        cannot be unloaded.
+        Note: nodes obtained before unloading remain valid, but are
+        no longer part of this file's roots.
+        '''
+        if not self.Can_Unload():
+            return False
+        if self._patched_root != None:
+            if self._patched_packed == None:
+                self._patched_packed = _Pack_XML_Root(
+                    self._patched_root, compress = Settings.compress_xml_roots)
+            self._patched_root = None
+        self._original_root = None
+        self.Reset_Cache()
+        return True
+
+
+    def Estimate_Memory(self):
+        '''
+        Returns a rough estimate of the memory used by one parsed root
+        of this file, in bytes.
+        '''
+        return self.xml_size * tree_bytes_per_xml_byte
+
+    
     def Delayed_Init(self):
         '''
         Fills in node ids for the patched_root, and any other delayed
@@ -503,6 +642,10 @@ class XML_File(Game_File):
         if self.load_error:
             return
 
+        # Compress the original root while here, since the file is
+        # being kept.
+        self.Pack_Roots()
+
         # Annotate the patched_root with node ids.
         XML_Diff.Fill_Node_IDs(self.patched_root)
         
@@ -628,6 +771,8 @@ class XML_File(Game_File):
             # Set the initial modified tree to a deep copy of the patched
             #  version; this will keep node_ids intact.
             self.modified_root = deepcopy(self.patched_root)
+            # The patched version is now only needed for diffs.
+            self.Pack_Roots()
         # Return a deepcopy of the modified_root, so that a transform
         #  can edit it safely, even if it exceptions out and doesn't
         #  complete.
@@ -670,8 +815,9 @@ class XML_File(Game_File):
         # Error checks: make sure the returned element isn't any of the
         # existing nodes, which would indicate it was pulled as a
         # read only root.
-        if (element_root is self.patched_root 
-            or element_root is self.original_root 
+        # (Check the underlying roots, to avoid parsing packed ones.)
+        if (element_root is self._patched_root 
+            or element_root is self._original_root 
             or element_root is self.modified_root
             # Backup check in case node ids go awry; the modified root
             # should have been created.
@@ -687,6 +833,75 @@ class XML_File(Game_File):
         # Assume the xml changed from the patched version.
         self.modified = True
         self.modified_root = element_root
+        self.Reset_Cache()
+        return
+
+
+    @contextmanager
+    def Edit_Root(self):
+        '''
+        Context manager for editing the current xml in place, avoiding
+        the copies made by Get_Root and Update_Root. Yields the modified
+        root, which may be freely edited within the block. If the block
+        completes, the edits are kept and the file is flagged as modified;
+        if an exception leaves the block, the edits are rolled back and
+        the exception continues.
+
+        Example:
+            with wares_file.Edit_Root() as xml_root:
+                for ware in xml_root.findall('./ware'):
+                    ...
+
+        Note: the root element itself cannot be replaced in the block;
+        use Get_Root and Update_Root for that.
+        Note: nodes from Get_Root_Readonly may be the same nodes being
+        edited, and will see the changes.
+        Note: rollback uses a checkpoint of the whole current root, not a
+        journal of touched nodes, since lxml offers no hook to see which
+        nodes a block edits. The first edit of a file still copies the
+        patched root, which is kept for diffs and may be held by readers.
+        Later sessions serialize the current root, roughly a third of the
+        cost of a Get_Root/Update_Root round trip on wares.xml (see the
+        edit session benchmark).
+        '''
+        # For rollback, save a serialized copy of the current root, which
+        # is much faster than a deepcopy. If there are no prior edits,
+        # nothing is needed, since the patched_root is the prior state.
+        # (Nested sessions leave rollback to the outer one.)
+        checkpoint = None
+        unedited = self.modified_root == None
+        if unedited:
+            self.modified_root = deepcopy(self.patched_root)
+            self.Pack_Roots()
+        elif not self._edit_depth:
+            checkpoint = _Pack_XML_Root(self.modified_root, compress = False)
+
+        self._edit_depth += 1
+        try:
+            yield self.modified_root
+        except BaseException:
+            if self._edit_depth == 1:
+                if unedited:
+                    # Back to the unedited state; Get_Root will copy
+                    # the patched_root again.
+                    self.modified_root = None
+                else:
+                    self.modified_root = _Unpack_XML_Root(checkpoint)
+                self.Reset_Cache()
+            raise
+        finally:
+            self._edit_depth -= 1
+
+        self.modified = True
+        self.Reset_Cache()
+        return
+
+
+    def Reset_Cache(self):
+        '''
+        Called when the current root changes; subclasses with lookups
+        into the current root should clear them here.
+        '''
         return
 
 
@@ -730,6 +945,9 @@ class XML_File(Game_File):
             shorten_xpaths = Settings.shorten_xpaths,
             verify = True)
 
+        # Drop the parsed patched_root again.
+        self.Pack_Roots()
+
         if Settings.profile:
             Print('XML_Diff.Make_Patch for {} time: {:.2f}'.format(
                 self.name, time.time() - start))
@@ -822,7 +1040,9 @@ class XML_File(Game_File):
                     self.virtual_path, other_file.extension_name))
             
         # Preserve this root as the original.
-        other_file.original_root = self.original_root
+        # (Copy the underlying forms, to avoid parsing a packed root.)
+        other_file._original_root = self._original_root
+        other_file._original_packed = self._original_packed
         
         # Based on x4 log errors, it seems that it will handle
         #  diff xmls (when fed as an original file or substitution)
@@ -939,11 +1159,10 @@ class XML_Text_File(XML_File):
         return
 
 
-    def Update_Root(self, *args, **kwargs):
+    def Reset_Cache(self):
         '''
         Clears the page_text_dict when root is updated.
         '''
-        super().Update_Root(*args, **kwargs)
         self.page_text_dict.clear()
         # Set the refresh countdown.
         self.requests_until_refresh = self.requests_until_refresh_limit
@@ -1059,11 +1278,10 @@ class XML_Index_File(XML_File):
         return
 
 
-    def Update_Root(self, *args, **kwargs):
+    def Reset_Cache(self):
         '''
-        Clears the page_text_dict when root is updated.
+        Clears the name_path_dict when root is updated.
         '''
-        super().Update_Root(*args, **kwargs)
         self.name_path_dict.clear()
         # Set the refresh countdown.
         self.requests_until_refresh = self.requests_until_refresh_limit
@@ -1175,15 +1393,25 @@ class XML_Wares_File(XML_File):
         return
 
 
-    def Update_Root(self, *args, **kwargs):
+    def Reset_Cache(self):
         '''
         Clears version_ware_node_dict['current'] when root is updated.
         '''
-        super().Update_Root(*args, **kwargs)
         self.version_ware_node_dict['current'].clear()
         # Set the refresh countdown.
         self.requests_until_refresh = self.requests_until_refresh_limit
         return
+
+
+    def Unload_Roots(self):
+        '''
+        Also clears the vanilla and patched node lookups when unloaded,
+        so they don't hold onto the old roots.
+        '''
+        unloaded = super().Unload_Roots()
+        if unloaded:
+            self.version_ware_node_dict.clear()
+        return unloaded
     
 
     def Get_Xpath_Nodes(self, xpath, version = 'current'):
@@ -1249,6 +1477,9 @@ class Misc_File(Game_File):
     * binary
       - Bytearray object holding the binary (may be given as bytes).
       - Optional if text is present.
+      - If neither text nor binary is given, the binary is read from
+        file_source_path each time it is requested, and not kept.
+        This keeps memory low when packing many loose files.
     '''
     def __init__(self, text = None, binary = None, **kwargs):
         super().__init__(**kwargs)
@@ -1282,6 +1513,9 @@ class Misc_File(Game_File):
         '''
         if self.binary != None:
             return self.binary
+        elif self.text == None and self.file_source_path != None:
+            # Read on demand from disk.
+            return self.file_source_path.read_bytes()
         else:
             assert self.text != None
 
@@ -1312,6 +1546,8 @@ class Misc_File(Game_File):
             binary = self.Get_Binary()
         elif self.binary != None:
             binary = self.binary
+        elif self.file_source_path != None:
+            binary = self.Get_Binary()
         else:
             return
 
@@ -1333,7 +1569,8 @@ class Text_File(Misc_File):
         else:
             assert binary != None
             # Manually standardize newlines.
-            self.text = binary.decode().replace('\r\n','\n').replace('\r','\n')
+            # (Binary may be a memoryview, so cast to bytes to decode.)
+            self.text = bytes(binary).decode().replace('\r\n','\n').replace('\r','\n')
     
     def Needs_Subst(self):
         # Shader files may need to be packed, else they are not found
@@ -1400,4 +1637,59 @@ class Signature_File(Misc_File):
         # Give default empty binary.
         if self.text == None and self.binary == None:
             self.binary = b''
-        return
\ No newline at end of file
+        return
+
+
+def _Pack_XML_Root(root, compress):
+    '''
+    Returns a tuple of (binary, compressed, root_tail) holding a
+    serialized xml root, for _Unpack_XML_Root. Node ids in tails are
+    kept, the root's tail being held separately.
+    '''
+    # Leave off the root tail, else it parses as extra content.
+    binary = ET.tostring(root, encoding = 'utf-8', with_tail = False)
+    if compress:
+        # Lowest level; most of the gain at a fraction of the time.
+        binary = zlib.compress(binary, 1)
+    return (binary, compress, root.tail)
+
+
+def _Unpack_XML_Root(packed):
+    '''
+    Returns a new xml root parsed from a tuple made by _Pack_XML_Root
+    (or a source file binary in the same form).
+    '''
+    binary, compressed, root_tail = packed
+    if compressed:
+        binary = zlib.decompress(binary)
+    root = ET.XML(binary, parser = Get_XML_Parser())
+    root.tail = root_tail
+    return root
+
+
+# Parsers reused by Get_XML_Parser, held per thread, since a parser
+# cannot be used by two threads at once.
+_thread_parsers = threading.local()
+
+def Get_XML_Parser():
+    '''
+    Returns an XMLParser for game xml files, reused across parses in
+    the current thread. Blank text is removed, so that pretty printing
+    works later.
+    If Settings.fast_xml_parsing is set, comments are dropped, huge
+    trees are allowed, and xml:id attributes are not collected.
+    '''
+    fast = bool(Settings.fast_xml_parsing)
+    # Note: thread locals are empty in each new thread.
+    parsers = getattr(_thread_parsers, 'parsers', None)
+    if parsers == None:
+        parsers = _thread_parsers.parsers = {}
+    parser = parsers.get(fast)
+    if parser == None:
+        parser = parsers[fast] = ET.XMLParser(
+            remove_blank_text = True, 
+            remove_comments = fast,
+            huge_tree = fast,
+            # Skip the xml:id lookup table, which is never used.
+            collect_ids = not fast)
+    return parser
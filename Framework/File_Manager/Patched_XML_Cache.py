@@ -0,0 +1,223 @@
+'''
+Persistent cache of diff patched xml files.
+
+Applying every extension's diff patches to large files (eg. wares.xml)
+can take a notable part of a run, and normally gives the same result
+each time. This cache saves the patched xml to the customizer cache
+folder, keyed by the contents of the base file and of each patch in
+the order applied, so that a later run with the same inputs can skip
+the patching.
+
+Notes:
+    File contents are identified without reading them: catalog files
+    by their cat md5 hash and size, loose files by their size and
+    modification time.
+    Only patch results are cached; reads involving substitutions, or
+    which logged any message while patching, are not cached, so that
+    warnings are repeated on every run.
+    The parser options (Settings.fast_xml_parsing) are part of the key,
+    since fast parsing drops comments from the patched result.
+    Entry files have their modification time refreshed on each use,
+    and the least recently used are removed when the cache grows past
+    Settings.patched_xml_cache_size_mb.
+'''
+from ..Documentation import Doc_Category_Default
+_doc_category = Doc_Category_Default('File_Manager')
+
+import os
+import json
+import hashlib
+from time import time
+from lxml import etree as ET
+
+from ..Common import Settings
+from .File_Types import Get_XML_Parser
+
+# Version of the entry format and key scheme; changing this (eg. when
+# patch application logic changes) retires all old entries.
+_cache_version = 2
+
+
+class Patched_XML_Cache_class:
+    '''
+    Handles reading and writing patched xml cache entries.
+    A single static copy is shared by all readers.
+
+    Attributes:
+    * hits
+    * misses
+      - Ints, counts of lookups this session.
+    * added
+      - Bool, True if entries were added since the last Trim.
+    '''
+    folder_name = 'patched_xml'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.added = False
+        return
+
+
+    def _Get_Folder(self):
+        '''
+        Returns the path to the cache entry folder, creating it if needed.
+        '''
+        path = Settings.Get_Cache_Folder() / self.folder_name
+        path.mkdir(parents = True, exist_ok = True)
+        return path
+
+
+    def Make_Key(self, virtual_path, content_keys):
+        '''
+        Returns a key string for a patched file.
+
+        * virtual_path
+          - String, the file's virtual path.
+        * content_keys
+          - List of strings identifying the base file contents followed
+            by each patch's contents, in application order.
+
+        The current xml parser options are included, so that entries
+        patched with and without fast_xml_parsing are kept apart.
+        '''
+        parser_options = 'fast' if Settings.fast_xml_parsing else 'full'
+        key_str = '\n'.join(
+            [str(_cache_version), parser_options, virtual_path] + content_keys)
+        return hashlib.md5(key_str.encode('utf-8')).hexdigest()
+
+
+    def _Read_Entry(self, key):
+        '''
+        Returns a tuple of (patched xml binary, header dict) for the key,
+        or None if there is no readable entry.
+        '''
+        path = self._Get_Folder() / (key + '.xml')
+        try:
+            with open(path, 'rb') as file:
+                header = json.loads(file.readline())
+                binary = file.read()
+            # Mark as recently used.
+            os.utime(path)
+        # Any problem (missing, partial, etc.) is just a miss.
+        except Exception:
+            return None
+        return (binary, header)
+
+
+    def Get(self, key):
+        '''
+        Returns a tuple of (patched_root, source_extension_names) for
+        the key, or None if there is no valid entry.
+        '''
+        try:
+            binary, header = self._Read_Entry(key)
+            patched_root = ET.XML(binary, parser = Get_XML_Parser())
+        # Missing or unparsable entries are just a miss.
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (patched_root, header['source_extension_names'])
+
+
+    def Get_Binary(self, key):
+        '''
+        Returns a tuple of (patched xml binary, source_extension_names)
+        for the key, without parsing it, or None if there is no entry.
+        '''
+        entry = self._Read_Entry(key)
+        if entry == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        binary, header = entry
+        return (binary, header['source_extension_names'])
+
+
+    def Add(self, key, game_file):
+        '''
+        Saves the patched_root and source extension names of an
+        XML_File under the key. Failures are ignored.
+        '''
+        path = self._Get_Folder() / (key + '.xml')
+        header = json.dumps({
+            'virtual_path'           : game_file.virtual_path,
+            'source_extension_names' : game_file.source_extension_names,
+            })
+        try:
+            # Write to a temp file and swap it in, so a partial write
+            # never looks valid.
+            temp_path = path.with_suffix('.tmp')
+            with open(temp_path, 'wb') as file:
+                file.write(header.encode('utf-8') + b'\n')
+                file.write(ET.tostring(game_file.patched_root, encoding = 'utf-8'))
+            os.replace(temp_path, path)
+            self.added = True
+        except Exception:
+            pass
+        return
+
+
+    def _Get_Entries(self):
+        '''
+        Returns a list of (path, size, mtime) for all entry files,
+        oldest first.
+        '''
+        entries = []
+        with os.scandir(self._Get_Folder()) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.name.endswith('.xml'):
+                    continue
+                stat = dir_entry.stat()
+                entries.append((dir_entry.path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key = lambda x: x[2])
+
+
+    def Trim(self):
+        '''
+        Removes least recently used entries until the cache fits in
+        Settings.patched_xml_cache_size_mb. Skipped if nothing was
+        added since the last trim.
+        '''
+        if not self.added:
+            return
+        self.added = False
+        max_bytes = int(Settings.patched_xml_cache_size_mb) * 1024 * 1024
+        entries = self._Get_Entries()
+        total = sum(x[1] for x in entries)
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return
+
+
+    def Remove_Entries(self, max_age_days = None):
+        '''
+        Removes cache entries not used within max_age_days, or all
+        entries if max_age_days is None.
+        Returns a tuple of (entries removed, bytes freed).
+        '''
+        cutoff = None
+        if max_age_days != None:
+            cutoff = time() - float(max_age_days) * 24 * 60 * 60
+        num_removed = 0
+        bytes_freed = 0
+        for path, size, mtime in self._Get_Entries():
+            if cutoff != None and mtime >= cutoff:
+                continue
+            try:
+                os.remove(path)
+                num_removed += 1
+                bytes_freed += size
+            except OSError:
+                pass
+        return (num_removed, bytes_freed)
+
+# Static copy of the cache.
+Patched_XML_Cache = Patched_XML_Cache_class()
@@ -0,0 +1,141 @@
+'''
+Directory structured index of virtual paths, for fast wildcard queries.
+
+Wildcard patterns follow fnmatch rules, where "*" and "?" may match
+across "/" separators (eg. "md/*.xml" also matches "md/sub/x.xml").
+Since a match must begin with the literal text of the pattern before
+its first wildcard, the index walks that prefix through the folder
+tree, and only the paths below it are checked against the full pattern.
+Results match fnmatch.filter on the same paths.
+'''
+from ..Documentation import Doc_Category_Default
+_doc_category = Doc_Category_Default('File_Manager')
+
+import os
+import re
+import fnmatch
+
+
+# Marker key for a node that is also a file (as opposed to just
+# a folder). Cannot collide with path segment strings.
+_file_key = None
+
+
+class Virtual_Path_Index:
+    '''
+    Prefix tree over virtual paths, split on "/".
+
+    Attributes:
+    * root
+      - Dict, the top tree node. Each node is a dict keyed by path
+        segment, holding child nodes; a node holding the _file_key
+        is itself a file.
+    * num_paths
+      - Int, number of paths recorded.
+    '''
+    def __init__(self, virtual_paths = None):
+        self.root = {}
+        self.num_paths = 0
+        if virtual_paths != None:
+            for virtual_path in virtual_paths:
+                self.Add(virtual_path)
+        return
+
+
+    def Add(self, virtual_path):
+        '''
+        Records a virtual path. Repeated paths are ignored.
+        '''
+        node = self.root
+        for segment in virtual_path.split('/'):
+            child = node.get(segment)
+            if child == None:
+                child = {}
+                node[segment] = child
+            node = child
+        if _file_key not in node:
+            node[_file_key] = True
+            self.num_paths += 1
+        return
+
+
+    def Gen_Paths(self, node = None, prefix = ''):
+        '''
+        Generator yielding all paths at or below a node, each joined
+        onto the given prefix (which should include any trailing "/").
+        Defaults to the whole tree.
+        '''
+        if node == None:
+            node = self.root
+        # Use an explicit stack to avoid deep recursion.
+        stack = [(node, prefix)]
+        while stack:
+            node, prefix = stack.pop()
+            for segment, child in node.items():
+                if segment is _file_key:
+                    continue
+                path = prefix + segment
+                if _file_key in child:
+                    yield path
+                if len(child) > 1 or _file_key not in child:
+                    stack.append((child, path + '/'))
+        return
+
+
+    def Filter(self, pattern):
+        '''
+        Returns a list of recorded paths matching the wildcard pattern,
+        in the same manner as fnmatch.filter.
+        '''
+        # fnmatch.filter normalizes case and separators per os; paths
+        # here are already lowercase, but on windows a backslash in the
+        # pattern would also stand in for a forward slash.
+        if os.path.sep == '\\':
+            pattern = pattern.replace('\\', '/')
+
+        # Find the literal text ahead of any wildcard character.
+        wildcard_match = re.search(r'[*?[]', pattern)
+        if wildcard_match == None:
+            # Plain path; just look it up.
+            return [pattern] if self.Contains(pattern) else []
+        literal = pattern[ : wildcard_match.start()]
+
+        # Split into whole folders to walk, and a partial name that
+        # starts the next segment.
+        folders = literal.split('/')
+        name_start = folders.pop()
+
+        # Walk down the folders.
+        node = self.root
+        prefix = ''
+        for segment in folders:
+            node = node.get(segment)
+            if node == None:
+                return []
+            prefix += segment + '/'
+
+        # Gather candidates under children starting with the partial name,
+        # checking them against the full pattern.
+        regex = re.compile(fnmatch.translate(pattern))
+        paths = []
+        for segment, child in node.items():
+            if segment is _file_key or not segment.startswith(name_start):
+                continue
+            path = prefix + segment
+            if _file_key in child and regex.match(path):
+                paths.append(path)
+            paths.extend(x for x in self.Gen_Paths(child, path + '/')
+                         if regex.match(x))
+        return paths
+
+
+    def Contains(self, virtual_path):
+        '''
+        Returns True if the virtual path is recorded, else False.
+        '''
+        node = self.root
+        for segment in virtual_path.split('/'):
+            node = node.get(segment)
+            if node == None:
+                return False
+        return _file_key in node
@@ -94,8 +94,9 @@ Note on case:
 
 '''
 from lxml import etree as ET
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
 import fnmatch
+import heapq
 from time import time
 
 from . import File_Types
@@ -104,8 +105,128 @@ from ..Common import Settings
 from ..Common import File_Missing_Exception, Unmatched_Diff_Exception
 from ..Common import File_Loading_Error_Exception
 from ..Common import Plugin_Log, Print
-from .Source_Reader_Local import Location_Source_Reader
+from .Source_Reader_Local import Location_Source_Reader, Pck_Cache
+from .Cat_Reader import Get_Index_Cache_Summary, Cat_Hash_Verifier
 from .Extension_Finder import Find_Extensions
+from .Path_Index import Virtual_Path_Index
+from .Patched_XML_Cache import Patched_XML_Cache
+
+# Extension files that may substitute or patch a given virtual_path.
+# Kind is one of 'substitution' or 'patch'.
+Path_Contributor = namedtuple(
+    'Path_Contributor', 
+    ['extension_name', 'source_path', 'kind'])
+
+
+def Sort_By_Dependencies(names, hard_deps, soft_deps, priorities):
+    '''
+    Returns a list of the names, ordered so that dependencies come first.
+    Logs an error to the Plugin_Log for any dependency cycle.
+
+    * names
+      - List of unique extension names to sort.
+    * hard_deps
+    * soft_deps
+      - Dicts, keyed by name, holding lists of the names it depends on.
+        Missing keys mean no dependencies.
+    * priorities
+      - Dict, keyed by name, holding the integer sorting priority.
+
+    The order is built one name at a time. The next name is picked
+    from those with all hard and soft dependencies already placed,
+    or if there are none, those with just hard dependencies placed.
+    Among candidates, the lowest (priority, name) goes first.
+
+    This uses Kahn's algorithm: each name counts its unplaced
+    dependencies, and placing a name decrements the counts of those
+    depending on it. Names whose counts reach zero go onto one of two
+    heaps (all deps placed, or hard deps placed), so each pick is a
+    heap pop instead of a rescan of all names.
+
+    If no name has its hard dependencies placed, the remainder hold a
+    dependency cycle. The cycle is logged, and the lowest remaining
+    (priority, name) is placed regardless, so sorting can continue.
+    '''
+    # Count of unplaced dependencies per name, for hard deps alone and
+    # for all deps. Duplicate dependency entries are counted each time.
+    hard_counts = {}
+    all_counts = {}
+    # Lists of (dependent name, is_hard) per dependency name.
+    dependents = defaultdict(list)
+    for name in names:
+        hard_counts[name] = len(hard_deps.get(name, []))
+        all_counts[name] = hard_counts[name] + len(soft_deps.get(name, []))
+        for dep_name in hard_deps.get(name, []):
+            dependents[dep_name].append((name, True))
+        for dep_name in soft_deps.get(name, []):
+            dependents[dep_name].append((name, False))
+
+    # Heaps of (priority, name) candidates. Placed names are left in
+    # the heaps, and skipped when popped.
+    all_ready = []
+    hard_ready = []
+    for name in names:
+        if all_counts[name] == 0:
+            heapq.heappush(all_ready, (priorities[name], name))
+        if hard_counts[name] == 0:
+            heapq.heappush(hard_ready, (priorities[name], name))
+
+    placed = set()
+    sorted_names = []
+    while len(sorted_names) < len(names):
+
+        # Prefer candidates with all deps placed, then just hard deps.
+        pick = None
+        for heap in [all_ready, hard_ready]:
+            while heap and heap[0][1] in placed:
+                heapq.heappop(heap)
+            if heap:
+                pick = heapq.heappop(heap)[1]
+                break
+
+        # If neither had anything, there is a cycle.
+        if pick == None:
+            remaining = [x for x in names if x not in placed]
+            Plugin_Log.Print(('Error: extension dependency cycle found: {};'
+                ' ordering will ignore it').format(
+                    ' -> '.join(_Find_Dependency_Cycle(
+                        remaining, hard_deps, placed))))
+            pick = min(remaining, key = lambda x: (priorities[x], x))
+
+        placed.add(pick)
+        sorted_names.append(pick)
+
+        # Update those depending on the pick.
+        for name, is_hard in dependents.get(pick, []):
+            if name in placed:
+                continue
+            all_counts[name] -= 1
+            if all_counts[name] == 0:
+                heapq.heappush(all_ready, (priorities[name], name))
+            if is_hard:
+                hard_counts[name] -= 1
+                if hard_counts[name] == 0:
+                    heapq.heappush(hard_ready, (priorities[name], name))
+
+    return sorted_names
+
+
+def _Find_Dependency_Cycle(remaining, hard_deps, placed):
+    '''
+    Returns a list of names forming a hard dependency cycle, with the
+    first name repeated at the end. Every remaining name should have
+    an unplaced hard dependency.
+    '''
+    # Follow unplaced hard deps from the first name until one repeats.
+    path = []
+    index_dict = {}
+    name = min(remaining)
+    while name not in index_dict:
+        index_dict[name] = len(path)
+        path.append(name)
+        name = min(x for x in hard_deps[name] if x not in placed)
+    return path[index_dict[name]:] + [name]
+
 
 class Source_Reader_class:
     '''
@@ -129,12 +250,36 @@ class Source_Reader_class:
       - String, during xml patch application this is the name (folder) of the
         extension sourcing the patch.
       - For use by monitoring code.
+    * virtual_path_contributors
+      - Dict, keyed by virtual_path, holding a list of Path_Contributor
+        tuples for extension files that substitute or patch the path,
+        in extension load order.
+      - Built once the readers are set up; sorting extensions only
+        reorders the lists.
+    * extension_order
+      - Dict, keyed by extension name, holding its index in the
+        load order. Rebuilt whenever extensions are sorted.
+    * extension_path_kinds
+      - Dict, keyed by extension name, holding a dict of the virtual
+        paths that extension provides (prefixed with 'extensions/name/'
+        for new files), with the kind of each: 'add' for new files,
+        'replace' for substitutions, or 'patch' for the rest.
+      - Built on first use, and cleared when readers are added.
+      - Unaffected by extension order.
+    * path_owners
+      - Dict, keyed by virtual path, holding a set of names of the
+        extensions providing that path, built alongside
+        extension_path_kinds.
     '''
     def __init__(self):
         self.base_x4_source_reader    = None
         self.loose_source_reader      = None
         self.extension_source_readers = OrderedDict()
         self.ext_currently_patching = None
+        self.virtual_path_contributors = {}
+        self.extension_order = {}
+        self.extension_path_kinds = None
+        self.path_owners = None
         return
 
 
@@ -183,6 +328,13 @@ class Source_Reader_class:
 
             # Record using the extension name (its folder).
             self.extension_source_readers[reader.extension_name] = reader
+
+        # Any prior extension path index is out of date.
+        self.extension_path_kinds = None
+        self.path_owners = None
+        # List out which extensions touch which paths; this is only
+        # reordered by later sorts.
+        self.Build_Contributor_Index()
                 
         # Now sort the extension order to satisfy dependencies.
         self.Sort_Extensions()
@@ -191,7 +343,25 @@ class Source_Reader_class:
             Print('Source_Reader.Init time: {:.3f} s'.format(
                 time() - start
                 ))
+            Print(Get_Index_Cache_Summary())
+
+        return
+
 
+    def Close(self):
+        '''
+        Closes any open catalog dat files held by the location readers.
+        Pending background md5 checks are finished (logging any failures)
+        and verified hashes are saved first. Cached pck contents are
+        dropped, and the patched xml cache is trimmed to size.
+        '''
+        Cat_Hash_Verifier.Finish_Background_Checks(raise_errors = False)
+        Pck_Cache.Clear()
+        Patched_XML_Cache.Trim()
+        for reader in ([self.base_x4_source_reader, self.loose_source_reader]
+                       + list(self.extension_source_readers.values())):
+            if reader != None:
+                reader.Close()
         return
 
 
@@ -252,10 +422,17 @@ class Source_Reader_class:
                 ' used by {}').format( ext_id, readers ))
 
 
+        # Map ids to the readers using them, in folder order, so each
+        # dependency is a single lookup.
+        id_readers_dict = defaultdict(list)
+        for reader in sorted(self.extension_source_readers.values(),
+                             key = lambda k: k.extension_name):
+            id_readers_dict[reader.extension_summary.ext_id].append(reader)
+
         # Translate dependency ids into extension_names, when possible.
-        # These inner dicts are keyed by extension reader, holding lists of
+        # These inner dicts are keyed by extension name, holding lists of
         # known extension names; any missing id will be skipped.
-        reader_deps_dict_dict = {
+        name_deps_dict_dict = {
             'soft' : defaultdict(list),
             'hard' : defaultdict(list) }
 
@@ -269,29 +446,19 @@ class Source_Reader_class:
 
                     # Check for a match.
                     # Use folder order.
-                    matching_reader = None
-                    for reader in sorted(self.extension_source_readers.values(),
-                                         key = lambda k: k.extension_name):
-
-                        # Skip if not a match.
-                        if dep_id != reader.extension_summary.ext_id:
-                            continue
-                        # Record if no match yet found.
-                        if not matching_reader:
-                            matching_reader = reader
-                        # Otherwise print an error.
-                        else:
-                            Plugin_Log.Print(('Error: extension "{}" has'
-                                ' multiple dependency matches for id "{}";'
-                                ' only the first match will be used, as in x4.'
-                                ).format(
-                                    source_reader.extension_name, 
-                                    dep_id))
+                    matching_readers = id_readers_dict.get(dep_id)
+                    if matching_readers and len(matching_readers) > 1:
+                        Plugin_Log.Print(('Error: extension "{}" has'
+                            ' multiple dependency matches for id "{}";'
+                            ' only the first match will be used, as in x4.'
+                            ).format(
+                                source_reader.extension_name, 
+                                dep_id))
 
                     # Record the reader, if found.
-                    if matching_reader:
-                        reader_deps_dict_dict[dep_type][source_reader].append(
-                            matching_reader.extension_name)
+                    if matching_readers:
+                        name_deps_dict_dict[dep_type][source_reader.extension_name].append(
+                            matching_readers[0].extension_name)
                     else:
                         # If this is a hard dep, print an error but
                         # allow processing to continue.
@@ -301,55 +468,80 @@ class Source_Reader_class:
                                     source_reader.extension_name, 
                                     dep_id))
 
-
         # Now need to sort the extensions according to dependencies.
-        # A brute force appoach will be used, scheduling extensions
-        #  that have dependencies filled first, iterating until done.
-        # Each loop will move some number of summaries from unsorted_dict
-        #  to sorted_dict.
-        # This dict is keyed by extension_name.
-        sorted_dict = OrderedDict()
-
-        # Start the sorting process, with a safety limit.
-        limit = 10000
-        while unsorted_dict:
-            limit -= 1
-            if limit <= 0:
-                raise AssertionError('Something went wrong with extension sorting.')
-
-            # Gather which extensions can be sorted into the next slot.
-            # Start with all that have hard and soft dependencies filled.
-            valid_next_readers = [
-                reader for reader in unsorted_dict.values()
-                if all(dep_name in sorted_dict for dep_name in (
-                    reader_deps_dict_dict['hard'][reader] 
-                    + reader_deps_dict_dict['soft'][reader] ))]
-
-            # If none were found, try just those with hard dependencies filled.
-            if not valid_next_readers:
-                valid_next_readers = [
-                    reader for reader in unsorted_dict.values()
-                    if all(dep_name in sorted_dict 
-                           for dep_name in reader_deps_dict_dict['hard'][reader])]
-
-            # Now sort them in priority order, with secondary on lowercase
-            # folder name order.
-            valid_next_readers = sorted(
-                valid_next_readers,
-                # Priority goes first (low to high), then name.
-                key = lambda reader: (priorities[reader.extension_name], 
-                                   reader.extension_name))
-
-            # Pick the first one and schedule it.
-            pick = valid_next_readers[0]
-            sorted_dict[pick.extension_name] = pick
-            unsorted_dict.pop(pick.extension_name)
+        sorted_names = Sort_By_Dependencies(
+            names     = list(unsorted_dict.keys()),
+            hard_deps = name_deps_dict_dict['hard'],
+            soft_deps = name_deps_dict_dict['soft'],
+            priorities = priorities)
+        sorted_dict = OrderedDict(
+            (name, unsorted_dict[name]) for name in sorted_names)
 
         # Store the sorted list.
         self.extension_source_readers = sorted_dict
+
+        # Contributor ordering follows the extensions, so refresh it.
+        self._Order_Contributors()
+        return
+
+
+    def Build_Contributor_Index(self):
+        '''
+        Fills in virtual_path_contributors and extension_order from the
+        current extension readers and their order.
+        This lists every extension's files, so is only done when the
+        readers change; Sort_Extensions just reorders the result.
+        '''
+        if Settings.profile:
+            start = time()
+
+        path_contributors_dict = defaultdict(list)
+        for ext_name, ext_reader in self.extension_source_readers.items():
+            # Substitutions only come from 'subst_' catalogs; patches
+            # come from 'ext_' catalogs and loose files. These match the
+            # searches that Read would otherwise do per extension.
+            for kind, cat_prefix, include_loose_files in [
+                    ('substitution', 'subst_', False),
+                    ('patch',        'ext_',   True)]:
+                for virtual_path, source_path in ext_reader.Get_Source_Paths(
+                        cat_prefix = cat_prefix, 
+                        include_loose_files = include_loose_files).items():
+                    path_contributors_dict[virtual_path].append(
+                        Path_Contributor(ext_name, source_path, kind))
+
+        self.virtual_path_contributors = dict(path_contributors_dict)
+        self._Order_Contributors()
+        
+        if Settings.profile:
+            Print('Source_Reader.Build_Contributor_Index time: {:.3f} s'.format(
+                time() - start
+                ))
         return
 
 
+    def _Order_Contributors(self):
+        '''
+        Refreshes extension_order from the current reader order, and
+        sorts each virtual_path_contributors list to match.
+        '''
+        self.extension_order = {
+            name : i for i, name in enumerate(self.extension_source_readers)}
+        # Sorts are stable, so kinds from one extension keep their order
+        # (substitution ahead of patch).
+        for contributors in self.virtual_path_contributors.values():
+            contributors.sort(key = lambda x: self.extension_order[x.extension_name])
+        return
+
+
+    def Get_Path_Contributors(self, virtual_path):
+        '''
+        Returns a list of Path_Contributors for the virtual_path, in
+        extension order. Extensions holding the file as a gzipped pck
+        are included, since source paths list pcks by unpacked name.
+        '''
+        return self.virtual_path_contributors.get(virtual_path, [])
+
+
     def Get_Extension_Names(self):
         '''
         Returns a list of names of all enabled extensions.
@@ -357,6 +549,97 @@ class Source_Reader_class:
         return [x.extension_name for x in self.extension_source_readers.values()]
     
 
+    def Build_Extension_Path_Index(self):
+        '''
+        Fills in extension_path_kinds and path_owners from the current
+        extension readers.
+        '''
+        if Settings.profile:
+            start = time()
+
+        # Get the base x4 paths, to check against.
+        # Note: this set is cached by the reader, so don't modify it.
+        base_paths = self.base_x4_source_reader.Get_Virtual_Paths()
+
+        extension_path_kinds = {}
+        path_owners = defaultdict(set)
+        for ext_name, ext_reader in self.extension_source_readers.items():
+            subst_paths = ext_reader.Get_Source_Paths(
+                cat_prefix = 'subst_', include_loose_files = False)
+
+            path_kinds = {}
+            extension_path_kinds[ext_name] = path_kinds
+            for ext_path in ext_reader.Get_Virtual_Paths():
+                # Paths matching a base file, or a file in another
+                # extension, are kept as-is.
+                # Note: since the other extension case would indicate diff
+                # patching, and file loading goes before diff patching, the
+                # other extension could be later in the load order and
+                # its file would still be found fine.
+                if (ext_path in base_paths 
+                or self._Is_Other_Extension_Path(ext_name, ext_path)):
+                    virtual_path = ext_path
+                    kind = 'replace' if ext_path in subst_paths else 'patch'
+                else:
+                    # Otherwise the file will be found by prefixing the
+                    # path with the extension folder.
+                    virtual_path = f'extensions/{ext_name}/{ext_path}'
+                    kind = 'add'
+                path_kinds[virtual_path] = kind
+                path_owners[virtual_path].add(ext_name)
+
+        self.extension_path_kinds = extension_path_kinds
+        self.path_owners = dict(path_owners)
+
+        if Settings.profile:
+            Print('Source_Reader.Build_Extension_Path_Index time: {:.3f} s'.format(
+                time() - start
+                ))
+        return
+
+
+    def _Is_Other_Extension_Path(self, ext_name, ext_path):
+        '''
+        Returns True if ext_path, from the named extension, refers to
+        a file held in a different extension, eg. "extensions/other/x.xml"
+        where "other" holds "x.xml".
+        '''
+        if not ext_path.startswith('extensions/'):
+            return False
+        split = ext_path.split('/', 2)
+        if len(split) < 3:
+            return False
+        _, other_name, other_path = split
+        return (other_name != ext_name
+                and other_name in self.extension_source_readers
+                and other_path in self.extension_source_readers[other_name].Get_Virtual_Paths())
+
+
+    def Get_Extension_Path_Kinds(self, ext_name):
+        '''
+        Returns a dict of the virtual paths provided by the given extension,
+        with values of 'add', 'replace', or 'patch'.
+        If the name doesn't match a known extension, this returns 
+        an empty dict.
+        '''
+        if self.extension_path_kinds == None:
+            self.Build_Extension_Path_Index()
+        return self.extension_path_kinds.get(ext_name, {})
+
+
+    def Get_Path_Owners(self, virtual_path):
+        '''
+        Returns a list of names of extensions that provide the given
+        virtual path, in extension load order.
+        '''
+        if self.path_owners == None:
+            self.Build_Extension_Path_Index()
+        owners = self.path_owners.get(virtual_path.lower())
+        if not owners:
+            return []
+        return sorted(owners, key = lambda x: self.extension_order[x])
+
+
     def Gen_Extension_Virtual_Paths(self, ext_name):
         '''
         Returns the virtual paths for the given extension.
@@ -365,34 +648,7 @@ class Source_Reader_class:
         If the name doesn't match a known extension, this returns 
         an empty list.
         '''
-        if ext_name not in self.extension_source_readers:
-            return []
-
-        # Get the base x4 paths, to check against.
-        base_paths = self.base_x4_source_reader.Get_Virtual_Paths()
-
-        # Also get other extensions.
-        # Note: since such cases would indicate diff patching, and file
-        # loading goes before diff patching, the other extension could
-        # be later in the load order and its file would still be found fine.
-        ext_paths = []
-        for reader_name, ext_reader in self.extension_source_readers.items():
-            if reader_name == ext_name:
-                continue
-            for ext_path in ext_reader.Get_Virtual_Paths():
-                # In this case, the file will be found by prefixing the
-                # path with the extension folder.
-                ext_paths.append(f'extensions/{reader_name}/{ext_path}')
-        base_paths |= set(ext_paths)
-
-        # Go through the paths returned by the extension reader.
-        for ext_path in self.extension_source_readers[ext_name].Get_Virtual_Paths():
-            # If this matches a base_path, return it as-is.
-            if ext_path in base_paths:
-                yield ext_path
-            # Otherwise, prefix it.
-            else:
-                yield f'extensions/{ext_name}/{ext_path}'
+        yield from self.Get_Extension_Path_Kinds(ext_name)
         return
 
     
@@ -442,11 +698,14 @@ class Source_Reader_class:
 
             # Cache the result, casting to set to uniquify paths.
             self._all_virtual_paths = set(path_list)
+            # Index them for pattern lookups.
+            self._virtual_path_index = Virtual_Path_Index(self._all_virtual_paths)
 
             if Settings.profile:
                 Print('Source_Reader.Gen_All_Virtual_Paths build time: {:.3f} s'.format(
                     time() - start
                     ))
+                Print(Get_Index_Cache_Summary())
                 
         # -Removed for now, in favor of building a list below.
         # With the paths filled in, can do a pass to yield each path.
@@ -469,7 +728,10 @@ class Source_Reader_class:
             # this up.
             #paths = [x for x in self._all_virtual_paths
             #         if fnmatch.fnmatch(x, pattern)]
-            paths = fnmatch.filter(self._all_virtual_paths, pattern)
+            #paths = fnmatch.filter(self._all_virtual_paths, pattern)
+            # Further speed up by using the path index, which only
+            # checks paths under the pattern's leading literal text.
+            paths = self._virtual_path_index.Filter(pattern)
 
             if Settings.profile:
                 Print('Source_Reader.Gen_All_Virtual_Paths fnmatch time: {:.3f} s'.format(
@@ -487,6 +749,7 @@ class Source_Reader_class:
             virtual_path,
             error_if_not_found = True,
             error_if_unmatched_diff = False,
+            delayed_init = True,
         ):
         '''
         Returns a Game_File intialized with the contents read from
@@ -508,6 +771,10 @@ class Source_Reader_class:
           - Bool, if True a Unmatched_Diff_Exception will be thrown
             if the assumed base file is found to be a diff patch.
           - Default is to log an error and return None.
+        * delayed_init
+          - Bool, if False then the game file's Delayed_Init is left
+            for the caller, eg. when reading in a worker process whose
+            node ids would not be unique in the main process.
         '''
         # Always work with lowercase virtual paths.
         # (Note: this may have been done already in the File_System, but
@@ -521,6 +788,7 @@ class Source_Reader_class:
         # selected extension if present, else from the base x4 folder
         # or source folder.
         game_file = None
+        base_reader = None
         if virtual_path.startswith('extensions/'):
             # Can split on all '/' and take the second term for the
             # extension name, 3rd term for virtual path within that
@@ -534,7 +802,8 @@ class Source_Reader_class:
                 # TODO: consider instead giving the whole virtual_path
                 # and a base_file flag to let the location source reader
                 # deal with picking the path apart locally.
-                game_file = self.extension_source_readers[ext_name].Read(ext_path)
+                base_reader = self.extension_source_readers[ext_name]
+                game_file = base_reader.Read(ext_path)
 
                 # Fix the virtual_path that was attached to the file.
                 # The reader only give its local path.
@@ -544,9 +813,11 @@ class Source_Reader_class:
         else:
             # Read from the source and base x4 locations.
             if self.loose_source_reader != None:
-                game_file = self.loose_source_reader.Read(virtual_path)
+                base_reader = self.loose_source_reader
+                game_file = base_reader.Read(virtual_path)
             if game_file == None:
-                game_file = self.base_x4_source_reader.Read(virtual_path)
+                base_reader = self.base_x4_source_reader
+                game_file = base_reader.Read(virtual_path)
 
             # Special case: if the game_file is not found, and it is a
             # text file, generate a dummy version of it. This is so that
@@ -593,6 +864,22 @@ class Source_Reader_class:
             return None
 
 
+        # Check for a cached result of the patching below.
+        patch_cache_key = None
+        if (isinstance(game_file, File_Types.XML_File)
+        and not game_file.load_error):
+            patch_cache_key = self._Get_Patch_Cache_Key(
+                virtual_path, base_reader, game_file.file_source_path)
+        if patch_cache_key != None:
+            cached = Patched_XML_Cache.Get(patch_cache_key)
+            if cached != None:
+                game_file.patched_root, game_file.source_extension_names = cached
+                if delayed_init:
+                    game_file.Delayed_Init()
+                return game_file
+            # Note log messages, so results with warnings are not cached.
+            num_messages = Plugin_Log.num_messages
+
         # Step 2: collect any patches/substitutions.
         # These can come from any extension, except the one the file
         #  was sourced from (if it came from an ext).
@@ -604,7 +891,11 @@ class Source_Reader_class:
             if game_file.load_error and mode == 'patch':
                 continue
 
-            for ext_reader in self.extension_source_readers.values():
+            # Only visit extensions known to hold this path.
+            for contributor in self.Get_Path_Contributors(virtual_path):
+                if contributor.kind != mode:
+                    continue
+                ext_reader = self.extension_source_readers[contributor.extension_name]
 
                 # Skip if this ext is the original source.
                 # This should be harmless to allow, but saves a little time.
@@ -623,21 +914,12 @@ class Source_Reader_class:
                 self.ext_currently_patching = ext_reader.extension_name
                 
                 try:
-                    # Get the file, if any.
-                    if mode == 'substitution':
-                        # For substitutions, want to just search the 'subst_'
-                        # catalogs and not any loose files.
-                        ext_game_file = ext_reader.Read(
-                            virtual_path,
-                            include_loose_files = False,
-                            cat_prefix = 'subst_')
-                    else:
-                        # For patches, want to search the 'ext_' catalogs and
-                        # any loose files.
-                        ext_game_file = ext_reader.Read(
-                            virtual_path,
-                            include_loose_files = True,
-                            cat_prefix = 'ext_')
+                    # Get the file from its known source.
+                    # For substitutions, this is a 'subst_' catalog; for 
+                    # patches, an 'ext_' catalog or loose file.
+                    ext_game_file = ext_reader.Read(
+                        virtual_path,
+                        source_path = contributor.source_path)
                         
                 # Catch File_Loading_Error_Exception errors here,
                 # to more reliably skip over problem patch files.
@@ -648,8 +930,8 @@ class Source_Reader_class:
                          ).format(ext_reader.extension_name, ex))
                     continue
                 
-                # Skip if no matching file was found.
-                # This is the normal case.
+                # Skip if no file came back; not expected with a known
+                # source, but keep the check for safety.
                 if ext_game_file == None:
                     continue            
 
@@ -662,12 +944,108 @@ class Source_Reader_class:
         # Clear out the patching note.
         self.ext_currently_patching = None
 
+        # Save the patching result for next time.
+        if (patch_cache_key != None 
+        and Plugin_Log.num_messages == num_messages):
+            Patched_XML_Cache.Add(patch_cache_key, game_file)
+
         # Finish initializing the xml file once patching is complete.
-        game_file.Delayed_Init()
+        if delayed_init:
+            game_file.Delayed_Init()
 
         return game_file
 
 
+    def Read_Patched_Binary(self, virtual_path):
+        '''
+        Returns the xml binary that Read would produce for the file,
+        when it can be had without any patching: the source binary of
+        a file with no extension patches or substitutions, or a saved
+        Patched_XML_Cache result. Otherwise returns None, including
+        when the file is not found.
+        The binary may be a memoryview into a mapped dat file.
+        Intended for read-only streaming of files that are not loaded.
+
+        * virtual_path
+          - String, virtual path of the file to look up.
+        '''
+        virtual_path = virtual_path.lower()
+
+        # Find the base version, as in Read.
+        base_reader = None
+        if virtual_path.startswith('extensions/'):
+            _, ext_name, ext_path = virtual_path.split('/',2)
+            if ext_name not in self.extension_source_readers:
+                return None
+            base_reader = self.extension_source_readers[ext_name]
+            source_path, binary = base_reader.Read_Binary(ext_path)
+        else:
+            binary = None
+            if self.loose_source_reader != None:
+                base_reader = self.loose_source_reader
+                source_path, binary = base_reader.Read_Binary(virtual_path)
+            if binary == None:
+                base_reader = self.base_x4_source_reader
+                source_path, binary = base_reader.Read_Binary(virtual_path)
+        # Missing and empty files are left to Read.
+        if not binary:
+            return None
+
+        # Check for anything that would change the file.
+        if not any(x.extension_name != base_reader.extension_name
+                   for x in self.Get_Path_Contributors(virtual_path)):
+            return binary
+
+        # Use a saved patching result if available.
+        patch_cache_key = self._Get_Patch_Cache_Key(
+            virtual_path, base_reader, source_path)
+        if patch_cache_key != None:
+            cached = Patched_XML_Cache.Get_Binary(patch_cache_key)
+            if cached != None:
+                return cached[0]
+        return None
+
+
+    def _Get_Patch_Cache_Key(self, virtual_path, base_reader, source_path):
+        '''
+        Returns the Patched_XML_Cache key for an xml file read from
+        the base_reader and its source_path, if its patching result can
+        be cached, else None.
+        Only files with patches (and no substitutions) are cached.
+        '''
+        if (not Settings.use_patched_xml_cache
+        or base_reader == None):
+            return None
+
+        # Start with the base file, then each patch in order.
+        # Extension readers know the base file by its local path.
+        local_path = virtual_path
+        if base_reader.extension_name != None:
+            local_path = virtual_path.split('/',2)[2]
+        content_key = base_reader.Get_Content_Key(local_path, source_path)
+        if content_key == None:
+            return None
+        content_keys = [content_key]
+
+        for contributor in self.Get_Path_Contributors(virtual_path):
+            # Matches the skip in Read.
+            if contributor.extension_name == base_reader.extension_name:
+                continue
+            if contributor.kind == 'substitution':
+                return None
+            ext_reader = self.extension_source_readers[contributor.extension_name]
+            content_key = ext_reader.Get_Content_Key(
+                virtual_path, contributor.source_path)
+            if content_key == None:
+                return None
+            content_keys.append(contributor.extension_name + ' ' + content_key)
+
+        # Skip files with nothing to patch.
+        if len(content_keys) == 1:
+            return None
+        return Patched_XML_Cache.Make_Key(virtual_path, content_keys)
+
+
     def Get_All_Loose_Source_Files(self):
         '''
         Returns a dict of absolute paths to all loose files in the loose
@@ -3,15 +3,19 @@ from ..Documentation import Doc_Category_Default
 _doc_category = Doc_Category_Default('File_Manager')
 
 from pathlib import Path
+import os
 from collections import OrderedDict, defaultdict
 from itertools import chain
+import zlib
 
 from . import File_Types
 from .Cat_Reader import Cat_Reader
+from .Dir_Walker import Walk_Files, List_Folder
 from .. import Common
 from ..Common import Settings
 from ..Common import File_Missing_Exception
 from ..Common import File_Loading_Error_Exception
+from ..Common import Gzip_Exception
 from ..Common import Plugin_Log, Print
 
 
@@ -42,6 +46,139 @@ valid_virtual_path_prefixes =  (
     'vulkan/',
     )
 
+def Get_Pck_Path(virtual_path):
+    '''
+    Returns the gzipped ".pck" form of the given virtual_path, or None
+    if the path has no suffix to replace or is already a pck.
+    Eg. "md/setup.xml" becomes "md/setup.pck".
+    '''
+    folder, _, name = virtual_path.rpartition('/')
+    if '.' not in name or name.endswith('.pck'):
+        return None
+    name = name.rsplit('.',1)[0] + '.pck'
+    return folder + '/' + name if folder else name
+
+
+def Get_Unpacked_Path(virtual_path):
+    '''
+    Returns the virtual_path a ".pck" file is read under, or None if the
+    path is not a pck. This is the inverse of Get_Pck_Path, assuming
+    the packed file is xml (the only kind x4 packs).
+    Eg. "md/setup.pck" becomes "md/setup.xml".
+    '''
+    if not virtual_path.endswith('.pck'):
+        return None
+    return virtual_path[:-len('.pck')] + '.xml'
+
+
+def Resolve_Pck_Paths(path_dict):
+    '''
+    Returns a copy of a dict keyed by virtual_path, with ".pck" keys
+    renamed to their unpacked paths. Where a file is present both
+    unpacked and as a pck, the unpacked entry is kept, matching the
+    lookup order of Location_Source_Reader.Read.
+    '''
+    resolved = {}
+    pck_items = []
+    for virtual_path, value in path_dict.items():
+        if virtual_path.endswith('.pck'):
+            pck_items.append((virtual_path, value))
+        else:
+            resolved[virtual_path] = value
+    for virtual_path, value in pck_items:
+        resolved.setdefault(Get_Unpacked_Path(virtual_path), value)
+    return resolved
+
+
+def Decompress_Pck(binary, chunk_size = 1 << 20):
+    '''
+    Returns the decompressed bytes of gzipped pck file contents.
+    The input is fed to zlib in chunks, so a memoryview into a mapped
+    dat is never copied in full. Raises Gzip_Exception on bad data.
+    '''
+    view = memoryview(binary)
+    output = bytearray()
+    try:
+        # wbits of 16+MAX_WBITS selects the gzip header format.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        position = 0
+        while position < len(view):
+            chunk = view[position : position + chunk_size]
+            position += chunk_size
+            output += decompressor.decompress(chunk)
+            # Concatenated gzip members are allowed; start on the next
+            # with whatever data followed the finished member.
+            while decompressor.eof and decompressor.unused_data:
+                leftover = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                output += decompressor.decompress(leftover)
+        output += decompressor.flush()
+        if not decompressor.eof:
+            raise zlib.error('truncated data')
+    except zlib.error as ex:
+        raise Gzip_Exception(str(ex))
+    return bytes(output)
+
+
+class Pck_Cache_class:
+    '''
+    Size bounded, least-recently-used cache of decompressed pck file
+    contents, so that rereading a file (eg. after File_System.Reset_File)
+    does not decompress it again. A single static copy is shared by
+    all readers, and is cleared when the source readers are closed.
+
+    Attributes:
+    * max_bytes
+      - Int, limit on the total decompressed bytes held.
+    * cache
+      - OrderedDict of decompressed bytes, keyed by (source path string,
+        pck virtual path), ordered oldest use first.
+    * num_bytes
+      - Int, current total bytes held.
+    '''
+    def __init__(self, max_bytes = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.num_bytes = 0
+        return
+
+    def Get(self, key):
+        '''
+        Returns the cached binary for the key, or None.
+        '''
+        binary = self.cache.get(key)
+        if binary != None:
+            self.cache.move_to_end(key)
+        return binary
+
+    def Add(self, key, binary):
+        '''
+        Records a binary, evicting the least recently used as needed.
+        Binaries larger than the whole cache are not kept.
+        '''
+        if len(binary) > self.max_bytes:
+            return
+        if key in self.cache:
+            self.num_bytes -= len(self.cache.pop(key))
+        self.cache[key] = binary
+        self.num_bytes += len(binary)
+        while self.num_bytes > self.max_bytes:
+            _, old_binary = self.cache.popitem(last = False)
+            self.num_bytes -= len(old_binary)
+        return
+
+    def Clear(self):
+        '''
+        Drops all cached binaries.
+        '''
+        self.cache.clear()
+        self.num_bytes = 0
+        return
+
+# Static cache object.
+Pck_Cache = Pck_Cache_class()
+
+
 class Location_Source_Reader:
     '''
     Class used to look up source files from a single location, such as the
@@ -82,6 +219,9 @@ class Location_Source_Reader:
         from each of the catalog readers.
     * all_virtual_paths
       - Set of all virtual paths in the catalogs or loose files.
+    * source_path_dicts
+      - Dict, keyed by (cat_prefix, include_loose_files) search arguments,
+        holding cached results of Get_Source_Paths.
     '''
     def __init__(
             self, 
@@ -98,6 +238,7 @@ class Location_Source_Reader:
         self.source_file_path_dict = None
         self.cat_path_entry_dict = None
         self.all_virtual_paths = None
+        self.source_path_dicts = {}
 
         # Search for cats and loose files if location given.
         if location != None:
@@ -106,6 +247,25 @@ class Location_Source_Reader:
         return
     
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+        return
+
+
+    def Close(self):
+        '''
+        Closes any open dat files held by catalog readers.
+        Readers stay valid, and will reopen their dat files if read again.
+        '''
+        for cat_reader in self.catalog_file_dict.values():
+            if cat_reader != None:
+                cat_reader.Close()
+        return
+
+
     def Find_Catalogs(self, location):
         '''
         Find and record all catalog files at the given location,
@@ -157,6 +317,17 @@ class Location_Source_Reader:
         else:
             prefixes = ['']
 
+        # Get the cat file names once, rather than checking each name
+        # on disk. Extension summaries already hold them.
+        # Names are normalized so that windows remains case insensitive.
+        if (self.extension_summary != None 
+        and self.extension_summary.content_xml_path.parent == Path(self.location)):
+            cat_names = set(os.path.normcase(x) 
+                            for x in self.extension_summary.catalog_names)
+        else:
+            cat_names = set(name for name, entry in List_Folder(self.location).items()
+                            if entry.is_file())
+
         for prefix in prefixes:
             # Loop until a cat index not found.
             cat_index = 1
@@ -164,10 +335,10 @@ class Location_Source_Reader:
                 # Error if hit 100.
                 assert cat_index < 100
                 cat_name = '{}{:02d}.cat'.format(prefix, cat_index)
-                cat_path = self.location / cat_name
                 # Stop if the cat file is not found.
-                if not cat_path.exists():
+                if os.path.normcase(cat_name) not in cat_names:
                     break
+                cat_path = self.location / cat_name
                 # Record it.
                 cat_dir_list_low_to_high.append(cat_path)
                 # Increment for the next cat.
@@ -203,51 +374,47 @@ class Location_Source_Reader:
         '''
         self.source_file_path_dict = {}
 
-        # Dynamically find all files in the source folder.
-        # The glob pattern means: 
-        #  '**' (recursive search of directories, starting from current)
-        #  '/*' (all files or subdirs in that dir)
-        # Note: to limit overhead from looking at invalid paths, the
-        # outer loop would ideally be limited to the valid path prefixes,
-        # though glob is case sensitive so this might not work great.
-        # TODO: revisit this.
+        # Pick the folders to walk, from the valid path prefixes.
+        # Note: the base folder prefix ('') is handled separately, being
+        #  just the flat directory exe files.
+        top_folders = set()
         for path_prefix in valid_virtual_path_prefixes:
-
             # Ignore the extensions folder if this is the base cat reader.
             if not self.is_extension and path_prefix == 'extensions/':
                 continue
-            # Ignore the base folder for extensions.
-            if self.is_extension and path_prefix == '':
+            if path_prefix:
+                top_folders.add(path_prefix[:-1])
+
+        # Walk all files in those folders in one pass.
+        # Unchanged folder trees can reuse a prior walk, since only the
+        #  file paths are needed here.
+        for record in Walk_Files(
+                self.location, 
+                top_folders = top_folders,
+                use_snapshot = Settings.use_folder_walk_cache):
+            rel_path = record.rel_path
+
+            # Skip sig files; don't care about those.
+            if rel_path.endswith('.sig'):
                 continue
 
-            # Pick the globbing pattern.
-            # If a path_prefix is given, get everything under it.
-            # If no prefix given, just the flat directory, select files.
-            if path_prefix:
-                glob_pattern = path_prefix+'**/*'
-            else:
-                glob_pattern = '*.exe'
+            # The relative path will be the same as a virtual path
+            # once lowercased.
+            virtual_path = rel_path.lower()
 
-            for file_path in self.location.glob(glob_pattern):
-                # Skip folders.
-                if not file_path.is_file():
+            # Files in the base folder are only exe files for the
+            # base reader; ignored for extensions.
+            if '/' not in virtual_path:
+                if self.is_extension or not virtual_path.endswith('.exe'):
                     continue
-                # Skip sig files; don't care about those.
-                if file_path.suffix == '.sig':
-                    continue
-
-                # Isolate the relative part of the path.
-                # This will be the same as a virtual path once lowercased.
-                # Convert from Path to a posix style string (forward slashes).
-                virtual_path = file_path.relative_to(self.location).as_posix().lower()
 
-                # Skip if this doesn't start in an x4 subfolder.
-                if not any(virtual_path.startswith(x) 
-                           for x in valid_virtual_path_prefixes):
-                    continue
+            # Skip if this doesn't start in an x4 subfolder.
+            elif not any(virtual_path.startswith(x) 
+                       for x in valid_virtual_path_prefixes if x):
+                continue
 
-                # Can now record it, with lower case virtual_path.
-                self.source_file_path_dict[virtual_path.lower()] = file_path
+            # Can now record it, with lower case virtual_path.
+            self.source_file_path_dict[virtual_path] = self.location / rel_path
         return
 
 
@@ -316,6 +483,8 @@ class Location_Source_Reader:
         by catalogs or loose files, relative to the location.
         These may need prefixing for extension files that
         are not present at the base x4 location.
+        Gzipped ".pck" files are listed under their unpacked ".xml"
+        path, the same as they are read.
         '''
         # Cache the results to avoid doing more than once.
         if self.all_virtual_paths == None:
@@ -330,11 +499,95 @@ class Location_Source_Reader:
             cat_paths = list(self.Get_Cat_Entries().keys())
 
             # Join the lists and cast to a set to uniquify.
-            self.all_virtual_paths = set(loose_paths + cat_paths)
+            self.all_virtual_paths = set(Resolve_Pck_Paths(
+                dict.fromkeys(loose_paths + cat_paths)))
 
         return self.all_virtual_paths
 
 
+    def Get_Source_Paths(self, cat_prefix = None, include_loose_files = True):
+        '''
+        Returns a dict, keyed by virtual_path, holding the path of the
+        catalog or loose file that Read would pull each file from when
+        given the same search arguments.
+        Gzipped ".pck" files are keyed by their unpacked ".xml" path.
+
+        * cat_prefix
+          - Optional string, prefix of catalog files to search.
+        * include_loose_files
+          - Bool, if True then loose files are included.
+        '''
+        key = (cat_prefix, include_loose_files)
+        if key not in self.source_path_dicts:
+            # Loop over the cats in reverse priority order, so that higher
+            # priority cats overwrite lower ones.
+            cat_dict = {}
+            for cat_path in reversed(self.catalog_file_dict):
+                if cat_prefix and not cat_path.name.startswith(cat_prefix):
+                    continue
+                cat_reader = self.Get_Catalog_Reader(cat_path)
+                cat_dict.update(dict.fromkeys(cat_reader.Get_Cat_Entries(), cat_path))
+
+            if not include_loose_files:
+                path_dict = cat_dict
+            # Merge loose files according to the same preference as Read,
+            # with the preferred source applied last.
+            elif Settings.prefer_single_files:
+                path_dict = dict(cat_dict)
+                path_dict.update(self.Get_All_Loose_Files())
+            else:
+                path_dict = dict(self.Get_All_Loose_Files())
+                path_dict.update(cat_dict)
+            self.source_path_dicts[key] = Resolve_Pck_Paths(path_dict)
+
+        return self.source_path_dicts[key]
+
+
+    def Read_Source_File(self, virtual_path, source_path, 
+                         allow_md5_error = False, as_memoryview = False):
+        '''
+        Returns a tuple of (source_path, file_binary) for a file read
+        directly from the given catalog or loose file source_path,
+        as found through Get_Source_Paths.
+        If no file found, returns (source_path, None).
+        Input virtual_path should be lowercase.
+        '''
+        if source_path in self.catalog_file_dict:
+            file_binary = self.Get_Catalog_Reader(source_path).Read(
+                virtual_path, 
+                allow_md5_error = allow_md5_error,
+                as_memoryview = as_memoryview)
+            return (source_path, file_binary)
+        return self.Read_Loose_File(virtual_path)
+
+
+    def Get_Content_Key(self, virtual_path, source_path):
+        '''
+        Returns a string identifying the contents Read would return for
+        the virtual_path from the given catalog or loose file source_path,
+        without reading the file, or None if unknown.
+        Catalog files use their cat hash and size; loose files use their
+        size and modification time.
+        '''
+        if source_path == None:
+            return None
+        try:
+            if source_path in self.catalog_file_dict:
+                cat_entries = self.Get_Catalog_Reader(source_path).Get_Cat_Entries()
+                # Check for the file as named, then as a pck.
+                for search_path in [virtual_path, Get_Pck_Path(virtual_path)]:
+                    if search_path != None and search_path in cat_entries:
+                        cat_entry = cat_entries[search_path]
+                        return 'cat {} {} {}'.format(
+                            search_path, cat_entry.num_bytes, cat_entry.hash_str)
+                return None
+            stat = Path(source_path).stat()
+            return 'loose {} {} {}'.format(
+                Path(source_path).as_posix(), stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            return None
+
+
     def Read_Loose_File(self, virtual_path, **kwargs):
         '''
         Returns a tuple of (file_path, file_binary) for a loose file
@@ -354,7 +607,8 @@ class Location_Source_Reader:
 
 
     def Read_Catalog_File(self, virtual_path, 
-                          cat_prefix = None, allow_md5_error = False):
+                          cat_prefix = None, allow_md5_error = False,
+                          as_memoryview = False, md5_policy = None):
         '''
         Returns a tuple of (cat_path, file_binary) for a cat/dat entry
         matching the given virtual_path.
@@ -365,6 +619,12 @@ class Location_Source_Reader:
           - Optional string, prefix of catalog files to search.
         * allow_md5_error
           - Bool, if True then the md5 check will be suppressed.
+        * as_memoryview
+          - Bool, if True then a memoryview into a mapped dat file may
+            be returned instead of bytes; see Cat_Reader.Read.
+        * md5_policy
+          - Optional string, md5 verification policy override;
+            see Cat_Reader.Read.
         '''
         cat_path = None
         file_binary = None
@@ -382,7 +642,9 @@ class Location_Source_Reader:
 
             # Check the cat for the file.
             file_binary = cat_reader.Read(virtual_path, 
-                                          allow_md5_error = allow_md5_error)
+                                          allow_md5_error = allow_md5_error,
+                                          as_memoryview = as_memoryview,
+                                          md5_policy = md5_policy)
 
             # Stop looping over cats once a match found.
             if file_binary != None:
@@ -391,12 +653,116 @@ class Location_Source_Reader:
         return (cat_path, file_binary)
     
 
+    def _Search_File(
+            self, 
+            virtual_path, 
+            include_loose_files = True,
+            cat_prefix = None,
+            allow_md5_error = False,
+        ):
+        '''
+        Searches loose files and catalogs for the virtual_path, returning
+        a tuple of (source_path, file_binary). The binary is None if
+        the file was not found. See Read for arguments.
+        '''
+        # Can pick from either loose files or cat/dat files.
+        # Preference is taken from Settings.
+        if Settings.prefer_single_files:
+            method_order = [self.Read_Loose_File, self.Read_Catalog_File]
+        else:
+            method_order = [self.Read_Catalog_File, self.Read_Loose_File]
+
+        # Maybe skip loose file checks.
+        if not include_loose_files:
+            method_order.remove(self.Read_Loose_File)
+
+        # Call the search methods in order, looking for the first to
+        #  fill in file_binary. This will also record where the data
+        #  was read from, for debug printout and identifying patches
+        #  vs overwrites (by cat name).
+        source_path = None
+        file_binary = None
+        for method in method_order:
+            # Call the function. Pass some args.
+            source_path, file_binary = method(
+                virtual_path, 
+                cat_prefix = cat_prefix,
+                allow_md5_error = allow_md5_error,
+                as_memoryview = True,
+                )
+            if file_binary != None:
+                break
+        return (source_path, file_binary)
+
+
+    def Read_Binary(self, 
+                    virtual_path,
+                    include_loose_files = True,
+                    cat_prefix = None,
+                    allow_md5_error = False,
+                    source_path = None,
+                    ):
+        '''
+        Returns a tuple of (source_path, file_binary) for the file Read
+        would load, unzipping a pck if needed, without building a
+        Game_File. The binary is None if the file was not found, and
+        may be a memoryview into a mapped dat file.
+        See Read for arguments.
+        '''
+        # Ensure the virtual_path is lowercase.
+        virtual_path = virtual_path.lower()
+
+        # Look for the file as named, then for a gzipped pck version.
+        known_source_path = source_path
+        for search_path in [virtual_path, Get_Pck_Path(virtual_path)]:
+            if search_path == None:
+                continue
+
+            # If the source is already known, go straight to it.
+            # Catalog reads may hand back a view into a mapped dat file,
+            # avoiding a copy; game files copy out what they keep.
+            if known_source_path != None:
+                source_path, file_binary = self.Read_Source_File(
+                    search_path, 
+                    known_source_path,
+                    allow_md5_error = allow_md5_error,
+                    as_memoryview = True,
+                    )
+            else:
+                source_path, file_binary = self._Search_File(
+                    search_path,
+                    include_loose_files = include_loose_files,
+                    cat_prefix = cat_prefix,
+                    allow_md5_error = allow_md5_error,
+                    )
+            if file_binary == None:
+                continue
+
+            # Unzip pck files, reusing a prior result if available.
+            if search_path != virtual_path:
+                cache_key = (str(source_path), search_path)
+                unzipped_binary = Pck_Cache.Get(cache_key)
+                if unzipped_binary == None:
+                    try:
+                        unzipped_binary = Decompress_Pck(file_binary)
+                    except Gzip_Exception as ex:
+                        message = ('Error when unzipping file "{}" from "{}";'
+                                   ' original exception: {}.').format(
+                                       search_path, source_path, ex)
+                        raise File_Loading_Error_Exception(message) from ex
+                    Pck_Cache.Add(cache_key, unzipped_binary)
+                file_binary = unzipped_binary
+            break
+        return (source_path, file_binary)
+
+
     def Read(self, 
              virtual_path,
              include_loose_files = True,
              cat_prefix = None,
              error_if_not_found = False,
              allow_md5_error = False,
+             source_path = None,
              ):
         '''
         Returns a Game_File intialized with the contents read from
@@ -407,6 +773,8 @@ class Location_Source_Reader:
           - String, virtual path of the file to look up.
           - For files which may be gzipped into a pck file, give the
             expected non-zipped extension (.xml, .txt, etc.).
+          - If no file is found under this name, a ".pck" version is
+            looked for and unzipped.
         * include_loose_files
           - Bool, if True then loose files are searched.
         * cat_prefix
@@ -418,38 +786,21 @@ class Location_Source_Reader:
         * allow_md5_error
           - Bool, if True then the md5 check will be suppressed and
             errors allowed. May still print a warning message.
+        * source_path
+          - Optional path to the catalog or loose file to read from,
+            as returned by Get_Source_Paths.
+          - When given, the search arguments are ignored.
         '''
         # Ensure the virtual_path is lowercase.
         virtual_path = virtual_path.lower()
+        source_path, file_binary = self.Read_Binary(
+            virtual_path,
+            include_loose_files = include_loose_files,
+            cat_prefix = cat_prefix,
+            allow_md5_error = allow_md5_error,
+            source_path = source_path,
+            )
 
-        # Can pick from either loose files or cat/dat files.
-        # Preference is taken from Settings.
-        if Settings.prefer_single_files:
-            method_order = [self.Read_Loose_File, self.Read_Catalog_File]
-        else:
-            method_order = [self.Read_Catalog_File, self.Read_Loose_File]
-
-        # Maybe skip loose file checks.
-        if not include_loose_files:
-            method_order.remove(self.Read_Loose_File)
-
-
-        # Call the search methods in order, looking for the first to
-        #  fill in file_binary. This will also record where the data
-        #  was read from, for debug printout and identifying patches
-        #  vs overwrites (by cat name).
-        source_path = None
-        file_binary = None
-        for method in method_order:
-            # Call the function. Pass some args.
-            source_path, file_binary = method(
-                virtual_path, 
-                cat_prefix = cat_prefix,
-                allow_md5_error = allow_md5_error,
-                )
-            if file_binary != None:
-                break
-            
         # If no binary was found, error.
         if file_binary == None:
             if error_if_not_found:
@@ -0,0 +1,208 @@
+'''
+Compact text lookup table for a t file, parsed a page at a time.
+
+Text lookups usually touch a handful of pages out of the thousands in
+a language file, so fully parsing it into an lxml tree (and keeping
+that tree) is mostly wasted. This table instead keeps the raw file
+binary, with a byte range for each page found by a quick scan, and
+parses a page into a plain {id: text} dict on the first lookup of
+its page id. Once every page is parsed, the binary is dropped.
+
+Notes:
+    The scan skips "<page" text inside comments and CDATA. If the
+    file is not utf-8, or any page fails to parse on its own, the
+    whole file is parsed instead, so results always match lookups
+    on the full xml (first page of a given id, first t of a given id).
+    If the whole file fails to parse, a File_Loading_Error_Exception
+    is raised, as when loading the file normally.
+'''
+from ..Documentation import Doc_Category_Default
+_doc_category = Doc_Category_Default('File_Manager')
+
+import re
+from lxml import etree as ET
+
+from ..Common import File_Loading_Error_Exception
+from .File_Types import Get_XML_Parser
+
+
+# Matches the start of a page node, or a comment or cdata section to skip.
+_page_scan_re = re.compile(
+    rb'<page[\s/>]|<!--.*?-->|<!\[CDATA\[.*?\]\]>', re.DOTALL)
+# Matches a full page start tag, walking its quoted attributes so that
+# any ">" or "id=" inside a value is skipped; group 1 is the attributes,
+# group 2 is "/" for a self closing page.
+_page_tag_re = re.compile(
+    rb'''<page((?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|'[^']*'))*)\s*(/?)>''')
+# Matches one attribute from the above, giving its name and value.
+_attribute_re = re.compile(
+    rb'''([^\s=/>]+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+# Matches an xml declaration encoding.
+_encoding_re = re.compile(rb'''\s*<\?xml[^>]*encoding\s*=\s*["']([^"']+)["']''')
+
+
+class Text_Table:
+    '''
+    Lookup table of text, keyed by page id and t id.
+
+    * binary
+      - Optional bytes (or memoryview) of the t file xml. A copy is
+        kept until all pages are parsed.
+    * xml_root
+      - Optional parsed language node, to fill the table from directly.
+    * virtual_path
+      - Optional string, the file's virtual path, for error messages.
+
+    Attributes:
+    * page_text_dict
+      - Dict, keyed by page id string, holding dicts of text keyed by
+        t id string, for pages parsed so far.
+    * page_ranges
+      - Dict, keyed by page id string, holding lists of (start, end)
+        byte ranges of unparsed pages.
+    * binary
+      - Bytes of the file while pages remain unparsed, else None.
+      - If set with no page_ranges, the whole file still needs parsing.
+    * virtual_path
+    '''
+    def __init__(self, binary = None, xml_root = None, virtual_path = None):
+        self.page_text_dict = {}
+        self.page_ranges = {}
+        self.binary = None
+        self.virtual_path = virtual_path
+        if xml_root != None:
+            self._Fill_From_Root(xml_root)
+        elif binary:
+            self.binary = bytes(binary)
+            if not self._Scan_Pages():
+                self.page_ranges.clear()
+                self._Parse_All()
+        return
+
+
+    def _Scan_Pages(self):
+        '''
+        Fills page_ranges from the binary. Returns False if the file
+        cannot be handled a page at a time.
+        '''
+        binary = self.binary
+        # Byte ranges are only found in utf-8 (or ascii) text.
+        if binary.startswith((b'\xff\xfe', b'\xfe\xff')):
+            return False
+        match = _encoding_re.match(binary.lstrip(b'\xef\xbb\xbf'))
+        if match and match.group(1).lower() not in (b'utf-8', b'utf8'):
+            return False
+
+        for match in _page_scan_re.finditer(binary):
+            # Skip comments and cdata.
+            if match.group(0)[1] == ord('!'):
+                continue
+            start = match.start()
+            tag_match = _page_tag_re.match(binary, start)
+            if tag_match == None:
+                return False
+            tag_end = tag_match.end()
+            # Self closing pages end with their start tag.
+            if tag_match.group(2):
+                end = tag_end
+            else:
+                end = binary.find(b'</page>', tag_end)
+                if end < 0:
+                    return False
+                end += len(b'</page>')
+
+            # Take the attribute named exactly "id", if any.
+            page_id = None
+            for attr_match in _attribute_re.finditer(tag_match.group(1)):
+                if attr_match.group(1) == b'id':
+                    page_id = (attr_match.group(2) if attr_match.group(2) != None
+                               else attr_match.group(3))
+                    break
+            if page_id == None:
+                # Pages without ids cannot be looked up.
+                continue
+            # Escaped ids would need xml unescaping; leave those to lxml.
+            if b'&' in page_id:
+                return False
+            page_id = page_id.decode('utf-8')
+            self.page_ranges.setdefault(page_id, []).append((start, end))
+        return True
+
+
+    def _Fill_Page(self, page_node):
+        '''
+        Adds the text of a parsed page node to page_text_dict, keeping
+        earlier entries on repeated ids.
+        '''
+        text_dict = self.page_text_dict.setdefault(page_node.get('id'), {})
+        for t_node in page_node.iterchildren('t'):
+            text_dict.setdefault(t_node.get('id'), t_node.text)
+        return
+
+
+    def _Fill_From_Root(self, xml_root):
+        '''
+        Fills page_text_dict with all pages of a language node.
+        '''
+        for page_node in xml_root.iterchildren('page'):
+            if page_node.get('id') != None:
+                self._Fill_Page(page_node)
+        return
+
+
+    def _Parse_All(self):
+        '''
+        Parses the whole binary into page_text_dict, dropping the binary
+        and any page ranges.
+        On bad xml, raises File_Loading_Error_Exception, keeping the
+        binary so that later lookups raise again.
+        '''
+        self.page_ranges.clear()
+        try:
+            xml_root = ET.XML(self.binary, parser = Get_XML_Parser())
+        except ET.XMLSyntaxError as ex:
+            message = ('Error when parsing text file "{}"; original'
+                       ' exception: {}.').format(self.virtual_path, ex)
+            raise File_Loading_Error_Exception(message) from ex
+        self.binary = None
+        self.page_text_dict.clear()
+        self._Fill_From_Root(xml_root)
+        return
+
+
+    def _Parse_Page(self, page_id):
+        '''
+        Parses the unparsed ranges of a page id into page_text_dict.
+        '''
+        ranges = self.page_ranges.pop(page_id)
+        try:
+            for start, end in ranges:
+                self._Fill_Page(ET.XML(
+                    self.binary[start : end], parser = Get_XML_Parser()))
+        except ET.XMLSyntaxError:
+            # The scan was off somewhere; fall back on the full file.
+            self._Parse_All()
+            return
+        if not self.page_ranges:
+            self.binary = None
+        return
+
+
+    def Read(self, page, id):
+        '''
+        Returns the text at the given page and id, or None if not found.
+
+        * page, id
+          - Int or string.
+        '''
+        page = str(page)
+        if page in self.page_ranges:
+            self._Parse_Page(page)
+        elif self.binary != None and not self.page_ranges:
+            # A prior full parse failed; try it again, to raise again.
+            self._Parse_All()
+        text_dict = self.page_text_dict.get(page)
+        if text_dict == None:
+            return None
+        return text_dict.get(str(id))
+
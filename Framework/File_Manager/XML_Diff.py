@@ -135,6 +135,7 @@ Note on namespaces:
 from lxml import etree as ET
 from copy import deepcopy
 from itertools import zip_longest
+import itertools
 import random
 import time # Used for some profiling.
 
@@ -175,7 +176,9 @@ copyreg.pickle(ET._Element, LXML_Element_Pickler, LXML_Element_Depickler)
 
 # Statically track the number of node id values assigned, and just
 # keep incrementing this.
-_running_id = 0
+# Note: a count object is used so that ids stay unique when files are
+# handled in threads (eg. parallel catalog writing).
+_running_id = itertools.count()
 def Fill_Node_IDs(xml_node):
     '''
     For all elements, fill their tail property with a unique integer
@@ -185,13 +188,11 @@ def Fill_Node_IDs(xml_node):
     so it should be safe to call this on already annotated xml to
     fill out ids for new nodes.
     '''
-    global _running_id
     # Loop over the nodes, including comments.
     for node in xml_node.iter():
         # If the tail is empty, fill it in.
         if not node.tail:
-            node.tail = str(_running_id)
-            _running_id += 1
+            node.tail = str(next(_running_id))
     return xml_node
 
 
@@ -235,6 +235,11 @@ def Run(*args):
         Settings.disable_cleanup_and_writeback = True
                 
 
+    # Queue up files hinted by the transforms the script calls, to be
+    # read in the background once the first plugin runs.
+    Framework.File_System.prefetch_patterns.extend(
+        Framework.Common.Plugin_Manager.Get_Script_Input_Hints(args.control_script))
+
     Print('Calling {}'.format(args.control_script))
     try:
         # Attempt to load/run the module.
@@ -132,6 +132,12 @@ Writing custom edit code:
     (which includes any prior transform changes), make any custom edits
     with the help of the lxml package, and to put the changes back using
     Update_Root().
+  * Alternatively, "with file.Edit_Root() as root:" edits the current
+    root in place, skipping the copies, and rolls back the edits if
+    an exception occurs.
+  * For read-only scans, Query_XML() yields the nodes of a given tag
+    and attributes from a file, streaming it when not loaded so that
+    only the matches are kept in memory.
   * Existing plugins offer examples of this approach.
   * Edits made using the framework will automatically support
     diff patch generation.
@@ -11,7 +11,7 @@ from .Support import *
 
 # TODO: expand this with per-mission selections, though they
 # will need more work finding the right nodes to edit.
-@Transform_Wrapper()
+@Transform_Wrapper(inputs = 'md/lib_reward_balancing.xml')
 def Adjust_Mission_Rewards(
         # Allow multipliers to be given as a loose list of args.
         multiplier = 1,
@@ -86,7 +86,7 @@ def Adjust_Mission_Rewards(
 
 
 
-@Transform_Wrapper()
+@Transform_Wrapper(inputs = 'md/gm_*')
 def Adjust_Mission_Reward_Mod_Chance(
         new_chance = 2,
     ):
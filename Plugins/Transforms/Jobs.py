@@ -10,7 +10,7 @@ from .Support import Standardize_Match_Rules
 from .Support import XML_Multiply_Int_Attribute
 from .Support import XML_Multiply_Float_Attribute
 
-@Transform_Wrapper()
+@Transform_Wrapper(inputs = 'libraries/jobs.xml')
 def Adjust_Job_Count(
         # Allow job multipliers to be given as a loose list of args.
         *job_multipliers,
@@ -54,65 +54,64 @@ def Adjust_Job_Count(
     rules = Standardize_Match_Rules(job_multipliers)
     
     jobs_game_file = Load_File('libraries/jobs.xml')
-    xml_root = jobs_game_file.Get_Root()
+    with jobs_game_file.Edit_Root() as xml_root:
         
-    # Loop over the jobs.
-    for job in xml_root.findall('./job'):
+        # Loop over the jobs.
+        for job in xml_root.findall('./job'):
         
-        quota = job.find('quota')
-        # Check if this is a wing ship.
-        # Could also check modifiers.subordinate.
-        is_wing = quota.get('wing') != None
+            quota = job.find('quota')
+            # Check if this is a wing ship.
+            # Could also check modifiers.subordinate.
+            is_wing = quota.get('wing') != None
         
-        # Look up the tags and a couple other properties of interest.
-        job_id      = job.get('id')
-        # The category node may not be present.
-        category = job.find('category')
-        if category != None:
-            faction  = category.get('faction')
-            size     = category.get('size')
-            # Parse the tags to separate them, removing
-            #  brackets and commas splitting.
-            tags     = [x.strip(' []') for x in category.get('tags').split(',') if x]
-        else:
-            faction  = None
-            size     = None
-            tags     = []
+            # Look up the tags and a couple other properties of interest.
+            job_id      = job.get('id')
+            # The category node may not be present.
+            category = job.find('category')
+            if category != None:
+                faction  = category.get('faction')
+                size     = category.get('size')
+                # Parse the tags to separate them, removing
+                #  brackets and commas splitting.
+                tags     = [x.strip(' []') for x in category.get('tags').split(',') if x]
+            else:
+                faction  = None
+                size     = None
+                tags     = []
 
-        # Always ignore the dummy_job, to be safe.
-        if job_id == 'dummy_job':
-            continue
+            # Always ignore the dummy_job, to be safe.
+            if job_id == 'dummy_job':
+                continue
 
-        # Check the matching rules.
-        multiplier = None
-        for key, value, mult in rules:
+            # Check the matching rules.
+            multiplier = None
+            for key, value, mult in rules:
 
-            # Non-wing matches.
-            if not is_wing:
-                if((key == '*')
-                or (key == 'id' and fnmatch(job_id, value))
-                or (key == 'faction' and faction == value)
-                # Check all tags, space separated.
-                or (key == 'tags' and all(x in tags for x in value.split(' ')))
-                # For sizes, add a 'ship_' prefix to the match_str.
-                or (key == 'size' and size == ('ship_'+value)) ):
-                    multiplier = mult
-                    break
+                # Non-wing matches.
+                if not is_wing:
+                    if((key == '*')
+                    or (key == 'id' and fnmatch(job_id, value))
+                    or (key == 'faction' and faction == value)
+                    # Check all tags, space separated.
+                    or (key == 'tags' and all(x in tags for x in value.split(' ')))
+                    # For sizes, add a 'ship_' prefix to the match_str.
+                    or (key == 'size' and size == ('ship_'+value)) ):
+                        multiplier = mult
+                        break
 
-            # Restrictive wing matches.
-            else:
-                # Only support on a perfect id match.
-                if key == 'id' and job_id == value:
-                    multiplier = mult
-                    break
+                # Restrictive wing matches.
+                else:
+                    # Only support on a perfect id match.
+                    if key == 'id' and job_id == value:
+                        multiplier = mult
+                        break
 
-        # Skip if no match.
-        if multiplier == None:
-            continue
+            # Skip if no match.
+            if multiplier == None:
+                continue
 
-        # Apply the multiplier to fields of the quota node.
-        for name, value in quota.items():
-            XML_Multiply_Int_Attribute(quota, name, multiplier)
+            # Apply the multiplier to fields of the quota node.
+            for name, value in quota.items():
+                XML_Multiply_Int_Attribute(quota, name, multiplier)
                         
-    jobs_game_file.Update_Root(xml_root)
     return
@@ -17,7 +17,7 @@ __all__ = [
 
 
 
-@Transform_Wrapper()
+@Transform_Wrapper(inputs = '*aiscripts/*.xml')
 def Increase_AI_Script_Waits(
         oos_multiplier = 2,
         oos_seta_multiplier = 4,
@@ -206,7 +206,7 @@ def Increase_AI_Script_Waits(
     return
 
 
-@Transform_Wrapper()
+@Transform_Wrapper(inputs = '*aiscripts/*.xml')
 def Adjust_OOS_Damage(multiplier):
     '''
     Adjusts all out-of-vision damage-per-second by a multiplier. For instance,
@@ -263,7 +263,7 @@ def Adjust_OOS_Damage(multiplier):
 
 
 
-@Transform_Wrapper()
+@Transform_Wrapper(inputs = '*aiscripts/*.xml')
 def Disable_AI_Travel_Drive():
     '''
     Disables usage of travel drives for all ai scripts. When applied to
@@ -10,6 +10,9 @@ given as 16-bit hex characters, eg. \033#7F7F7F# for grey.
 TODO: verify this before adding to function doc.
 '''
 
+# Note: t files are not hinted as inputs for prefetch; parsing every
+# language up front is costly, and text lookups elsewhere only read
+# the pages they need.
 @Transform_Wrapper(category = 'Text')
 def Color_Text(
         *page_t_colors
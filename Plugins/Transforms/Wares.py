@@ -39,7 +39,7 @@ doc_matching_rules = '''
     </code>
     '''
 
-@Transform_Wrapper(shared_docs = doc_matching_rules)
+@Transform_Wrapper(shared_docs = doc_matching_rules, inputs = 'libraries/wares.xml')
 def Adjust_Ware_Price_Spread(
         # Allow multipliers to be given as a loose list of args.
         *match_rule_multipliers
@@ -53,47 +53,46 @@ def Adjust_Ware_Price_Spread(
       - Series of matching rules paired with the spread multipliers to use.
     '''
     wares_file = Load_File('libraries/wares.xml')
-    xml_root = wares_file.Get_Root()
+    with wares_file.Edit_Root() as xml_root:
 
-    # Get wars paired with multipliers.
-    for ware, multiplier in Gen_Wares_Matched_To_Args(xml_root, match_rule_multipliers):
+        # Get wars paired with multipliers.
+        for ware, multiplier in Gen_Wares_Matched_To_Args(xml_root, match_rule_multipliers):
         
-        # Look up the existing spread.
-        price_node = ware.find('./price')
-        price_min  = int(price_node.get('min'))
-        price_avg  = int(price_node.get('average'))
-        price_max  = int(price_node.get('max'))
-
-        # If price is 0 or 1, just skip.
-        if price_avg in [0,1]:
-            continue
-
-        # Can individually adjust the min and max separations from average.
-        new_min = round(price_avg - (price_avg - price_min) * multiplier)
-        new_max = round(price_avg + (price_max - price_avg) * multiplier)
-
-        # Limit to a spread of 10 credits or more from min to max,
-        # or 5 from average.
-        if new_min > price_avg - 5:
-            new_min = price_avg - 5
-        if new_max < price_avg + 5:
-            new_max = price_avg + 5
-
-        # If min dropped to 0, bump it back to 1.
-        if new_min <= 0:
-            new_min = 1
-            # Adjust max to have the same spread from average.
-            new_max = price_avg + (price_avg - new_min)
-
-        # Put them back.
-        price_node.set('min', str(int(new_min)))
-        price_node.set('max', str(int(new_max)))
+            # Look up the existing spread.
+            price_node = ware.find('./price')
+            price_min  = int(price_node.get('min'))
+            price_avg  = int(price_node.get('average'))
+            price_max  = int(price_node.get('max'))
+
+            # If price is 0 or 1, just skip.
+            if price_avg in [0,1]:
+                continue
+
+            # Can individually adjust the min and max separations from average.
+            new_min = round(price_avg - (price_avg - price_min) * multiplier)
+            new_max = round(price_avg + (price_max - price_avg) * multiplier)
+
+            # Limit to a spread of 10 credits or more from min to max,
+            # or 5 from average.
+            if new_min > price_avg - 5:
+                new_min = price_avg - 5
+            if new_max < price_avg + 5:
+                new_max = price_avg + 5
+
+            # If min dropped to 0, bump it back to 1.
+            if new_min <= 0:
+                new_min = 1
+                # Adjust max to have the same spread from average.
+                new_max = price_avg + (price_avg - new_min)
+
+            # Put them back.
+            price_node.set('min', str(int(new_min)))
+            price_node.set('max', str(int(new_max)))
 
-    wares_file.Update_Root(xml_root)
     return
 
 
-@Transform_Wrapper(shared_docs = doc_matching_rules)
+@Transform_Wrapper(shared_docs = doc_matching_rules, inputs = 'libraries/wares.xml')
 def Adjust_Ware_Prices(
         # Allow multipliers to be given as a loose list of args.
         *match_rule_multipliers
@@ -106,17 +105,16 @@ def Adjust_Ware_Prices(
       - Series of matching rules paired with the spread multipliers to use.
     '''
     wares_file = Load_File('libraries/wares.xml')
-    xml_root = wares_file.Get_Root()
+    with wares_file.Edit_Root() as xml_root:
 
-    # Get wars paired with multipliers.
-    for ware, multiplier in Gen_Wares_Matched_To_Args(xml_root, match_rule_multipliers):
+        # Get wars paired with multipliers.
+        for ware, multiplier in Gen_Wares_Matched_To_Args(xml_root, match_rule_multipliers):
         
-        # Adjust everything in the price subnode.
-        price = ware.find('price')
-        for name, value in price.items():
-            XML_Multiply_Int_Attribute(price, name, multiplier)
+            # Adjust everything in the price subnode.
+            price = ware.find('price')
+            for name, value in price.items():
+                XML_Multiply_Int_Attribute(price, name, multiplier)
             
-    wares_file.Update_Root(xml_root)
     return
 
 
@@ -0,0 +1,26 @@
+
+from Framework.Documentation import Doc_Category_Default
+_doc_category = Doc_Category_Default('Utilities')
+
+from Framework import Utility_Wrapper
+from Framework import Print
+from Framework.File_Manager.Patched_XML_Cache import Patched_XML_Cache
+
+
+@Utility_Wrapper(uses_paths_from_settings = False)
+def Clean_Patched_XML_Cache(max_age_days = 30):
+    '''
+    Removes saved results from the patched xml cache (in the customizer
+    "cache" folder). Entries for old extension versions are never
+    reused, so this can reclaim space after mods are updated.
+    Returns a tuple of (entries removed, bytes freed).
+
+    * max_age_days
+      - Number, entries not used within this many days are removed.
+      - If None, all entries are removed.
+      - Defaults to 30.
+    '''
+    num_removed, bytes_freed = Patched_XML_Cache.Remove_Entries(max_age_days)
+    Print('Removed {} patched xml cache files ({:.1f} MB)'.format(
+        num_removed, bytes_freed / (1024 * 1024)))
+    return (num_removed, bytes_freed)
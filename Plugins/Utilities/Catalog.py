@@ -3,12 +3,16 @@ from Framework.Documentation import Doc_Category_Default
 _doc_category = Doc_Category_Default('Utilities')
 
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 # Note: re was looked at, but deemed overkill when just regular
 # wildcard expressions are good enough for all expected uses.
 #import re
 from fnmatch import fnmatch
 
 from Framework import Utility_Wrapper, File_Manager, Cat_Hash_Exception, Print
+from Framework import Settings
+from .Generate_Diffs import Generate_Diff_From_Binaries
 
 
 @Utility_Wrapper(uses_paths_from_settings = False)
@@ -17,7 +21,8 @@ def Cat_Unpack(
         dest_dir_path,
         include_pattern  = None,
         exclude_pattern  = None,
-        allow_md5_errors = False
+        allow_md5_errors = False,
+        num_workers      = None,
     ):
     '''
     Unpack a single catalog file, or a group if a folder given.
@@ -44,7 +49,14 @@ def Cat_Unpack(
       - Bool, if True then files with md5 errors will be unpacked, otherwise
         they are skipped.
       - Such errors may arise from poorly constructed catalog files.
+    * num_workers
+      - Int, optional, number of threads used to check, read, and
+        write files.
+      - Defaults to the python thread pool default, based on cpu count.
+      - Set to 1 to unpack one file at a time.
     '''
+    start_time = time()
+
     # Do some error checking on the paths.
     try:
         source_cat_path = Path(source_cat_path).resolve()
@@ -69,31 +81,9 @@ def Cat_Unpack(
     if isinstance(exclude_pattern, str):
         exclude_pattern = [exclude_pattern]
 
-        
-    # Sourcing behavior depends on if a folder or file given.
-    if source_cat_path.is_dir():
-
-        # Set up a reader for the source location.
-        # If this is an extension, it needs some more annotation; can
-        # test for the content.xml at the path.
-        extension_summary = None
-        content_xml_path = source_cat_path / 'content.xml'
-        if content_xml_path.exists():
-            extension_summary = File_Manager.Extension_Finder.Extension_Summary(content_xml_path)
 
-        source_reader = File_Manager.Source_Reader.Location_Source_Reader(
-            location = source_cat_path,
-            extension_summary = extension_summary)
-
-        # Print how many catalogs were found.
-        Print(('{} catalog files found using standard naming convention.'
-               ).format(len(source_reader.catalog_file_dict)))
-    else:
-        # Set up an empty reader.
-        source_reader = File_Manager.Source_Reader.Location_Source_Reader(
-            location = None)
-        # Manually add the cat path to it.
-        source_reader.Add_Catalog(source_cat_path)
+    # Set up a reader for the catalogs.
+    source_reader = _Get_Catalog_Reader(source_cat_path)
 
 
     # Some counts for printout at the end.
@@ -101,77 +91,270 @@ def Cat_Unpack(
     num_pattern_skips = 0
     num_hash_skips    = 0
     num_md5_skips     = 0
+    num_bytes_written = 0
     
 
     # TODO:
     # Record a json record of already extracted file hashes, for fast
     # checking them instead of re-hashing every time.
 
-    # TODO:
-    # Switch to pulling out all virtual_paths first, then use fnmatch.filter
-    # on them for each pattern, then use some set operations to merge the
-    # results down to the desired set of paths.
-    # This would mostly be useful if switching to storing hashes from
-    # prior extractions for fast comparison, as currently the hashing
-    # takes far more time than the fnmatching.
-
-    # Loop over the Cat_Entry objects; the reader takes care of
-    #  cat priorities.
-    # Note: virtual_path is lowercase, but cat_entry.cat_path has
-    #  original case.
-    for virtual_path, cat_entry in source_reader.Get_Cat_Entries().items():
-
-        # Skip if a pattern given and this doesn't match.
-        if not _Pattern_Match(virtual_path, include_pattern, exclude_pattern):
-            num_pattern_skips += 1
-            continue
-
-        dest_path = dest_dir_path / cat_entry.cat_path
-
-        # To save some effort, check if the file already exists at
-        #  the dest, and if so, get its md5 hash.
-        if dest_path.exists():
-            existing_binary = dest_path.read_bytes()
-            dest_hash = File_Manager.Cat_Reader.Get_Hash_String(existing_binary)
-            # If hashes match, skip.
-            # Ego uses 0's instead of a proper hash for empty files, so also
-            # check that case.
-            if (dest_hash == cat_entry.hash_str 
-            or (not existing_binary and cat_entry.hash_str == '00000000000000000000000000000000')):
-                num_hash_skips += 1
-                continue
-
-        # Make a folder for the dest if needed.
-        dest_path.parent.mkdir(parents = True, exist_ok = True)
-
-        # Get the file binary, catching any md5 error.
-        # This will only throw the exception if allow_md5_errors is False.
-        try:
-            cat_path, file_binary = source_reader.Read_Catalog_File(
-                virtual_path,
-                allow_md5_error = allow_md5_errors)
-        except Cat_Hash_Exception:
-            num_md5_skips += 1
-            continue
-        
-        # Write it back out to the destination.
-        with open(dest_path, 'wb') as file:
-            file.write(file_binary)
-
-        # Be verbose for now.
-        num_writes += 1
-        Print('Extracted {}'.format(virtual_path))
-
+    # Release the dat file mappings (and finish any background md5
+    # checks) even if unpacking fails partway, so the dat files are
+    # not left locked.
+    try:
+        # Collect the entries to unpack, tracking which cat reader each
+        # comes from. Cats are visited in priority order, so the first
+        # sighting of a path is the one to use.
+        # Note: virtual_path is lowercase, but cat_entry.cat_path has
+        #  original case.
+        unpack_list = []
+        seen_paths = set()
+        for cat_index, cat_path in enumerate(source_reader.catalog_file_dict):
+            cat_reader = source_reader.Get_Catalog_Reader(cat_path)
+
+            for virtual_path, cat_entry in cat_reader.Get_Cat_Entries().items():
+                if virtual_path in seen_paths:
+                    continue
+                seen_paths.add(virtual_path)
+
+                # Skip if a pattern given and this doesn't match.
+                if not _Pattern_Match(virtual_path, include_pattern, exclude_pattern):
+                    num_pattern_skips += 1
+                    continue
+                unpack_list.append((cat_index, cat_entry.start_byte, 
+                                    virtual_path, cat_entry, cat_reader))
+
+        # Sort by dat and position within it, so that reads sweep forward
+        # through each dat file instead of jumping around.
+        unpack_list.sort(key = lambda x: x[:2])
+
+
+        def Unpack_Entry(entry):
+            '''
+            Unpacks a single entry, if it differs from the destination.
+            Returns a tuple of (result string, bytes written), where the
+            result is one of 'write', 'hash_skip', or 'md5_skip'.
+            '''
+            cat_index, start_byte, virtual_path, cat_entry, cat_reader = entry
+            dest_path = dest_dir_path / cat_entry.cat_path
+
+            # To save some effort, check if the file already exists at
+            #  the dest, and if so and the size matches, get its md5 hash.
+            # A size mismatch means the file surely changed, so skip
+            #  reading and hashing it.
+            try:
+                dest_size = dest_path.stat().st_size
+            except OSError:
+                dest_size = None
+            if dest_size == cat_entry.num_bytes:
+                existing_binary = dest_path.read_bytes()
+                # If hashes match, skip.
+                if File_Manager.Cat_Reader.Hash_Matches(existing_binary, cat_entry.hash_str):
+                    return ('hash_skip', 0)
+
+            # Get the file binary, catching any md5 error.
+            # This will only throw the exception if allow_md5_errors is False.
+            # This is written straight back out, so a view into the mapped
+            # dat is fine.
+            # Always hash eagerly here, since bad files should be caught
+            # before they are written out.
+            try:
+                file_binary = cat_reader.Read(
+                    virtual_path,
+                    allow_md5_error = allow_md5_errors,
+                    as_memoryview = True,
+                    md5_policy = 'eager')
+            except Cat_Hash_Exception:
+                return ('md5_skip', 0)
+
+            # Make a folder for the dest if needed.
+            dest_path.parent.mkdir(parents = True, exist_ok = True)
+
+            # Write it back out to the destination.
+            with open(dest_path, 'wb') as file:
+                file.write(file_binary)
+            return ('write', len(file_binary))
+
+
+        # Hand the entries to a thread pool; hashing and file io release
+        # the GIL, so these overlap well. Results come back in the
+        # sorted order for printout.
+        with ThreadPoolExecutor(max_workers = num_workers) as executor:
+            for entry, (result, num_bytes) in zip(
+                    unpack_list, executor.map(Unpack_Entry, unpack_list)):
+
+                if result == 'hash_skip':
+                    num_hash_skips += 1
+                elif result == 'md5_skip':
+                    num_md5_skips += 1
+                else:
+                    # Be verbose for now.
+                    num_writes += 1
+                    num_bytes_written += num_bytes
+                    Print('Extracted {}'.format(entry[2]))
+
+    finally:
+        source_reader.Close()
         
     Print('Files written                    : {}'.format(num_writes))
     Print('Files skipped (pattern mismatch) : {}'.format(num_pattern_skips))
     Print('Files skipped (hash match)       : {}'.format(num_hash_skips))
     Print('Files skipped (md5 hash failure) : {}'.format(num_md5_skips))    
 
+    # Throughput summary.
+    duration = max(time() - start_time, 1e-6)
+    Print('Unpack time: {:.3f} s, {:.2f} MB/s, {:.1f} files/s'.format(
+        duration, 
+        num_bytes_written / 1e6 / duration, 
+        num_writes / duration))
     return
 
 
 
+@Utility_Wrapper(uses_paths_from_settings = False)
+def Cat_Compare(
+        original_cat_path,
+        modified_cat_path,
+        include_pattern = None,
+        exclude_pattern = None,
+        diff_output_dir_path = None,
+        verbose = False,
+    ):
+    '''
+    Compare two catalog files, or two folders of catalogs, reporting
+    which files were added, removed, or changed. Only the catalog
+    sizes and hashes are compared, so no dat contents are read.
+    Returns a dict with 'added', 'removed', and 'changed' keys, each
+    holding a sorted list of virtual paths.
+
+    * original_cat_path
+      - Path to the original catalog file, or to a folder.
+      - When a folder given, catalogs are read in X4 priority order
+        according to their expected names.
+    * modified_cat_path
+      - Path to the modified catalog file, or to a folder.
+    * include_pattern
+      - String or list of strings, optional, wildcard patterns for file
+        names to include in the comparison.
+      - Case is ignored.
+    * exclude_pattern
+      - String or list of strings, optional, wildcard patterns for file
+        names to exclude from the comparison.
+    * diff_output_dir_path
+      - Optional path to a folder; if given, diff patches are generated
+        for changed xml files and written here, as with Generate_Diffs.
+      - Only the changed files are read from the dats.
+      - Gzipped ".pck" files are unzipped, and their diffs written under
+        the ".xml" name; other changed files are counted as skipped.
+    * verbose
+      - Bool, if True then every added, removed, and changed path is
+        printed, instead of just counts.
+    '''
+    start_time = time()
+
+    # Pack up the patterns given to always be lists or None.
+    if isinstance(include_pattern, str):
+        include_pattern = [include_pattern]
+    if isinstance(exclude_pattern, str):
+        exclude_pattern = [exclude_pattern]
+
+    # Set up readers and grab their entries.
+    # Readers are closed even on errors, so the dats are not left mapped
+    # (which would lock them on windows).
+    readers = []
+    try:
+        entry_dicts = []
+        for cat_path in [original_cat_path, modified_cat_path]:
+            try:
+                cat_path = Path(cat_path).resolve()
+                assert cat_path.exists()
+            except Exception:
+                raise AssertionError('Error in the source path ({})'.format(cat_path))
+            reader = _Get_Catalog_Reader(cat_path)
+            readers.append(reader)
+            entry_dicts.append({
+                virtual_path : cat_entry
+                for virtual_path, cat_entry in reader.Get_Cat_Entries().items()
+                if _Pattern_Match(virtual_path, include_pattern, exclude_pattern)
+                })
+        original_entries, modified_entries = entry_dicts
+
+        def Entry_Key(cat_entry):
+            '''
+            Returns the (size, hash) used for comparison; empty files have
+            inconsistent hashes in ego cats, so just use their size.
+            '''
+            if cat_entry.num_bytes == 0:
+                return (0, None)
+            return (cat_entry.num_bytes, cat_entry.hash_str)
+
+        results = {
+            'added'   : sorted(modified_entries.keys() - original_entries.keys()),
+            'removed' : sorted(original_entries.keys() - modified_entries.keys()),
+            'changed' : sorted(
+                virtual_path for virtual_path in 
+                original_entries.keys() & modified_entries.keys()
+                if Entry_Key(original_entries[virtual_path]) 
+                != Entry_Key(modified_entries[virtual_path])),
+            }
+
+        if verbose:
+            for key in ['added', 'removed', 'changed']:
+                for virtual_path in results[key]:
+                    Print('{:<8}: {}'.format(key.capitalize(), virtual_path))
+
+        Print('Files added                      : {}'.format(len(results['added'])))
+        Print('Files removed                    : {}'.format(len(results['removed'])))
+        Print('Files changed                    : {}'.format(len(results['changed'])))
+        Print('Compare time: {:.3f} s'.format(time() - start_time))
+
+
+        # Pass changed xml files along to diff generation, reading just
+        # those from the dats. Gzipped pck files are unzipped, and their
+        # diffs written under the xml name.
+        if diff_output_dir_path != None:
+            diff_output_dir_path = Path(diff_output_dir_path).resolve()
+            num_diffs = 0
+            num_diff_skips = 0
+            for virtual_path in results['changed']:
+                is_pck = virtual_path.endswith('.pck')
+                if not (is_pck or virtual_path.endswith('.xml')):
+                    num_diff_skips += 1
+                    continue
+                output_path = Path(modified_entries[virtual_path].cat_path)
+                if is_pck:
+                    output_path = output_path.with_suffix('.xml')
+
+                # Handle errors per file, as Generate_Diffs would.
+                try:
+                    binaries = [reader.Read_Catalog_File(virtual_path, allow_md5_error = True)[1]
+                                for reader in readers]
+                    if is_pck:
+                        binaries = [File_Manager.Source_Reader_Local.Decompress_Pck(x)
+                                    for x in binaries]
+                    Generate_Diff_From_Binaries(
+                        original_binary  = binaries[0],
+                        modified_binary  = binaries[1],
+                        output_file_path = diff_output_dir_path / output_path,
+                        verbose          = verbose,
+                        modified_name    = virtual_path,
+                        )
+                    num_diffs += 1
+                except Exception as ex:
+                    if Settings.developer:
+                        raise ex
+                    num_diff_skips += 1
+                    Print('Skipped diff of {} due to {}: "{}".'.format(
+                        virtual_path, type(ex).__name__, str(ex)))
+            Print('Diff patches written             : {}'.format(num_diffs))
+            Print('Diffs skipped (not xml, errors)  : {}'.format(num_diff_skips))
+
+    finally:
+        for reader in readers:
+            reader.Close()
+    return results
+
+
 @Utility_Wrapper(uses_paths_from_settings = False)
 def Cat_Pack(
         source_dir_path,
@@ -180,6 +363,9 @@ def Cat_Pack(
         exclude_pattern = None,
         generate_sigs = True,
         separate_sigs = False,
+        incremental = False,
+        num_workers = None,
+        gzip_xml = False,
     ):
     '''
     Packs all files in subdirectories of the given directory into a
@@ -209,7 +395,25 @@ def Cat_Pack(
     * separate_sigs
       - Bool, if True then any signatures will be moved to a second
         cat/dat pair suffixed with .sig.
+    * incremental
+      - Bool, if True and the dest catalog already exists, files whose
+        size and modification time match their existing cat entry are
+        copied over from the old dat without being reread or rehashed.
+      - Cat entries record each file's modification time (instead of
+        the packing time) to support this.
+      - The first incremental pack over a catalog made without this
+        option will still repack every file.
+    * num_workers
+      - Int, optional, number of threads used to read and hash files.
+      - Defaults to the python thread pool default, based on cpu count.
+      - Output is identical for any worker count.
+    * gzip_xml
+      - Bool, if True then xml files are gzipped and packed as ".pck"
+        files, which x4 unzips when loading.
+      - Zipped files are always repacked when incremental.
     '''
+    start_time = time()
+
     # Do some error checking on the paths.
     try:
         source_dir_path = Path(source_dir_path)
@@ -247,10 +451,19 @@ def Cat_Pack(
         location = source_dir_path,
         is_extension = True)
 
+    # When incremental, open the existing catalog for comparison.
+    # Note: mmap is avoided, so the dat is not held open when the new
+    #  one replaces it.
+    old_cat_reader = None
+    if incremental and dest_cat_path.exists():
+        old_cat_reader = File_Manager.Cat_Reader.Cat_Reader(
+            dest_cat_path, use_mmap = False)
+
     # Pick out the subfolders to be included.
     subfolder_names = File_Manager.Source_Reader_Local.valid_virtual_path_prefixes
     
     num_writes        = 0
+    num_reuses        = 0
     num_pattern_skips = 0
     num_folder_skips  = 0
 
@@ -267,15 +480,41 @@ def Cat_Pack(
             num_folder_skips += 1
             continue
 
-        # Get the file binary; skip the Read_File function since that
-        #  returns a semi-processed game file (eg. stripping off xml
-        #  headers and such), and just want pure binary here.
-        (file_path, file_binary) = source_reader.Read_Loose_File(virtual_path)
         # Pack into a game_file, expected by the cat_writer.
+        # Skip the Read_File function since that returns a semi-processed
+        #  game file (eg. stripping off xml headers and such), and just
+        #  want pure binary here. The binary is left on disk, and read
+        #  by the cat_writer as it streams out the dat.
         game_file = File_Manager.File_Types.Misc_File(
             virtual_path = virtual_path,
-            binary = file_binary )
-        cat_writer.Add_File(game_file)
+            file_source_path = abs_path )
+
+        if not incremental:
+            cat_writer.Add_File(game_file)
+        else:
+            # Record the file's mtime, and check if the old entry
+            # still matches it.
+            stat = abs_path.stat()
+            timestamp = int(stat.st_mtime)
+            reuse_entry = None
+            # Zipped entries don't match their loose file size, so
+            # can't be compared.
+            if gzip_xml and virtual_path.endswith('.xml'):
+                pass
+            elif old_cat_reader != None:
+                cat_entry = old_cat_reader.Get_Cat_Entries().get(virtual_path)
+                if (cat_entry != None 
+                and cat_entry.num_bytes == stat.st_size
+                and cat_entry.timestamp == timestamp):
+                    reuse_entry = (old_cat_reader, cat_entry)
+
+            cat_writer.Add_File(game_file, 
+                                timestamp = timestamp, 
+                                reuse_entry = reuse_entry)
+            if reuse_entry != None:
+                num_writes += 1
+                num_reuses += 1
+                continue
         
         # Be verbose for now.
         num_writes += 1
@@ -288,14 +527,51 @@ def Cat_Pack(
         cat_writer.Write(
             generate_sigs = generate_sigs,
             separate_sigs = separate_sigs,
+            num_workers   = num_workers,
+            gzip_xml      = gzip_xml,
             )
     
     Print('Files written                    : {}'.format(num_writes))
+    if incremental:
+        Print('Files reused from prior catalog  : {}'.format(num_reuses))
     Print('Files skipped (pattern mismatch) : {}'.format(num_pattern_skips))
     Print('Files skipped (not x4 subdir)    : {}'.format(num_folder_skips))
+    Print('Pack time: {:.3f} s'.format(time() - start_time))
     return
 
 
+def _Get_Catalog_Reader(source_cat_path):
+    '''
+    Returns a Location_Source_Reader for a single catalog file, or for
+    all catalogs in a folder.
+    '''
+    # Sourcing behavior depends on if a folder or file given.
+    if source_cat_path.is_dir():
+
+        # Set up a reader for the source location.
+        # If this is an extension, it needs some more annotation; can
+        # test for the content.xml at the path.
+        extension_summary = None
+        content_xml_path = source_cat_path / 'content.xml'
+        if content_xml_path.exists():
+            extension_summary = File_Manager.Extension_Finder.Extension_Summary(content_xml_path)
+
+        source_reader = File_Manager.Source_Reader.Location_Source_Reader(
+            location = source_cat_path,
+            extension_summary = extension_summary)
+
+        # Print how many catalogs were found.
+        Print(('{} catalog files found using standard naming convention.'
+               ).format(len(source_reader.catalog_file_dict)))
+    else:
+        # Set up an empty reader.
+        source_reader = File_Manager.Source_Reader.Location_Source_Reader(
+            location = None)
+        # Manually add the cat path to it.
+        source_reader.Add_Catalog(source_cat_path)
+    return source_reader
+
+
 def _Pattern_Match(
         name, 
         include_patterns = None, 
@@ -11,6 +11,7 @@ from Framework import Plugin_Log
 from Framework import Print
 from Framework.File_Manager import XML_File
 from Framework.File_Manager.Cat_Reader import Get_Hash_String
+from Framework.File_Manager.Dir_Walker import Walk_Files
 from Framework.File_Manager.XML_Diff import Print as XML_Print
 
 # TODO: merge this in with the Game_File system if run as part of
@@ -52,7 +53,9 @@ def Generate_Diffs(
     # Make dicts for ease of use, keyed by relative path from the
     # base folder.
     #original_paths = {x.relative_to(original_dir_path) : x for x in original_dir_path.glob('**/*.xml')}
-    modified_paths = {x.relative_to(modified_dir_path) : x for x in modified_dir_path.glob('**/*.xml')}
+    modified_paths = {Path(x.rel_path) : modified_dir_path / x.rel_path 
+                      for x in Walk_Files(modified_dir_path)
+                      if x.rel_path.endswith('.xml')}
 
     # Pair off the modified files with originals by name.
     # If an original is not found, error.
@@ -117,6 +120,36 @@ def Generate_Diff(
     or  output_file_path == modified_file_path):
         raise Exception('Path conflict error')
 
+    Generate_Diff_From_Binaries(
+        original_binary  = original_file_path.read_bytes(),
+        modified_binary  = modified_file_path.read_bytes(),
+        output_file_path = output_file_path,
+        skip_unchanged   = skip_unchanged,
+        verbose          = verbose,
+        modified_name    = modified_file_path,
+        )
+    return
+
+
+def Generate_Diff_From_Binaries(
+        original_binary,
+        modified_binary,
+        output_file_path,
+        skip_unchanged = False,
+        verbose = False,
+        modified_name = None,
+    ):
+    '''
+    Generate a diff patch from the contents of two xml files, given
+    as binaries, eg. as read from catalogs. See Generate_Diff for
+    most arguments.
+
+    * modified_name
+      - Optional name of the modified file, for messages.
+    '''
+    if modified_name == None:
+        modified_name = output_file_path.name
+
     # List of messages to print out.
     messages = []
     def Print_Messages():
@@ -135,7 +168,7 @@ def Generate_Diff(
         # Virtual path doesn't matter, though can be useful for debug,
         # so try to fill in something.
         virtual_path = output_file_path.name,
-        binary = original_file_path.read_bytes(),
+        binary = original_binary,
         # Flag as the source; this will trigger diff patch generation later.
         from_source = True,
         )
@@ -148,7 +181,7 @@ def Generate_Diff(
     # for consistent loading format.
     temp_game_file = XML_File(
         virtual_path = '',
-        binary = modified_file_path.read_bytes(),
+        binary = modified_binary,
         )
     # Go ahead and give node ids. Not too important, but might do some
     # misc formatting, eg. removing tails.
@@ -169,7 +202,7 @@ def Generate_Diff(
     # If files match, check arg for skipping the file.
     if not changed and skip_unchanged:
 
-        messages.append('File unchanged: {}'.format(modified_file_path))
+        messages.append('File unchanged: {}'.format(modified_name))
         # Check if an output file already exists and delete it.
         if output_file_path.exists():
             output_file_path.unlink()
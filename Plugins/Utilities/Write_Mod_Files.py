@@ -231,10 +231,7 @@ def Update_Content_XML_Dependencies():
     # Note: multiple dependencies may share the same ID if those extensions
     #  have conflicting ids; don't worry about that here.
     source_extension_ids = set()
-    for file_name, game_file in File_System.game_file_dict.items():
-        if not game_file.modified:
-            continue
-        
+    for game_file in File_System.Get_Modified_Files():
         for ext_name in game_file.source_extension_names:
             # Translate extension names to ids.
             ext_id = File_System.source_reader.extension_source_readers[
@@ -4,8 +4,10 @@ This package holds semi-standalone utilities for the user.
 
 from .Catalog import Cat_Unpack
 from .Catalog import Cat_Pack
+from .Catalog import Cat_Compare
 from .Generate_Diffs import Generate_Diff
 from .Generate_Diffs import Generate_Diffs
 from .Write_Mod_Files import *
 from .Check_Extension import Check_Extension
-from .Check_Extension import Check_All_Extensions
\ No newline at end of file
+from .Check_Extension import Check_All_Extensions
+from .Cache import Clean_Patched_XML_Cache
\ No newline at end of file
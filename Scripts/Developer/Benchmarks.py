@@ -0,0 +1,492 @@
+'''
+Timing checks for framework internals, using synthetic data so that
+no x4 installation is needed.
+Note: the newest benchmarks tend to be near the top.
+'''
+
+import sys
+import random
+from pathlib import Path
+from time import time
+from types import SimpleNamespace
+from collections import OrderedDict
+
+# Set up the customizer import path.
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+import Framework
+from Framework.File_Manager.Source_Reader import Source_Reader_class
+
+# For all benchmarks to run.
+run_all = 1
+
+
+def Get_RSS_MB():
+    '''
+    Returns the resident memory of this process in MB, or None if it
+    cannot be measured here.
+    '''
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as file:
+            import resource
+            return int(file.read().split()[1]) * resource.getpagesize() / 2**20
+    except Exception:
+        return None
+
+
+# Edit sessions on a synthetic 60k ware file, through Get_Root and
+# Update_Root versus Edit_Root. The first session of each includes the
+# initial copy of the patched root.
+if 0 or run_all:
+    from lxml import etree as ET
+    from Framework.File_Manager.File_Types import XML_File
+
+    def Make_Wares_File():
+        '''
+        Returns a new initialized XML_File holding 60k wares.
+        '''
+        xml_root = ET.Element('wares')
+        for i in range(60000):
+            ware = ET.SubElement(xml_root, 'ware', id = 'ware_{}'.format(i))
+            ET.SubElement(ware, 'price', min = '90', average = '100', max = '110')
+            production = ET.SubElement(ware, 'production', time = '10', amount = '5')
+            ET.SubElement(ET.SubElement(production, 'primary'), 'ware', 
+                          ware = 'energycells', amount = '20')
+        game_file = XML_File(virtual_path = 'libraries/wares.xml', xml_root = xml_root)
+        game_file.Delayed_Init()
+        return game_file
+
+    def Edit_Prices(xml_root, session):
+        '''
+        Edits a few prices, as a typical transform might.
+        '''
+        for ware in xml_root.findall('./ware')[session :: 1000]:
+            ware.find('./price').set('average', str(session))
+        return
+
+    results = []
+    for label in ['Get_Root/Update_Root', 'Edit_Root']:
+        game_file = Make_Wares_File()
+        times = []
+        for session in range(5):
+            start = time()
+            if label == 'Edit_Root':
+                with game_file.Edit_Root() as xml_root:
+                    Edit_Prices(xml_root, session)
+            else:
+                xml_root = game_file.Get_Root()
+                Edit_Prices(xml_root, session)
+                game_file.Update_Root(xml_root)
+            times.append(time() - start)
+        print('Wares edit sessions x5, {}: first {:.3f} s, later {:.3f} s each'.format(
+            label, times[0], sum(times[1:]) / 4))
+        # Compare without node ids, which differ between the files.
+        xml_root = game_file.Get_Root()
+        for node in xml_root.iter():
+            node.tail = None
+        results.append(ET.tostring(xml_root))
+    assert results[0] == results[1]
+
+
+def Make_Text_Binary(language_id, num_pages = 1500, num_ids = 40):
+    '''
+    Returns the binary of a synthetic t file for the language, with
+    some nested references and comments.
+    '''
+    lines = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<language id="{}">'.format(language_id)]
+    for page in range(num_pages):
+        lines.append('<page id="{}" title="Page {}">'.format(20000 + page, page))
+        for id in range(num_ids):
+            text = 'Text {} {} {}'.format(language_id, page, id)
+            if id % 10 == 9:
+                text = '{{{},{}}} (note)'.format(20000 + page, id - 1)
+            lines.append('<t id="{}">{}</t>'.format(id, text))
+        lines.append('</page>')
+        if page % 100 == 0:
+            lines.append('<!-- page group {} -->'.format(page))
+    lines.append('</language>')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def Text_Lookup_RSS(use_tables, language_ids, terms):
+    '''
+    Reads the terms from a synthetic t file for each language, through
+    a Text_Table or a parsed XML_Text_File, returning a tuple of (time
+    for the first file, time for all files, rss in MB at start and after).
+    Run in a fresh process, since freed memory is not always returned
+    to the os.
+    '''
+    from Framework.File_Manager.File_Types import XML_Text_File
+    from Framework.File_Manager.Text_Table import Text_Table
+    binaries = [Make_Text_Binary(x) for x in language_ids]
+    start_rss = Get_RSS_MB()
+    tables = []
+    start = time()
+    for language_id, binary in zip(language_ids, binaries):
+        if use_tables:
+            table = Text_Table(binary)
+        else:
+            table = XML_Text_File(
+                binary = binary,
+                virtual_path = 't/0001-l{:03d}.xml'.format(language_id))
+            table.Delayed_Init()
+        for page, id in terms:
+            table.Read(page = page, id = id)
+        tables.append(table)
+        if len(tables) == 1:
+            first_time = time() - start
+    return (first_time, time() - start, start_rss, Get_RSS_MB())
+
+
+# Text lookups of 500 random entries from each of 12 synthetic languages,
+# through page-at-a-time Text_Tables versus fully parsed t files.
+if (0 or run_all) and __name__ == '__main__':
+    from multiprocessing import Pool
+
+    if Get_RSS_MB() == None:
+        print('Skipping text lookup benchmark; rss not available.')
+    else:
+        rand = random.Random(0)
+        # Lookups tend to cluster in a few pages (eg. ware names).
+        pages = rand.sample(range(20000, 21500), 20)
+        terms = [(rand.choice(pages), rand.randrange(40)) for _ in range(500)]
+        language_ids = [7, 33, 34, 39, 44, 48, 49, 55, 81, 82, 86, 88]
+        for label, use_tables in [('parsed files', False), ('Text_Tables', True)]:
+            with Pool(1) as pool:
+                first_time, all_time, start_rss, end_rss = pool.apply(
+                    Text_Lookup_RSS, (use_tables, language_ids, terms))
+            print('Text lookups x{}, {}: first language {:.3f} s, all {} languages'
+                  ' {:.3f} s, rss +{:.0f} MB'.format(
+                      len(terms), label, first_time, len(language_ids), 
+                      all_time, end_rss - start_rss))
+
+
+def Scan_Wares_RSS(use_query):
+    '''
+    Collects the ids of all container wares, either through Query_XML
+    or a full Load_File, returning a tuple of (number found, seconds,
+    rss in MB at start and after).
+    Run in a fresh process, since freed memory is not always returned
+    to the os.
+    '''
+    from Framework import File_System
+    File_System.Delayed_Init()
+    start_rss = Get_RSS_MB()
+    start = time()
+    if use_query:
+        ids = [x.get('id') for x in File_System.Query_XML(
+                'libraries/wares.xml', 'ware', {'transport' : 'container'})]
+    else:
+        ids = [x.get('id') for x in File_System.Load_File(
+                'libraries/wares.xml').Get_Root_Readonly().xpath(
+                    '//ware[@transport="container"]')]
+    return (len(ids), time() - start, start_rss, Get_RSS_MB())
+
+
+# Read-only scan of wares.xml through a streamed query, versus a full
+# load. This uses the x4 paths from the saved settings, and is skipped
+# if they are not set up.
+if (0 or run_all) and __name__ == '__main__':
+    from multiprocessing import Pool
+    from Framework import Settings
+
+    if not Settings.Paths_Are_Valid():
+        print('Skipping wares query benchmark; x4 paths not set up.')
+    elif Get_RSS_MB() == None:
+        print('Skipping wares query benchmark; rss not available.')
+    else:
+        results = []
+        for label, use_query in [('Load_File', False), ('Query_XML', True)]:
+            with Pool(1) as pool:
+                num_found, scan_time, start_rss, end_rss = pool.apply(
+                    Scan_Wares_RSS, (use_query,))
+            print('Container wares ({} found), {}: {:.3f} s, rss +{:.0f} MB'.format(
+                num_found, label, scan_time, end_rss - start_rss))
+            results.append(num_found)
+        assert results[0] == results[1]
+
+
+# Parse throughput of base md, aiscripts, and libraries xml, with a new
+# parser per file, the pooled parser, and the pooled fast parser.
+# This uses the x4 paths from the saved settings, and is skipped if
+# they are not set up.
+if (0 or run_all) and __name__ == '__main__':
+    from lxml import etree as ET
+    from Framework import Settings, File_System
+    from Framework.File_Manager.File_Types import Get_XML_Parser
+
+    if not Settings.Paths_Are_Valid():
+        print('Skipping xml parse benchmark; x4 paths not set up.')
+    else:
+        # Read all binaries first, so only parsing is timed.
+        reader = File_System.Get_Source_Reader().base_x4_source_reader
+        binaries = []
+        for pattern in ['md/*.xml', 'aiscripts/*.xml', 'libraries/*.xml']:
+            for virtual_path in File_System.Gen_All_Virtual_Paths(pattern):
+                _, binary = reader.Read_Catalog_File(virtual_path)
+                if binary == None:
+                    _, binary = reader.Read_Loose_File(virtual_path)
+                if binary:
+                    binaries.append(bytes(binary))
+        num_mb = sum(len(x) for x in binaries) / 2**20
+
+        for label, fast, Get_Parser in [
+                ('new parser per file', False, 
+                    lambda: ET.XMLParser(remove_blank_text = True)),
+                ('pooled parser'      , False, Get_XML_Parser),
+                ('pooled fast parser' , True , Get_XML_Parser),
+            ]:
+            Settings.fast_xml_parsing = fast
+            start = time()
+            for binary in binaries:
+                ET.XML(binary, parser = Get_Parser())
+            parse_time = time() - start
+            print('Parsing {} files ({:.1f} MB), {}: {:.3f} s, {:.1f} MB/s'.format(
+                len(binaries), num_mb, label, parse_time, num_mb / parse_time))
+        Settings.fast_xml_parsing = False
+        File_System.Reset()
+
+
+# Reset_File and modified or extension file lookups with 50k loaded
+# files, against the prior linear scans.
+if 0 or run_all:
+    from lxml import etree as ET
+    from Framework import File_System
+    from Framework.File_Manager.File_Types import XML_File
+
+    def Linear_Reset_File(virtual_path):
+        '''
+        The prior Reset_File, kept for comparison.
+        '''
+        game_file = File_System.game_file_dict.pop(virtual_path)
+        for key, subdict in File_System.asset_class_dict.items():
+            for key2, sublist in subdict.items():
+                if game_file in sublist:
+                    sublist.remove(game_file)
+        for key, value in File_System.asset_name_dict.items():
+            if value is game_file:
+                File_System.asset_name_dict.pop(key)
+                break
+
+    File_System.Reset()
+    start = time()
+    for i in range(50000):
+        name = 'macro_{:05d}'.format(i)
+        game_file = XML_File(
+            virtual_path = 'assets/{}.xml'.format(name),
+            xml_root = ET.fromstring(
+                '<macros><macro name="{}" class="class_{}"/></macros>'.format(
+                    name, i % 50)),
+            extension_name = 'ext_{}'.format(i % 20) if i % 4 == 0 else None,
+            )
+        game_file.Delayed_Init()
+        if i % 100 == 0:
+            game_file.modified = True
+        File_System.Add_File(game_file)
+    print('Adding 50k files: {:.3f} s'.format(time() - start))
+
+    paths = list(File_System.game_file_dict)
+    for label, func, reset_paths in [
+            ('linear scan', Linear_Reset_File, paths[1::100]),
+            ('indexed'    , File_System.Reset_File, paths[2::100]),
+        ]:
+        start = time()
+        for virtual_path in reset_paths:
+            func(virtual_path)
+        print('Reset_File x{} ({}): {:.3f} s'.format(
+            len(reset_paths), label, time() - start))
+    # Both should clear the asset lookups.
+    assert not any(x.virtual_path in paths[1::100] + paths[2::100]
+                   for x in File_System.asset_name_dict.values())
+
+    start = time()
+    for _ in range(100):
+        expected = [x for x in File_System.game_file_dict.values() if x.modified]
+    linear_time = time() - start
+    start = time()
+    for _ in range(100):
+        found = File_System.Get_Modified_Files()
+    print('Modified files x100: linear scan {:.3f} s, indexed {:.3f} s'.format(
+        linear_time, time() - start))
+    assert found == expected
+
+    start = time()
+    for _ in range(100):
+        expected = [x for x in File_System.game_file_dict.values() 
+                    if 'ext_4' in x.source_extension_names]
+    linear_time = time() - start
+    start = time()
+    for _ in range(100):
+        found = File_System.Get_Extension_Files('ext_4')
+    print('Extension files x100: linear scan {:.3f} s, indexed {:.3f} s'.format(
+        linear_time, time() - start))
+    assert found and found == expected
+    File_System.Reset()
+
+
+def Load_All_XML_RSS(compress_xml_roots):
+    '''
+    Loads all xml files, returning a tuple of (number of files, and rss
+    in MB at start, after loading, and after parsing all original roots).
+    Having every original root parsed matches the memory use from when
+    they were always kept parsed.
+    Run in a fresh process, since freed memory is not always returned
+    to the os.
+    '''
+    from Framework import Settings, File_System
+    Settings(use_patched_xml_cache = False,
+             compress_xml_roots = compress_xml_roots)
+    File_System.Delayed_Init()
+    start_rss = Get_RSS_MB()
+    game_files = File_System.Load_Files('*.xml')
+    load_rss = Get_RSS_MB()
+    for game_file in game_files:
+        game_file.original_root
+    return (len(game_files), start_rss, load_rss, Get_RSS_MB())
+
+
+# Memory use of a full xml load, with lazily parsed original roots
+# (compressed or not) versus all original roots parsed.
+# This uses the x4 paths from the saved settings, and is skipped if
+# they are not set up.
+if (0 or run_all) and __name__ == '__main__':
+    from multiprocessing import Pool
+    from Framework import Settings
+
+    if not Settings.Paths_Are_Valid():
+        print('Skipping xml memory benchmark; x4 paths not set up.')
+    elif Get_RSS_MB() == None:
+        print('Skipping xml memory benchmark; rss not available.')
+    else:
+        for compress in [False, True]:
+            start = time()
+            with Pool(1) as pool:
+                num_files, start_rss, load_rss, parsed_rss = pool.apply(
+                    Load_All_XML_RSS, (compress,))
+            print('Load_Files *.xml ({} files), compress_xml_roots {}: {:.3f} s,'
+                  ' rss +{:.0f} MB, with original roots parsed +{:.0f} MB'.format(
+                      num_files, compress, time() - start, 
+                      load_rss - start_rss, parsed_rss - start_rss))
+
+
+# Serial versus parallel loading of all md scripts.
+# This uses the x4 paths from the saved settings, and is skipped if
+# they are not set up. The main check is needed since workers import
+# this module.
+if (0 or run_all) and __name__ == '__main__':
+    from lxml import etree as ET
+    from Framework import Settings, File_System
+
+    # Patch every run, so the first load does not warm a cache for
+    # the second.
+    Settings(use_patched_xml_cache = False)
+
+    if not Settings.Paths_Are_Valid():
+        print('Skipping md load benchmark; x4 paths not set up.')
+    else:
+        results = []
+        for num_workers in [1, None]:
+            File_System.Reset()
+            start = time()
+            game_files = File_System.Load_Files('md/*.xml', num_workers = num_workers)
+            print('Load_Files md/*.xml ({} files), workers {}: {:.3f} s'.format(
+                len(game_files), num_workers or 'auto', time() - start))
+            # Compare contents with node ids taken relative to the first,
+            # since ids keep counting across loads.
+            first_id = int(game_files[0].Get_Root_Readonly().tail)
+            contents = []
+            for game_file in game_files:
+                root = game_file.Get_Root()
+                for node in root.iter():
+                    node.tail = str(int(node.tail) - first_id)
+                contents.append((game_file.virtual_path, ET.tostring(root)))
+            results.append(contents)
+        assert results[0] == results[1]
+        File_System.Reset()
+
+
+# Extension sorting with 500 synthetic extensions and random
+# dependency graphs, checked against the original brute force sort.
+if 0 or run_all:
+
+    def Make_Readers(num_extensions, seed):
+        '''
+        Returns a list of stand-in extension readers with random soft
+        and hard dependencies. Hard dependencies are acyclic; soft
+        dependencies may form cycles.
+        '''
+        rand = random.Random(seed)
+        names = ['ext_{:04d}'.format(i) for i in range(num_extensions)]
+        # Hard deps only point back in a shuffled order, to stay acyclic.
+        dep_order = list(names)
+        rand.shuffle(dep_order)
+        readers = []
+        for i, name in enumerate(dep_order):
+            readers.append(SimpleNamespace(
+                extension_name = name,
+                extension_summary = SimpleNamespace(
+                    ext_id = 'id_' + name,
+                    hard_dependencies = ['id_' + x for x in
+                        rand.sample(dep_order[:i], min(i, rand.randint(0,3)))],
+                    soft_dependencies = ['id_' + x for x in
+                        rand.sample(names, rand.randint(0,3))],
+                    ),
+                Get_Source_Paths = lambda **kwargs: {},
+                ))
+        return readers
+
+    def Brute_Force_Order(readers, priorities):
+        '''
+        The prior Sort_Extensions loop, kept for comparison.
+        '''
+        id_name_dict = {x.extension_summary.ext_id : x.extension_name
+                        for x in readers}
+        deps = {x.extension_name : {
+                    dep_type : [id_name_dict[y] for y in getattr(
+                        x.extension_summary, dep_type + '_dependencies')]
+                    for dep_type in ['soft','hard']}
+                for x in readers}
+        unsorted_names = [x.extension_name for x in readers]
+        sorted_names = OrderedDict()
+        while unsorted_names:
+            valid = [x for x in unsorted_names
+                     if all(y in sorted_names
+                            for y in deps[x]['hard'] + deps[x]['soft'])]
+            if not valid:
+                valid = [x for x in unsorted_names
+                         if all(y in sorted_names for y in deps[x]['hard'])]
+            pick = sorted(valid, key = lambda x: (priorities.get(x,0), x))[0]
+            sorted_names[pick] = None
+            unsorted_names.remove(pick)
+        return list(sorted_names)
+
+    for seed in range(5):
+        readers = Make_Readers(500, seed)
+        source_reader = Source_Reader_class()
+        source_reader.extension_source_readers = OrderedDict(
+            (x.extension_name, x) for x in readers)
+
+        # Check each priority pass, as used by Check_Extension.
+        for priority in [0, -1, 1]:
+            priorities = {readers[0].extension_name : priority}
+
+            start = time()
+            expected = Brute_Force_Order(readers, priorities)
+            brute_time = time() - start
+
+            start = time()
+            source_reader.Sort_Extensions(priorities = dict(priorities))
+            sort_time = time() - start
+
+            assert list(source_reader.extension_source_readers) == expected
+            print('Extension sort (seed {}, priority {:2}): brute force {:.3f} s,'
+                  ' Sort_Extensions {:.3f} s'.format(
+                      seed, priority, brute_time, sort_time))
+
+
+print('Benchmarks done')
@@ -25,6 +25,58 @@ test_all = 0
 if 0:
     GUI.Start_GUI()
 
+# Check that a parallel load works while background md5 checks are
+# still pending, matching a serial load. Forked workers previously hung
+# waiting on the inherited checks. The main check is needed since
+# workers may import this module.
+if (0 or test_all) and __name__ == '__main__':
+    Settings(cat_md5_verification = 'background', use_patched_xml_cache = False)
+    results = []
+    for num_workers in [1, 4]:
+        Framework.File_System.Reset()
+        # Start some background checks ahead of the parallel load.
+        Framework.File_System.Load_File('libraries/wares.xml')
+        game_files = Framework.File_System.Load_Files(
+            'md/*.xml', num_workers = num_workers)
+        results.append([(x.virtual_path, len(list(x.Get_Root_Readonly().iter())))
+                        for x in game_files])
+    assert results[0] == results[1]
+    Framework.File_System.Reset()
+    Settings(cat_md5_verification = 'eager', use_patched_xml_cache = True)
+
+# Check that the virtual path index matches fnmatch on pattern queries.
+if 0 or test_all:
+    import fnmatch, random
+    all_paths = set(Framework.File_System.Gen_All_Virtual_Paths())
+    index = Framework.File_Manager.Path_Index.Virtual_Path_Index(all_paths)
+    patterns = ['*', 'md/*.xml', 'assets/units/**/macros/*.xml', 
+                'libraries/wares.xml', 't/00??-l044.xml', '*/[ab]*.xml']
+    # Add random patterns built from pieces of real paths.
+    pieces = ['*', '?', '/', '[a-m]', '.xml', 'assets', 'md', 'macros', 's']
+    for _ in range(1000):
+        patterns.append(''.join(random.choice(pieces) 
+                                for _ in range(random.randint(1,6))))
+    for pattern in patterns:
+        assert (sorted(index.Filter(pattern)) 
+                == sorted(fnmatch.filter(all_paths, pattern))), pattern
+
+# Check that parallel catalog writing matches the serial output.
+if 0 or test_all:
+    game_files = Framework.File_System.Load_Files('libraries/*.xml')
+    outputs = []
+    for num_workers in [1, 8]:
+        cat_path = (this_dir / '../private/test' 
+                    / 'cat_write_{}'.format(num_workers) / 'ext_01.cat')
+        cat_path.parent.mkdir(parents = True, exist_ok = True)
+        cat_writer = Framework.File_Manager.Cat_Writer.Cat_Writer(cat_path)
+        # Fixed timestamps, so runs can be compared.
+        for game_file in game_files:
+            cat_writer.Add_File(game_file, timestamp = 0)
+        cat_writer.Write(num_workers = num_workers)
+        outputs.append((cat_path.read_bytes(), 
+                        cat_path.with_suffix('.dat').read_bytes()))
+    assert outputs[0] == outputs[1]
+
 # Test sector resizing.
 if 0 or test_all:
     Scale_Sector_Size(